@@ -3,5 +3,6 @@ API 路由包。
 
 在这里集中组织各个领域的路由模块，例如：
 - app.api.routes.models
+- app.api.routes.metrics
 """
 
@@ -0,0 +1,60 @@
+"""
+HTTP 请求指标：按路由模板、模型 ID 和状态码计数并记录耗时。
+
+使用纯 ASGI 中间件而不是 BaseHTTPMiddleware，不包装响应体，SSE 流的转发路径不受影响；
+流式响应的耗时到响应体发送完毕为止。
+model_id 标签只取模型注册表中存在的模型，其余（不存在的 ID、未开启注册表）归为 other，避免任意路径参数撑大标签集合。
+"""
+import time
+
+from app.models.registry import model_registry
+from app.services.metrics import counter, histogram
+
+HTTP_REQUESTS = counter(
+    "http_requests_total",
+    "HTTP 请求数（按路由模板，带 model_id 的路由按模型区分）",
+    ("method", "route", "model_id", "status"),
+)
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds",
+    "HTTP 请求从收到到响应发送完毕的耗时",
+    ("method", "route"),
+)
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 路由匹配后 FastAPI 会把 route / path_params 写回 scope；未匹配的请求归为一类，避免标签数量失控
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            model_id = _model_label(scope.get("path_params")) if route is not None else ""
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method, path, model_id, str(status))
+            HTTP_REQUEST_SECONDS.observe(method, path, value=time.perf_counter() - start)
+
+
+def _model_label(path_params) -> str:
+    model_id = (path_params or {}).get("model_id")
+    if not model_id:
+        return ""
+    _, model = model_registry.lookup(model_id)
+    return model_id if model is not None else "other"
@@ -1,5 +1,4 @@
 import httpx
-from pathlib import Path
 from fastapi import APIRouter, HTTPException, Body, Request, Query
 
 from app.models.model import (
@@ -7,61 +6,81 @@ from app.models.model import (
     ModelUpdateRequest,
     ModelGetRequest,
     ChatRequest,
-    list_models,
-    get_model_by_id,
-    get_model_by_name,
-    exists_model_with_name_excluding,
-    create_model_entry,
-    save_model,
-    delete_model_entry,
+    EmbedRequest,
+    alist_models_page,
+    acount_models,
+    aget_model_by_id,
+    aget_model_cached,
+    aget_model_by_name,
+    aexists_model_with_name_excluding,
+    acreate_model_entry,
+    asave_model,
+    adelete_model_entry,
 )
-from app.models.response import APIResponse, success, error
-from app.services.chat import stream_to_client, call_model_once
+from app.models.response import APIResponse, APIJSONResponse, success, error
+from app.services.chat import build_messages, stream_to_client, call_model_once, resume_stream
+from app.services.chat_jobs import get_chat_jobs, ChatJobsFull, ChatJobNotStreaming
+from app.services.embedding import embed
+from app.services.limiter import ModelOverloaded
+from app.services.ratelimit import get_rate_limiter, estimate_tokens, RateLimited
 
 router = APIRouter(prefix="/api/v1/models", tags=["models"])
 
-PROMPT_PATH = Path(__file__).resolve().parents[2] / "prompts" / "system_prompt.txt"
-SYSTEM_PROMPT = PROMPT_PATH.read_text(encoding="utf-8").strip()
+
+def _too_many(msg: str, retry_after: int) -> APIJSONResponse:
+    """限流或并发已满：返回真实的 429 状态码，便于网关和客户端按 Retry-After 退避。"""
+    return error(429, msg, status_code=429, headers={"Retry-After": str(retry_after)})
+
+
+def _check_api_key(model) -> APIJSONResponse | None:
+    # 与 Go 一致：API Key 校验
+    api_key = (model.api_key or "").strip()
+    if not api_key:
+        return error(500, "API Key 为空")
+    if any(c in api_key for c in "\r\n\t "):
+        return error(500, "API Key 包含非法字符")
+    return None
 
 
 @router.post("/create", response_model=APIResponse)
-async def create_model(req: ModelCreateRequest) -> APIResponse:
-    if get_model_by_name(req.name) is not None:
+async def create_model(req: ModelCreateRequest) -> APIJSONResponse:
+    if await aget_model_by_name(req.name) is not None:
         return error(409, "模型名称已存在")
-    model = create_model_entry(req)
+    model = await acreate_model_entry(req)
     return success(model, "成功创建模型")
 
 
 async def _do_get_models(
         req: ModelGetRequest,
-) -> APIResponse:
+) -> APIJSONResponse:
     """获取模型，支持单个查询或列表查询"""
     # 如果传了 model_id，查询单个模型
     if req.model_id:
-        model = get_model_by_id(req.model_id)
+        model = await aget_model_by_id(req.model_id)
         if not model:
             return error(404, "模型不存在")
         return success(model, "查询成功")
 
-    # 否则查询列表
-    all_models = list_models()
-    total = len(all_models)
-    start = (req.page - 1) * req.page_size
-    end = start + req.page_size
-    page_models = all_models[start:end]
+    # 否则查询列表：分页下推到数据库，传 cursor 时走 keyset 分页
+    try:
+        page_models, next_cursor = await alist_models_page(req.page, req.page_size, req.cursor)
+    except ValueError as e:
+        return error(400, str(e))
+    total = await acount_models()
     return success(
         {
             "list": page_models,
             "total": total,
             "page": req.page,
             "page_size": req.page_size,
+            "next_cursor": next_cursor,
         },
         "查询模型列表成功",
     )
 
 
 @router.post("/get", response_model=APIResponse)
-async def get_models_post(req: ModelGetRequest) -> APIResponse:
+async def get_models_post(req: ModelGetRequest) -> APIJSONResponse:
     """POST 方式获取模型"""
     return await _do_get_models(req)
 
@@ -71,30 +90,31 @@ async def get_models_get(
         model_id: str | None = Query(None),
         page: int = Query(1, ge=1),
         page_size: int = Query(10, ge=1),
-) -> APIResponse:
+        cursor: str | None = Query(None),
+) -> APIJSONResponse:
     """GET 方式获取模型"""
-    req = ModelGetRequest(model_id=model_id, page=page, page_size=page_size)
+    req = ModelGetRequest(model_id=model_id, page=page, page_size=page_size, cursor=cursor)
     return await _do_get_models(req)
 
 
 @router.put("/{model_id}", response_model=APIResponse)
-async def update_model(model_id: str, req: ModelUpdateRequest) -> APIResponse:
-    model = get_model_by_id(model_id)
+async def update_model(model_id: str, req: ModelUpdateRequest) -> APIJSONResponse:
+    model = await aget_model_by_id(model_id)
     if not model:
         return error(404, "模型不存在")
 
-    if req.name and req.name != model.name and exists_model_with_name_excluding(req.name, model_id):
+    if req.name and req.name != model.name and await aexists_model_with_name_excluding(req.name, model_id):
         return error(409, "模型名称已存在")
 
     update_data = req.model_dump(exclude_unset=True)
     updated = model.model_copy(update=update_data)
-    save_model(updated)
+    await asave_model(updated)
     return success(updated, "成功更新模型")
 
 
 @router.delete("/{model_id}", response_model=APIResponse)
-async def delete_model(model_id: str) -> APIResponse:
-    model = delete_model_entry(model_id)
+async def delete_model(model_id: str) -> APIJSONResponse:
+    model = await adelete_model_entry(model_id)
     if not model:
         return error(404, "模型不存在")
     return success(model, "成功删除模型")
@@ -106,44 +126,135 @@ async def chat_with_model(
         request: Request,
         req: ChatRequest = Body(...),
 ):
-    model = get_model_by_id(model_id)
+    model = await aget_model_cached(model_id)
     if not model:
         return error(404, "模型不存在")
 
-    # 与 Go 一致：API Key 校验
-    api_key = (model.api_key or "").strip()
-    if not api_key:
-        return error(500, "API Key 为空")
-    if any(c in api_key for c in "\r\n\t "):
-        return error(500, "API Key 包含非法字符")
+    invalid = _check_api_key(model)
+    if invalid is not None:
+        return invalid
 
-    if req.messages:
-        messages = [m.model_dump() for m in req.messages if m.content]
-    elif req.prompt:
-        messages = [
-            {
-                "role": "user",
-                "content": req.prompt,
-            }
-        ]
-    else:
-        return error(400, "prompt 或 messages 不能为空")
+    stream = request.query_params.get("stream") == "1"
+    # mode=async：立即返回 job_id，之后通过 /jobs/{job_id} 查询结果或订阅流式输出
+    async_mode = request.query_params.get("mode") == "async"
+    # 断线重连：生成仍在保留期内时直接从断点继续，不计入限流也不再请求上游
+    last_event_id = request.headers.get("last-event-id")
+    if stream and last_event_id and not async_mode:
+        resumed = resume_stream(model, last_event_id, request)
+        if resumed is not None:
+            return resumed
 
-    has_system = any(m.get("role") == "system" for m in messages)
-    if not has_system:
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}] + messages
+    messages = build_messages(req.prompt, [m.model_dump() for m in req.messages] if req.messages else None)
+    if messages is None:
+        return error(400, "prompt 或 messages 不能为空")
 
     payload = {
         "model": model.type,
         "messages": messages,
     }
 
-    stream = request.query_params.get("stream") == "1"
+    # 令牌桶限流：被拒绝的请求不会访问上游
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        try:
+            await limiter.check(model.model_id, limiter.caller_of(request), estimate_tokens(messages))
+        except RateLimited as e:
+            return _too_many(str(e), e.retry_after)
+
     if stream:
         payload["stream"] = True
-        return await stream_to_client(model, payload)
+    if async_mode:
+        jobs = get_chat_jobs()
+        if jobs is None:
+            return error(400, "未开启异步对话任务")
+        try:
+            job = jobs.submit(model, payload, stream)
+        except ChatJobsFull as e:
+            return _too_many(str(e), e.retry_after)
+        return success(job.info(), "任务已提交")
 
     try:
+        if stream:
+            return await stream_to_client(model, payload, request)
         return await call_model_once(model, payload)
+    except ModelOverloaded as e:
+        return _too_many(str(e), e.retry_after)
+    except HTTPException as e:
+        return error(e.status_code, e.detail if isinstance(e.detail, str) else str(e.detail))
+
+
+@router.get("/jobs/{job_id}", response_model=APIResponse)
+async def get_chat_job(
+        job_id: str,
+        wait: float = Query(0, ge=0),
+) -> APIJSONResponse:
+    """查询异步对话任务；wait > 0 时长轮询，任务结束或等待 wait 秒（有上限）后返回。"""
+    jobs = get_chat_jobs()
+    info = await jobs.get(job_id, wait) if jobs is not None else None
+    if info is None:
+        return error(404, "任务不存在或已过期")
+    return success(info, "查询成功")
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_chat_job(
+        job_id: str,
+        request: Request,
+        wait: float | None = Query(None, ge=0),
+):
+    """
+    订阅流式异步任务的 SSE 输出，从头开始；任务结束后返回完整输出。
+    任务仍在排队时最多等待 wait 秒（有上限），仍未开始返回 202，已失败返回 409，data 为任务状态。
+    """
+    jobs = get_chat_jobs()
+    try:
+        resp = await jobs.stream(job_id, request, wait) if jobs is not None else None
+    except ChatJobNotStreaming as e:
+        headers = {"Retry-After": "1"} if e.status_code == 202 else None
+        return APIJSONResponse(
+            {"status": e.status_code, "data": e.info, "msg": str(e)},
+            status_code=e.status_code,
+            headers=headers,
+        )
+    except HTTPException as e:
+        return error(e.status_code, e.detail if isinstance(e.detail, str) else str(e.detail))
+    if resp is None:
+        return error(404, "任务不存在或已过期")
+    return resp
+
+
+@router.post("/embed/{model_id}")
+async def embed_with_model(
+        model_id: str,
+        request: Request,
+        req: EmbedRequest = Body(...),
+):
+    """OpenAI 风格的向量化接口；并发的单条文本请求会合并为一次上游批量调用。"""
+    model = await aget_model_cached(model_id)
+    if not model:
+        return error(404, "模型不存在")
+    invalid = _check_api_key(model)
+    if invalid is not None:
+        return invalid
+
+    inputs = [req.input] if isinstance(req.input, str) else req.input
+    if not inputs or any(not text for text in inputs):
+        return error(400, "input 不能为空")
+
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        try:
+            tokens = estimate_tokens([{"content": text} for text in inputs])
+            await limiter.check(model.model_id, limiter.caller_of(request), tokens)
+        except RateLimited as e:
+            return _too_many(str(e), e.retry_after)
+
+    try:
+        return APIJSONResponse(await embed(model, inputs, req.encoding_format))
+    except ModelOverloaded as e:
+        return _too_many(str(e), e.retry_after)
     except HTTPException as e:
+        if e.status_code == 429:
+            retry_after = (e.headers or {}).get("Retry-After", "1")
+            return _too_many(e.detail, int(retry_after) if retry_after.isdigit() else 1)
         return error(e.status_code, e.detail if isinstance(e.detail, str) else str(e.detail))
@@ -1,15 +1,49 @@
 from functools import lru_cache
 import os
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Literal
 
 import yaml
 from pydantic import BaseModel, Field
 
 
 class ServerConfig(BaseModel):
+    host: str = "0.0.0.0"
     port: int = 3000
+    # 工作进程数，0 表示按 CPU 核数；缓存、并发名额、本地限流、指标等进程内状态在各进程间不共享
+    workers: int = 1
+    # 事件循环与 HTTP 解析：auto 在已安装时使用 uvloop / httptools（uvicorn[standard] 自带）
+    loop: Literal["auto", "uvloop", "asyncio"] = "auto"
+    http: Literal["auto", "httptools", "h11"] = "auto"
+    # 收到停止信号后不再接受新连接，等待进行中的请求（含 SSE 流）结束的最长时间（秒），超时后中断
+    shutdown_timeout_seconds: float = 30
     sse_heartbeat_seconds: int = 15
+    # SSE 转发实现：bytes 为字节级零拷贝转发，text 为原有的解码后逐行处理
+    sse_relay_mode: Literal["bytes", "text"] = "bytes"
+    # 检测 SSE 客户端断开的轮询间隔（秒），0 表示不主动检测
+    sse_disconnect_poll_seconds: float = 1.0
+    # 上游连续无输出超过该时长（秒）即结束 SSE 流，0 表示不限制
+    sse_idle_timeout_seconds: float = 300
+    # SSE 客户端跟不上上游时的处理：pause 暂停读取上游（共享同一生成的客户端都按最慢的速度推进），
+    # drop 断开落后过多的客户端（开启续传时可带 Last-Event-ID 重连），off 不限制
+    sse_backpressure: Literal["pause", "drop", "off"] = "off"
+    # pause 单次暂停的最长时间（秒），超时仍未追上时断开落后的客户端，0 表示一直等待
+    sse_max_pause_seconds: float = 30
+    # 单个流中客户端最多落后的长度（bytes 模式为字节，text 模式为字符）；
+    # 开启背压时也是单个流缓冲的保留上限，超过后丢弃所有客户端都已写出的部分
+    sse_client_max_lag_bytes: int = 1024 * 1024
+    # 所有流的客户端落后长度之和上限；超出时 pause 暂停有积压的流，drop 断开积压超过平均份额的客户端
+    sse_max_lag_bytes: int = 256 * 1024 * 1024
+    # SSE 断线续传：生成结束（或客户端全部断开）后保留多久（秒）供带 Last-Event-ID 的重连继续，0 表示不开启
+    sse_resume_grace_seconds: float = 0
+    # 可续传的流缓冲区总大小上限（字节），超出时按最近使用淘汰
+    sse_replay_max_bytes: int = 64 * 1024 * 1024
+    # 非流式对话透传：上游响应体和 Content-Type 原样转发，不解析 JSON；开启了响应缓存或语义缓存的模型不透传
+    chat_passthrough: bool = False
+    # GET /metrics（Prometheus 文本格式）
+    metrics_enabled: bool = True
+    # 事件循环延迟的采样间隔（秒），0 表示不采样
+    loop_lag_interval_seconds: float = 0.5
 
 
 class DBConfig(BaseModel):
@@ -19,6 +53,8 @@ class DBConfig(BaseModel):
     password: str
     database: str
     maxConnections: int
+    # 完整的 SQLAlchemy URL（如 sqlite:///bench.db），设置后忽略上面的 MySQL 配置；异步连接自动换用对应的异步驱动
+    url: Optional[str] = None
 
 
 class MilvusConfig(BaseModel):
@@ -48,11 +84,228 @@ class NatsConfig(BaseModel):
     account: Dict[str, NatsAccount] = Field(default_factory=dict)
 
 
+class UpstreamConfig(BaseModel):
+    """上游大模型 HTTP 连接池配置。"""
+    max_connections: int = 200
+    max_keepalive_connections: int = 50
+    keepalive_expiry: float = 60.0
+    connect_timeout: float = 10.0
+    http2: bool = False
+
+
+class ModelRegistryConfig(BaseModel):
+    """进程内模型注册表配置。"""
+    enabled: bool = True
+    refresh_seconds: float = 30
+    negative_ttl_seconds: float = 5
+    negative_max_entries: int = 10000
+
+
+class ModelCacheOverride(BaseModel):
+    """单个模型的响应缓存设置，未填写的项沿用全局配置。"""
+    enabled: Optional[bool] = None
+    ttl_seconds: Optional[float] = None
+
+
+class ResponseCacheConfig(BaseModel):
+    """非流式对话响应缓存配置，默认关闭。"""
+    enabled: bool = False
+    ttl_seconds: float = 300
+    max_bytes: int = 64 * 1024 * 1024
+    max_entry_bytes: int = 1024 * 1024
+    # 磁盘层目录，为空表示只用内存
+    disk_dir: Optional[str] = None
+    # 磁盘层总大小上限（字节），超出时先删除最早过期的文件
+    disk_max_bytes: int = 1024 * 1024 * 1024
+    # 定期清理磁盘层过期文件的间隔（秒）
+    disk_sweep_seconds: float = 300
+    # key 为 model_id
+    models: Dict[str, ModelCacheOverride] = Field(default_factory=dict)
+
+
+class CoalesceConfig(BaseModel):
+    """并发的相同对话请求合并为一次上游调用。"""
+    enabled: bool = True
+
+
+class BalancerConfig(BaseModel):
+    """模型多上游地址的负载均衡与熔断配置。"""
+    # least_outstanding：按 在途请求数 / 权重 选择；ewma：再乘以首字节延迟的指数滑动平均
+    strategy: Literal["least_outstanding", "ewma"] = "least_outstanding"
+    ewma_alpha: float = 0.3
+    # 连接失败时最多尝试的地址数（只在收到任何字节之前重试）
+    max_attempts: int = 2
+    # 连续失败达到该次数后熔断该地址
+    failure_threshold: int = 3
+    # 熔断时长（秒），到期后放行一个试探请求
+    open_seconds: float = 30
+
+
+class HedgeOverride(BaseModel):
+    """单个模型的对冲开关，未填写时沿用全局配置。"""
+    enabled: Optional[bool] = None
+
+
+class HedgeConfig(BaseModel):
+    """对话请求对冲（按需开启）：首字节迟迟未到时向备选上游再发一份，先开始输出的一方胜出。"""
+    enabled: bool = False
+    # 等待时长取该模型最近 window 次首字节耗时的 percentile 分位数，样本不足 min_samples 时不对冲
+    percentile: float = 95
+    window: int = 200
+    min_samples: int = 20
+    min_delay_ms: float = 50
+    max_delay_ms: float = 10000
+    # 对冲请求数占总请求数的上限（百分比），budget_burst 为最多可积累的对冲次数
+    budget_percent: float = 5
+    budget_burst: float = 10
+    # 同模型没有其它地址时，是否对冲到 type 相同的其它模型
+    alternate_models: bool = True
+    # key 为 model_id
+    models: Dict[str, HedgeOverride] = Field(default_factory=dict)
+
+
+class RateLimitRule(BaseModel):
+    """令牌桶限额，0 表示不限制；桶容量等于每分钟额度。"""
+    requests_per_minute: float = 0
+    tokens_per_minute: float = 0
+
+
+class RateLimitConfig(BaseModel):
+    """按模型、按调用方的令牌桶限流，默认关闭。"""
+    enabled: bool = False
+    # local：进程内；redis：多个 worker 共享额度
+    backend: Literal["local", "redis"] = "local"
+    redis_url: Optional[str] = None
+    # 调用方身份：已认证的用户（认证中间件写入的 scope["user"]），其次是该请求头或 Authorization 中
+    # 出现在 api_keys 里的 API Key，都没有时按客户端 IP；未登记的 Key 不单独建桶，防止换 Key 绕过限流
+    caller_header: str = "X-API-Key"
+    # API Key -> 调用方名称，callers 中按调用方名称覆盖额度
+    api_keys: Dict[str, str] = Field(default_factory=dict)
+    model: RateLimitRule = Field(default_factory=RateLimitRule)
+    caller: RateLimitRule = Field(default_factory=RateLimitRule)
+    # key 为 model_id / 调用方标识，覆盖上面的默认额度
+    models: Dict[str, RateLimitRule] = Field(default_factory=dict)
+    callers: Dict[str, RateLimitRule] = Field(default_factory=dict)
+
+
+class UsageConfig(BaseModel):
+    """对话用量记录（t_usage，见 migrations/005_t_usage.sql），写后批量落库，默认关闭。"""
+    enabled: bool = False
+    # 缓冲达到该条数或距上次写入超过 flush_interval_seconds 时写入一批
+    batch_size: int = 500
+    flush_interval_seconds: float = 2
+    # 等待写入的记录上限，超出时丢弃新记录
+    max_pending: int = 50000
+
+
+class EmbeddingConfig(BaseModel):
+    """向量化接口的微批：并发的单条请求合并为一次上游批量调用。"""
+    max_batch_size: int = 64
+    max_wait_ms: float = 5
+    # 多条文本的请求切分后同时进行的上游调用数
+    max_concurrent_batches: int = 4
+
+
+class SemanticCacheOverride(BaseModel):
+    """单个模型的语义缓存设置，未填写的项沿用全局配置。"""
+    enabled: Optional[bool] = None
+    threshold: Optional[float] = None
+
+
+class SemanticCacheConfig(BaseModel):
+    """非流式对话的语义缓存（按需开启）：问题足够相似时直接返回已有回答。"""
+    enabled: bool = False
+    # 用于向量化问题的模型（t_model 中的 model_id）
+    embedding_model_id: Optional[str] = None
+    # 余弦相似度阈值
+    threshold: float = 0.95
+    ttl_seconds: float = 3600
+    # 每个模型最多保留的条目数，超出后淘汰最久未命中的
+    max_entries: int = 10000
+    # numpy：进程内索引；milvus：使用 milvus 配置中的实例，多个 worker 共享
+    backend: Literal["numpy", "milvus"] = "numpy"
+    milvus_collection: str = "chat_semantic_cache"
+    # key 为 model_id
+    models: Dict[str, SemanticCacheOverride] = Field(default_factory=dict)
+
+
+class PullWorkerConfig(BaseModel):
+    """JetStream 拉取消费者的公共配置。"""
+    enabled: bool = False
+    # 每次拉取的最大条数
+    batch_size: int = 16
+    fetch_timeout_seconds: float = 5
+    # 同时处理的消息数上限
+    concurrency: int = 8
+    # 确认批量发送的间隔（毫秒）
+    ack_flush_ms: float = 100
+    ack_wait_seconds: float = 300
+    max_deliver: int = 5
+    # 第 n 次重投前的等待时间（秒），次数超出列表时取最后一项
+    backoff_seconds: List[float] = Field(default_factory=lambda: [5, 30, 120, 600])
+
+
+class ArticleWorkerConfig(PullWorkerConfig):
+    """nats.articleSubject 的消费者，默认不随 API 进程启动。"""
+
+
+class ImagesProcConfig(PullWorkerConfig):
+    """nats.imagesProcSubject 的图片预处理消费者，默认不随 API 进程启动。"""
+    # 处理进程数，0 表示 CPU 核数
+    workers: int = 0
+    # 子进程启动方式；spawn 不继承父进程的线程和连接，最稳妥
+    mp_context: Literal["spawn", "forkserver", "fork"] = "spawn"
+    # 输出尺寸（宽, 高），按比例缩放后居中裁剪
+    target_width: int = 224
+    target_height: int = 224
+    # 按通道标准化：(x / 255 - mean) / std
+    mean: List[float] = Field(default_factory=lambda: [0.485, 0.456, 0.406])
+    std: List[float] = Field(default_factory=lambda: [0.229, 0.224, 0.225])
+    max_image_bytes: int = 50 * 1024 * 1024
+    # 预处理结果（float32 CHW 的 .npy 文件）的输出目录
+    output_dir: str = "/tmp/images-proc"
+    # 消息中 path 只能指向该目录下的文件（相对路径相对于该目录），为空时不接受 path
+    input_dir: str = ""
+    # 消息中 url（含重定向）允许的协议和主机；主机支持 "*.example.com" 匹配子域名，为空时不接受 url
+    url_schemes: List[str] = Field(default_factory=lambda: ["https"])
+    url_hosts: List[str] = Field(default_factory=list)
+
+
+class ChatJobsConfig(BaseModel):
+    """异步对话任务（mode=async）：提交后立即返回 job_id，由后台的有界 worker 池执行，默认关闭。"""
+    enabled: bool = False
+    # 同时执行的任务数
+    workers: int = 16
+    # 排队任务数上限，超出时拒绝提交（429）
+    max_queue: int = 1000
+    # 任务结束后结果保留的时长（秒）
+    ttl_seconds: float = 3600
+    # 长轮询单次最长等待（秒）
+    max_wait_seconds: float = 30
+    # 内存中保存的结果总大小上限（字节），超出时最早结束的结果落盘或丢弃
+    max_memory_bytes: int = 64 * 1024 * 1024
+    # 结果落盘目录，为空表示只用内存
+    spill_dir: Optional[str] = None
+
+
 class Settings(BaseModel):
     server: ServerConfig
     db: DBConfig
     milvus: MilvusConfig
     nats: NatsConfig
+    upstream: UpstreamConfig = Field(default_factory=UpstreamConfig)
+    registry: ModelRegistryConfig = Field(default_factory=ModelRegistryConfig)
+    response_cache: ResponseCacheConfig = Field(default_factory=ResponseCacheConfig)
+    coalesce: CoalesceConfig = Field(default_factory=CoalesceConfig)
+    balancer: BalancerConfig = Field(default_factory=BalancerConfig)
+    hedge: HedgeConfig = Field(default_factory=HedgeConfig)
+    rate_limit: RateLimitConfig = Field(default_factory=RateLimitConfig)
+    usage: UsageConfig = Field(default_factory=UsageConfig)
+    embedding: EmbeddingConfig = Field(default_factory=EmbeddingConfig)
+    semantic_cache: SemanticCacheConfig = Field(default_factory=SemanticCacheConfig)
+    chat_jobs: ChatJobsConfig = Field(default_factory=ChatJobsConfig)
+    article_worker: ArticleWorkerConfig = Field(default_factory=ArticleWorkerConfig)
+    images_proc: ImagesProcConfig = Field(default_factory=ImagesProcConfig)
 
 
 def _default_config_path() -> Path:
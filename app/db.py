@@ -2,14 +2,18 @@
 数据库连接与表初始化。
 从 config.yaml 的 db 配置读取 MySQL 连接信息，与 get_settings() 一致。
 """
-from contextlib import contextmanager
+import time
+from contextlib import contextmanager, asynccontextmanager
 from datetime import datetime
 from urllib.parse import quote_plus
 
-from sqlalchemy import create_engine, Integer, String, DateTime, BigInteger
+from sqlalchemy import create_engine, make_url, Integer, String, DateTime, BigInteger
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, sessionmaker, Mapped, mapped_column
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from app.config import DBConfig
+from app.services.metrics import gauge, histogram, on_collect
 
 
 class Base(DeclarativeBase):
@@ -28,10 +32,24 @@ class ModelRecord(Base):
     type: Mapped[str] = mapped_column("type", String(255), nullable=False)
     dimensions: Mapped[int] = mapped_column("dimensions", BigInteger, nullable=False, default=0)
     enable: Mapped[int] = mapped_column("enable", Integer, nullable=False, default=1)
+    max_concurrency: Mapped[int] = mapped_column("max_concurrency", Integer, nullable=False, default=0)
+    max_queue: Mapped[int] = mapped_column("max_queue", Integer, nullable=False, default=0)
+    queue_timeout: Mapped[int] = mapped_column("queue_timeout", Integer, nullable=False, default=10)
     created_at: Mapped[datetime | None] = mapped_column("created_at", DateTime, nullable=True)
     updated_at: Mapped[datetime | None] = mapped_column("updated_at", DateTime, nullable=True)
 
 
+class ModelEndpointRecord(Base):
+    """模型上游地址表 ORM，对应 t_model_endpoint：一个模型可配置多个带权重的上游地址。"""
+    __tablename__ = "t_model_endpoint"
+
+    id: Mapped[int] = mapped_column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    model_id: Mapped[str] = mapped_column("model_id", String(64), nullable=False, index=True)
+    endpoint: Mapped[str] = mapped_column("endpoint", String(255), nullable=False)
+    weight: Mapped[int] = mapped_column("weight", Integer, nullable=False, default=1)
+    enable: Mapped[int] = mapped_column("enable", Integer, nullable=False, default=1)
+
+
 class SiteRecord(Base):
     """站点表 ORM，对应数据库中的 t_site 表。"""
     __tablename__ = "t_site"
@@ -40,26 +58,102 @@ class SiteRecord(Base):
     site_name: Mapped[str | None] = mapped_column("site_name", String(255), nullable=True)
 
 
+class UsageRecord(Base):
+    """用量表 ORM，对应 t_usage：每次上游对话调用一行，用于容量规划和按模型计费；由 UsageRecorder 批量写入。"""
+    __tablename__ = "t_usage"
+
+    id: Mapped[int] = mapped_column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    model_id: Mapped[str] = mapped_column("model_id", String(64), nullable=False, index=True)
+    # stream / once / passthrough
+    mode: Mapped[str] = mapped_column("mode", String(16), nullable=False)
+    prompt_tokens: Mapped[int] = mapped_column("prompt_tokens", Integer, nullable=False, default=0)
+    completion_tokens: Mapped[int] = mapped_column("completion_tokens", Integer, nullable=False, default=0)
+    # token 数来源：upstream 为上游返回的 usage，stream 为按流式分段计数，estimated 为按字符数估算
+    token_source: Mapped[str] = mapped_column("token_source", String(16), nullable=False)
+    latency_ms: Mapped[int] = mapped_column("latency_ms", Integer, nullable=False, default=0)
+    # 上游 HTTP 状态码，请求失败（未收到响应）时为 0
+    status: Mapped[int] = mapped_column("status", Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column("created_at", DateTime, nullable=False, index=True)
+
+
 _engine = None
 _SessionLocal = None
+_async_engine = None
+_AsyncSessionLocal = None
+
+
+DB_POOL_CHECKOUT_SECONDS = histogram(
+    "db_pool_checkout_seconds",
+    "从连接池取得连接的耗时（池满时的等待和新建连接都计入）",
+    ("engine",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+DB_POOL_CHECKED_OUT = gauge("db_pool_checked_out", "连接池中已借出的连接数", ("engine",))
+DB_POOL_OVERFLOW = gauge("db_pool_overflow", "超出 pool_size 额外建立的连接数", ("engine",))
+DB_POOL_SIZE = gauge("db_pool_size", "连接池的 pool_size", ("engine",))
 
 
-def _build_mysql_url(cfg: DBConfig) -> str:
-    """从 config.yaml 的 db 配置拼 MySQL URL。"""
+def _timed_pool(base, engine_name: str):
+    """给连接池加上取连接的计时；dispose 后重建的池沿用同一个类。"""
+
+    class TimedPool(base):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                DB_POOL_CHECKOUT_SECONDS.observe(engine_name, value=time.perf_counter() - start)
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def _collect_pool_stats() -> None:
+    for name, engine in (("sync", _engine), ("async", _async_engine)):
+        if engine is None:
+            continue
+        pool = engine.pool
+        DB_POOL_CHECKED_OUT.set(name, value=pool.checkedout())
+        # QueuePool 的 overflow 从 -pool_size 开始计数
+        DB_POOL_OVERFLOW.set(name, value=max(0, pool.overflow()))
+        DB_POOL_SIZE.set(name, value=pool.size())
+
+
+on_collect(_collect_pool_stats)
+
+
+def _build_mysql_url(cfg: DBConfig, driver: str = "pymysql") -> str:
+    """从 config.yaml 的 db 配置拼 MySQL URL。driver 为 pymysql（同步）或 aiomysql（异步）。"""
     password = quote_plus(cfg.password) if cfg.password else ""
     return (
-        f"mysql+pymysql://{cfg.username}:{password}@{cfg.host}:{cfg.port}/{cfg.database}"
+        f"mysql+{driver}://{cfg.username}:{password}@{cfg.host}:{cfg.port}/{cfg.database}"
     )
 
 
+# db.url 的异步驱动
+_ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def _database_url(cfg: DBConfig, is_async: bool = False) -> str:
+    """优先使用 db.url（基准测试等离线场景用 sqlite），否则按 MySQL 配置拼接。"""
+    if not cfg.url:
+        return _build_mysql_url(cfg, driver="aiomysql" if is_async else "pymysql")
+    url = make_url(cfg.url)
+    if is_async:
+        backend = url.get_backend_name()
+        url = url.set(drivername=f"{backend}+{_ASYNC_DRIVERS.get(backend, url.get_driver_name())}")
+    return url.render_as_string(hide_password=False)
+
+
 def init_db(db_config: DBConfig) -> None:
     """使用 config.yaml 中的 db 配置初始化 MySQL 连接。"""
     global _engine, _SessionLocal
     if _engine is not None:
         return
-    url = _build_mysql_url(db_config)
+    url = _database_url(db_config)
     _engine = create_engine(
         url,
+        poolclass=_timed_pool(QueuePool, "sync"),
         pool_size=min(db_config.maxConnections, 20),
         pool_pre_ping=True,
         echo=False,
@@ -69,6 +163,35 @@ def init_db(db_config: DBConfig) -> None:
     _SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
 
 
+def init_async_db(db_config: DBConfig) -> None:
+    """初始化异步 MySQL 连接（aiomysql），供 async 路由使用，避免阻塞事件循环。"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is not None:
+        return
+    url = _database_url(db_config, is_async=True)
+    _async_engine = create_async_engine(
+        url,
+        poolclass=_timed_pool(AsyncAdaptedQueuePool, "async"),
+        pool_size=min(db_config.maxConnections, 20),
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        echo=False,
+    )
+    _AsyncSessionLocal = async_sessionmaker(
+        bind=_async_engine,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+async def close_async_db() -> None:
+    """释放异步连接池（lifespan 关闭时调用）。"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        return
+    engine, _async_engine, _AsyncSessionLocal = _async_engine, None, None
+    await engine.dispose()
+
 
 @contextmanager
 def get_db_session():
@@ -84,3 +207,19 @@ def get_db_session():
         raise
     finally:
         session.close()
+
+
+@asynccontextmanager
+async def get_async_db_session():
+    """获取异步数据库 session（异步上下文管理器）。"""
+    if _AsyncSessionLocal is None:
+        raise RuntimeError("异步数据库未初始化，请先调用 init_async_db()")
+    session = _AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -1,17 +1,54 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.api.middleware import RequestMetricsMiddleware
+from app.api.routes.metrics import router as metrics_router
 from app.api.routes.models import router as models_router
 from app.api.routes.sites import router as sites_router
 from app.config import get_settings
-from app.db import init_db
+from app.db import init_db, init_async_db
+from app.services.article_worker import ArticleWorker
+from app.services.chat_jobs import init_chat_jobs
+from app.services.runtime import start_services, stop_services
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = app.state.settings
+    await start_services(settings)
+    # 异步对话任务的 worker 池只在 API 进程中运行
+    jobs = init_chat_jobs(settings.chat_jobs)
+    if jobs is not None:
+        jobs.start()
+    # NATS 消费者：开启时随 API 进程运行，也可用 python -m app.services.article_worker / images_worker 单独部署
+    workers = []
+    if settings.article_worker.enabled:
+        workers.append(ArticleWorker(settings.nats, settings.article_worker))
+    if settings.images_proc.enabled:
+        # 依赖 Pillow / numpy，只在开启时导入
+        from app.services.images_worker import ImagesProcWorker
+
+        workers.append(ImagesProcWorker(settings.nats, settings.images_proc))
+    for worker in workers:
+        await worker.start()
+    try:
+        yield
+    finally:
+        for worker in workers:
+            await worker.stop()
+        if jobs is not None:
+            await jobs.stop()
+        await stop_services()
 
 
 def create_app() -> FastAPI:
     settings = get_settings()
-    # 使用 config.yaml 中的 db 配置初始化 MySQL
+    # 使用 config.yaml 中的 db 配置初始化 MySQL：路由走异步连接，同步连接保留给脚本
     init_db(settings.db)
-    app = FastAPI(title="MyAPI Python Server", version="0.1.0")
+    init_async_db(settings.db)
+    app = FastAPI(title="MyAPI Python Server", version="0.1.0", lifespan=lifespan)
 
     # 将配置挂到应用状态，方便后续在路由或服务中使用
     app.state.settings = settings
@@ -24,13 +61,16 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    # 请求计数与耗时，GET /metrics 输出
+    app.add_middleware(RequestMetricsMiddleware)
 
     # 路由
     app.include_router(models_router)
     app.include_router(sites_router)
+    if settings.server.metrics_enabled:
+        app.include_router(metrics_router)
 
     return app
 
 
 app = create_app()
-
@@ -1,10 +1,21 @@
-from typing import Optional, List, Literal
+import base64
+import json
+import time
+from datetime import datetime
+from typing import Optional, List, Literal, Tuple, Union
 
 from pydantic import BaseModel, Field
 from uuid import uuid4
-from sqlalchemy import select
+from sqlalchemy import select, func, and_, or_, delete
 
-from app.db import get_db_session, ModelRecord, SiteRecord
+from app.db import get_db_session, get_async_db_session, ModelRecord, ModelEndpointRecord, SiteRecord
+from app.models.registry import model_registry
+
+
+class ModelEndpoint(BaseModel):
+    endpoint: str = Field(..., description="上游地址")
+    weight: int = Field(1, ge=1, description="负载均衡权重")
+    enable: int = Field(1, description="是否启用：1 可用，0 不可用")
 
 
 class ModelBase(BaseModel):
@@ -15,6 +26,10 @@ class ModelBase(BaseModel):
     type: str = Field("", description="模型类型")
     dimensions: int = Field(0, description="向量维度")
     enable: int = Field(1, description="是否启用：1 可用，0 不可用")
+    endpoints: List[ModelEndpoint] = Field(default_factory=list, description="额外的上游地址，与 endpoint 一起做负载均衡")
+    max_concurrency: int = Field(0, ge=0, description="同时进行的对话请求上限，0 表示不限制")
+    max_queue: int = Field(0, ge=0, description="达到并发上限后允许排队等待的请求数")
+    queue_timeout: int = Field(10, ge=0, description="排队等待超时时间（秒），0 表示一直等待")
 
 
 class ModelCreateRequest(ModelBase):
@@ -29,6 +44,10 @@ class ModelUpdateRequest(BaseModel):
     type: Optional[str] = None
     dimensions: Optional[int] = None
     enable: Optional[int] = None
+    endpoints: Optional[List[ModelEndpoint]] = None
+    max_concurrency: Optional[int] = Field(None, ge=0)
+    max_queue: Optional[int] = Field(None, ge=0)
+    queue_timeout: Optional[int] = Field(None, ge=0)
 
 
 class Model(ModelBase):
@@ -39,6 +58,7 @@ class ModelGetRequest(BaseModel):
     model_id: Optional[str] = None
     page: int = 1
     page_size: int = 10
+    cursor: Optional[str] = Field(None, description="游标分页：传上一页返回的 next_cursor，传入后忽略 page")
 
 
 class ChatMessage(BaseModel):
@@ -51,7 +71,12 @@ class ChatRequest(BaseModel):
     messages: Optional[List[ChatMessage]] = None
 
 
-def _record_to_model(r: ModelRecord) -> Model:
+class EmbedRequest(BaseModel):
+    input: Union[str, List[str]] = Field(..., description="待向量化的文本，单条或多条")
+    encoding_format: Literal["float", "base64"] = Field("float", description="base64 为小端 float32 字节的 base64 编码")
+
+
+def _record_to_model(r: ModelRecord, endpoints: Optional[List[ModelEndpoint]] = None) -> Model:
     """ORM 记录转 Pydantic 模型。"""
     return Model(
         model_id=r.model_id,
@@ -62,22 +87,54 @@ def _record_to_model(r: ModelRecord) -> Model:
         type=r.type,
         dimensions=r.dimensions,
         enable=r.enable,
+        endpoints=endpoints or [],
+        max_concurrency=r.max_concurrency,
+        max_queue=r.max_queue,
+        queue_timeout=r.queue_timeout,
     )
 
 
+def _record_to_endpoint(r: ModelEndpointRecord) -> ModelEndpoint:
+    return ModelEndpoint(endpoint=r.endpoint, weight=r.weight, enable=r.enable)
+
+
+def _endpoint_records(model_id: str, endpoints: List[ModelEndpoint]) -> List[ModelEndpointRecord]:
+    return [
+        ModelEndpointRecord(model_id=model_id, endpoint=e.endpoint, weight=e.weight, enable=e.enable)
+        for e in endpoints
+    ]
+
+
+def _load_endpoints(session, model_ids: Optional[List[str]] = None) -> dict:
+    """批量查询模型的额外上游地址，返回 {model_id: [ModelEndpoint]}；model_ids 为 None 时查全部。"""
+    stmt = select(ModelEndpointRecord).order_by(ModelEndpointRecord.id)
+    if model_ids is not None:
+        if not model_ids:
+            return {}
+        stmt = stmt.where(ModelEndpointRecord.model_id.in_(model_ids))
+    grouped: dict = {}
+    for r in session.execute(stmt).scalars().all():
+        grouped.setdefault(r.model_id, []).append(_record_to_endpoint(r))
+    return grouped
+
+
 def list_models() -> List[Model]:
-    """查询模型列表（不分页，由路由层做分页）。"""
+    """查询模型列表（不分页，由路由层做分页；含额外上游地址）。"""
     with get_db_session() as session:
         result = session.execute(select(ModelRecord).order_by(ModelRecord.created_at))
         rows = result.scalars().all()
-        return [_record_to_model(r) for r in rows]
+        endpoints = _load_endpoints(session)
+        return [_record_to_model(r, endpoints.get(r.model_id)) for r in rows]
 
 
 def get_model_by_id(model_id: str) -> Optional[Model]:
-    """按 model_id 查询单个模型。"""
+    """按 model_id 查询单个模型（含额外上游地址）。"""
     with get_db_session() as session:
         r = session.get(ModelRecord, model_id)
-        return _record_to_model(r) if r else None
+        if not r:
+            return None
+        endpoints = _load_endpoints(session, [model_id])
+        return _record_to_model(r, endpoints.get(model_id))
 
 
 def get_model_by_name(name: str) -> Optional[Model]:
@@ -99,10 +156,13 @@ def exists_model_with_name_excluding(name: str, exclude_model_id: str) -> bool:
         return r is not None
 
 
+# 同步的增删改与异步版本一致：同时写额外上游地址，并即时更新本进程的模型注册表和总数缓存
+
 def create_model_entry(req: ModelCreateRequest) -> Model:
     """创建模型并落库。"""
     model_id = str(uuid4())
     timeout = req.timeout if req.timeout > 0 else 30
+    now = datetime.now()
     with get_db_session() as session:
         record = ModelRecord(
             model_id=model_id,
@@ -113,14 +173,25 @@ def create_model_entry(req: ModelCreateRequest) -> Model:
             type=req.type,
             dimensions=req.dimensions,
             enable=req.enable,
+            max_concurrency=req.max_concurrency,
+            max_queue=req.max_queue,
+            queue_timeout=req.queue_timeout,
+            created_at=now,
+            updated_at=now,
         )
         session.add(record)
+        session.add_all(_endpoint_records(model_id, req.endpoints))
         session.flush()
-        return _record_to_model(record)
+        model = _record_to_model(record, req.endpoints)
+    model_registry.put(model)
+    _invalidate_model_count()
+    return model
 
 
 def save_model(model: Model) -> None:
-    """更新模型并落库。"""
+    """更新模型并落库；额外上游地址整体替换。"""
+    endpoints = [ModelEndpoint.model_validate(e) for e in model.endpoints]
+    model = model.model_copy(update={"endpoints": endpoints})
     with get_db_session() as session:
         record = session.get(ModelRecord, model.model_id)
         if not record:
@@ -132,6 +203,13 @@ def save_model(model: Model) -> None:
         record.type = model.type
         record.dimensions = model.dimensions
         record.enable = model.enable
+        record.max_concurrency = model.max_concurrency
+        record.max_queue = model.max_queue
+        record.queue_timeout = model.queue_timeout
+        record.updated_at = datetime.now()
+        session.execute(delete(ModelEndpointRecord).where(ModelEndpointRecord.model_id == model.model_id))
+        session.add_all(_endpoint_records(model.model_id, endpoints))
+    model_registry.put(model)
 
 
 def delete_model_entry(model_id: str) -> Optional[Model]:
@@ -140,9 +218,243 @@ def delete_model_entry(model_id: str) -> Optional[Model]:
         record = session.get(ModelRecord, model_id)
         if not record:
             return None
-        model = _record_to_model(record)
+        endpoints = _load_endpoints(session, [model_id])
+        model = _record_to_model(record, endpoints.get(model_id))
         session.delete(record)
+        session.execute(delete(ModelEndpointRecord).where(ModelEndpointRecord.model_id == model_id))
+    model_registry.remove(model_id)
+    _invalidate_model_count()
+    return model
+
+
+# ============ Model 异步 CRUD（供 async 路由使用） ============
+
+async def _aload_endpoints(session, model_ids: Optional[List[str]] = None) -> dict:
+    """批量查询模型的额外上游地址，返回 {model_id: [ModelEndpoint]}；model_ids 为 None 时查全部。"""
+    stmt = select(ModelEndpointRecord).order_by(ModelEndpointRecord.id)
+    if model_ids is not None:
+        if not model_ids:
+            return {}
+        stmt = stmt.where(ModelEndpointRecord.model_id.in_(model_ids))
+    grouped: dict = {}
+    for r in (await session.execute(stmt)).scalars().all():
+        grouped.setdefault(r.model_id, []).append(_record_to_endpoint(r))
+    return grouped
+
+
+async def alist_models() -> List[Model]:
+    """list_models 的异步版本（含额外上游地址）。"""
+    async with get_async_db_session() as session:
+        result = await session.execute(select(ModelRecord).order_by(ModelRecord.created_at))
+        rows = result.scalars().all()
+        endpoints = await _aload_endpoints(session)
+        return [_record_to_model(r, endpoints.get(r.model_id)) for r in rows]
+
+
+def _encode_model_cursor(created_at: Optional[datetime], model_id: str) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, model_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_model_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    """解析游标，格式不合法时抛 ValueError。"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, model_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return (datetime.fromisoformat(created_at) if created_at else None), str(model_id)
+    except Exception as e:
+        raise ValueError("cursor 无效") from e
+
+
+async def alist_models_page(
+        page: int,
+        page_size: int,
+        cursor: Optional[str] = None,
+) -> Tuple[List[Model], Optional[str]]:
+    """
+    在数据库侧分页查询模型，按 (created_at, model_id) 排序。
+    传 cursor 时走 keyset 分页（不随页码增大变慢），否则走 LIMIT/OFFSET。
+    返回 (当前页模型, 下一页游标)，没有下一页时游标为 None。
+    """
+    stmt = select(ModelRecord).order_by(ModelRecord.created_at, ModelRecord.model_id)
+    if cursor:
+        created_at, last_id = _decode_model_cursor(cursor)
+        # MySQL 升序时 NULL 排在最前
+        if created_at is None:
+            stmt = stmt.where(or_(
+                and_(ModelRecord.created_at.is_(None), ModelRecord.model_id > last_id),
+                ModelRecord.created_at.is_not(None),
+            ))
+        else:
+            stmt = stmt.where(or_(
+                ModelRecord.created_at > created_at,
+                and_(ModelRecord.created_at == created_at, ModelRecord.model_id > last_id),
+            ))
+    else:
+        stmt = stmt.offset((page - 1) * page_size)
+    # 多取一条用于判断是否还有下一页
+    stmt = stmt.limit(page_size + 1)
+
+    async with get_async_db_session() as session:
+        rows = (await session.execute(stmt)).scalars().all()
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            next_cursor = _encode_model_cursor(last.created_at, last.model_id)
+        endpoints = await _aload_endpoints(session, [r.model_id for r in rows])
+    return [_record_to_model(r, endpoints.get(r.model_id)) for r in rows], next_cursor
+
+
+# 模型总数缓存：(总数, 过期时间)，本进程增删时失效
+_MODEL_COUNT_TTL_SECONDS = 10
+_model_count_cache: Optional[Tuple[int, float]] = None
+
+
+async def acount_models() -> int:
+    """模型总数（带短 TTL 缓存），用于分页的 total。"""
+    global _model_count_cache
+    cached = _model_count_cache
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    async with get_async_db_session() as session:
+        total = (await session.execute(select(func.count()).select_from(ModelRecord))).scalar_one()
+    _model_count_cache = (total, time.monotonic() + _MODEL_COUNT_TTL_SECONDS)
+    return total
+
+
+def _invalidate_model_count() -> None:
+    global _model_count_cache
+    _model_count_cache = None
+
+
+async def aget_model_by_id(model_id: str) -> Optional[Model]:
+    """get_model_by_id 的异步版本。"""
+    async with get_async_db_session() as session:
+        r = await session.get(ModelRecord, model_id)
+        if not r:
+            return None
+        endpoints = await _aload_endpoints(session, [model_id])
+        return _record_to_model(r, endpoints.get(model_id))
+
+
+async def aget_model_cached(model_id: str) -> Optional[Model]:
+    """优先从进程内注册表取模型（chat 热路径），未命中再查库并回填。"""
+    if not model_registry.enabled:
+        return await aget_model_by_id(model_id)
+    hit, model = model_registry.lookup(model_id)
+    if hit:
         return model
+    model = await aget_model_by_id(model_id)
+    if model:
+        model_registry.put(model)
+    else:
+        model_registry.put_missing(model_id)
+    return model
+
+
+async def amodel_fingerprint() -> Tuple[int, Optional[datetime], Optional[datetime]]:
+    """t_model 的廉价版本指纹：行数与最大创建/更新时间，供注册表轮询使用。"""
+    async with get_async_db_session() as session:
+        result = await session.execute(
+            select(
+                func.count(),
+                func.max(ModelRecord.created_at),
+                func.max(ModelRecord.updated_at),
+            ).select_from(ModelRecord)
+        )
+        count, max_created, max_updated = result.one()
+        return count, max_created, max_updated
+
+
+async def aget_model_by_name(name: str) -> Optional[Model]:
+    """get_model_by_name 的异步版本。"""
+    async with get_async_db_session() as session:
+        result = await session.execute(select(ModelRecord).where(ModelRecord.name == name))
+        r = result.scalars().one_or_none()
+        return _record_to_model(r) if r else None
+
+
+async def aexists_model_with_name_excluding(name: str, exclude_model_id: str) -> bool:
+    """exists_model_with_name_excluding 的异步版本。"""
+    async with get_async_db_session() as session:
+        result = await session.execute(
+            select(ModelRecord.model_id).where(
+                ModelRecord.name == name,
+                ModelRecord.model_id != exclude_model_id,
+            ).limit(1)
+        )
+        return result.first() is not None
+
+
+async def acreate_model_entry(req: ModelCreateRequest) -> Model:
+    """create_model_entry 的异步版本。"""
+    model_id = str(uuid4())
+    timeout = req.timeout if req.timeout > 0 else 30
+    now = datetime.now()
+    async with get_async_db_session() as session:
+        record = ModelRecord(
+            model_id=model_id,
+            name=req.name,
+            endpoint=req.endpoint,
+            api_key=req.api_key,
+            timeout=timeout,
+            type=req.type,
+            dimensions=req.dimensions,
+            enable=req.enable,
+            max_concurrency=req.max_concurrency,
+            max_queue=req.max_queue,
+            queue_timeout=req.queue_timeout,
+            created_at=now,
+            updated_at=now,
+        )
+        session.add(record)
+        session.add_all(_endpoint_records(model_id, req.endpoints))
+        await session.flush()
+        model = _record_to_model(record, req.endpoints)
+    model_registry.put(model)
+    _invalidate_model_count()
+    return model
+
+
+async def asave_model(model: Model) -> None:
+    """save_model 的异步版本；额外上游地址整体替换。"""
+    # 路由层 model_copy(update=...) 不做校验，这里统一转成 ModelEndpoint
+    endpoints = [ModelEndpoint.model_validate(e) for e in model.endpoints]
+    model = model.model_copy(update={"endpoints": endpoints})
+    async with get_async_db_session() as session:
+        record = await session.get(ModelRecord, model.model_id)
+        if not record:
+            return
+        record.name = model.name
+        record.endpoint = model.endpoint
+        record.api_key = model.api_key
+        record.timeout = model.timeout
+        record.type = model.type
+        record.dimensions = model.dimensions
+        record.enable = model.enable
+        record.max_concurrency = model.max_concurrency
+        record.max_queue = model.max_queue
+        record.queue_timeout = model.queue_timeout
+        record.updated_at = datetime.now()
+        await session.execute(delete(ModelEndpointRecord).where(ModelEndpointRecord.model_id == model.model_id))
+        session.add_all(_endpoint_records(model.model_id, endpoints))
+    model_registry.put(model)
+
+
+async def adelete_model_entry(model_id: str) -> Optional[Model]:
+    """delete_model_entry 的异步版本。"""
+    async with get_async_db_session() as session:
+        record = await session.get(ModelRecord, model_id)
+        if not record:
+            return None
+        endpoints = await _aload_endpoints(session, [model_id])
+        model = _record_to_model(record, endpoints.get(model_id))
+        await session.delete(record)
+        await session.execute(delete(ModelEndpointRecord).where(ModelEndpointRecord.model_id == model_id))
+    model_registry.remove(model_id)
+    _invalidate_model_count()
+    return model
 
 
 # ============ Site Pydantic Models ============
@@ -220,3 +532,55 @@ def delete_site_entry(site_id: int) -> Optional[Site]:
         site = _record_to_site(record)
         session.delete(record)
         return site
+
+
+# ============ Site 异步 CRUD ============
+
+async def alist_sites() -> List[Site]:
+    """list_sites 的异步版本。"""
+    async with get_async_db_session() as session:
+        result = await session.execute(select(SiteRecord).order_by(SiteRecord.site_id))
+        rows = result.scalars().all()
+        return [_record_to_site(r) for r in rows]
+
+
+async def aget_site_by_id(site_id: int) -> Optional[Site]:
+    """get_site_by_id 的异步版本。"""
+    async with get_async_db_session() as session:
+        r = await session.get(SiteRecord, site_id)
+        return _record_to_site(r) if r else None
+
+
+async def acreate_site_entry(req: SiteCreateRequest) -> Site:
+    """create_site_entry 的异步版本。"""
+    async with get_async_db_session() as session:
+        # 获取当前最大 site_id
+        max_id = (await session.execute(select(SiteRecord.site_id).order_by(SiteRecord.site_id.desc()))).scalar()
+        new_id = (max_id or 0) + 1
+        record = SiteRecord(
+            site_id=new_id,
+            site_name=req.site_name,
+        )
+        session.add(record)
+        await session.flush()
+        return _record_to_site(record)
+
+
+async def asave_site(site: Site) -> None:
+    """save_site 的异步版本。"""
+    async with get_async_db_session() as session:
+        record = await session.get(SiteRecord, site.site_id)
+        if not record:
+            return
+        record.site_name = site.site_name
+
+
+async def adelete_site_entry(site_id: int) -> Optional[Site]:
+    """delete_site_entry 的异步版本。"""
+    async with get_async_db_session() as session:
+        record = await session.get(SiteRecord, site_id)
+        if not record:
+            return None
+        site = _record_to_site(record)
+        await session.delete(record)
+        return site
@@ -0,0 +1,112 @@
+"""
+进程内模型注册表。
+
+t_model 的数据几乎不变，chat 热路径直接从内存取 Model，避免每次请求都查库：
+- 启动时全量加载；
+- 本进程内的增删改（见 app.models.model 中的异步 CRUD）即时写入；
+- 定期轮询表指纹（行数 + 最大时间戳），其他 worker / 副本的修改在一个轮询周期内生效；
+- 不存在的 model_id 做短暂的负缓存，吸收批量的非法 ID 请求。
+"""
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config import ModelRegistryConfig
+
+if TYPE_CHECKING:
+    from app.models.model import Model
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    def __init__(self, cfg: Optional[ModelRegistryConfig] = None):
+        self._cfg = cfg or ModelRegistryConfig()
+        self._models: Dict[str, "Model"] = {}
+        self._missing: Dict[str, float] = {}
+        self._fingerprint: Any = None
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+
+    def configure(self, cfg: ModelRegistryConfig) -> None:
+        self._cfg = cfg
+
+    @property
+    def enabled(self) -> bool:
+        return self._cfg.enabled
+
+    def lookup(self, model_id: str) -> Tuple[bool, Optional["Model"]]:
+        """返回 (是否命中, Model)。命中负缓存时返回 (True, None)。"""
+        model = self._models.get(model_id)
+        if model is not None:
+            return True, model
+        expire_at = self._missing.get(model_id)
+        if expire_at is not None:
+            if expire_at > time.monotonic():
+                return True, None
+            self._missing.pop(model_id, None)
+        return False, None
+
+    def put(self, model: "Model") -> None:
+        self._models[model.model_id] = model
+        self._missing.pop(model.model_id, None)
+
+    def put_missing(self, model_id: str) -> None:
+        if self._cfg.negative_ttl_seconds <= 0:
+            return
+        if len(self._missing) >= self._cfg.negative_max_entries:
+            self._missing.clear()
+        self._missing[model_id] = time.monotonic() + self._cfg.negative_ttl_seconds
+
+    def remove(self, model_id: str) -> None:
+        self._models.pop(model_id, None)
+
+    def replace_all(self, models: List["Model"]) -> None:
+        self._models = {m.model_id: m for m in models}
+        self._missing.clear()
+        self.loaded = True
+
+    def all(self) -> List["Model"]:
+        return list(self._models.values())
+
+    async def start(
+            self,
+            loader: Callable[[], Awaitable[List["Model"]]],
+            fingerprint: Callable[[], Awaitable[Any]],
+    ) -> None:
+        """启动时全量加载，并开启指纹轮询任务。"""
+        if not self._cfg.enabled:
+            return
+        try:
+            self._fingerprint = await fingerprint()
+            self.replace_all(await loader())
+        except Exception:
+            # 数据库暂时不可用时不阻塞启动，查询会回落到数据库，轮询任务稍后补齐
+            logger.exception("模型注册表初始加载失败")
+        if self._cfg.refresh_seconds > 0 and self._task is None:
+            self._task = asyncio.create_task(self._poll(loader, fingerprint))
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _poll(self, loader, fingerprint) -> None:
+        while True:
+            await asyncio.sleep(self._cfg.refresh_seconds)
+            try:
+                fp = await fingerprint()
+                if fp != self._fingerprint or not self.loaded:
+                    self.replace_all(await loader())
+                    self._fingerprint = fp
+            except Exception:
+                logger.exception("模型注册表刷新失败")
+
+
+model_registry = ModelRegistry()
@@ -1,6 +1,9 @@
-from typing import Any, Optional
+from typing import Any, Dict, Optional
 
+import orjson
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
 
 
 class APIResponse(BaseModel):
@@ -9,11 +12,21 @@ class APIResponse(BaseModel):
     msg: str
 
 
-def success(data: Any = None, msg: str = "success") -> APIResponse:
-    return APIResponse(status=200, data=data, msg=msg)
+class APIJSONResponse(JSONResponse):
+    """
+    orjson 序列化的 JSON 响应。
+    路由直接返回它时 FastAPI 不再做 response_model 校验和 jsonable_encoder 转换；
+    content 中的 Pydantic 模型等 orjson 不认识的对象交给 pydantic-core 转换。
+    """
 
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=to_jsonable_python)
 
-def error(status: int, msg: str) -> APIResponse:
-    return APIResponse(status=status, data=None, msg=msg)
 
+def success(data: Any = None, msg: str = "success") -> APIJSONResponse:
+    return APIJSONResponse({"status": 200, "data": data, "msg": msg})
 
+
+def error(status: int, msg: str, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> APIJSONResponse:
+    """错误信封；HTTP 状态码默认仍为 200，错误码在 status 字段中。"""
+    return APIJSONResponse({"status": status, "data": None, "msg": msg}, status_code=status_code, headers=headers)
@@ -0,0 +1,85 @@
+"""
+nats.articleSubject 的 JetStream 拉取消费者：把批量的文章生成从同步 HTTP 挪到消息队列。
+
+消息体为 JSON：
+    {"id": "...", "model_id": "...", "prompt": "..." | "messages": [...], "reply_subject": "..."}
+处理方式与 /api/v1/models/chat/{model_id} 的非流式调用相同（缓存、合并、并发名额、多地址负载均衡都生效），
+结果 {"id", "status", "data"} 发布到 reply_subject（或 Reply-To 消息头），两者都没有时只确认不回复。
+上游 5xx、网络错误、模型繁忙按退避重投；JSON 错误、模型不存在直接 term。
+拉取、批量确认、退避重投见 jetstream_worker.PullConsumerWorker。
+
+单独运行：python -m app.services.article_worker（配置同样来自 MYAPI_CONFIG）。
+"""
+import asyncio
+import json
+import logging
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from app.config import ArticleWorkerConfig, NatsConfig, get_settings
+from app.models.model import ChatRequest, aget_model_cached
+from app.services.chat import build_messages, fetch_completion
+from app.services.jetstream_worker import ACK, NAK, PermanentError, PullConsumerWorker, run_until_signalled
+from app.services.limiter import ModelOverloaded
+
+logger = logging.getLogger(__name__)
+
+
+class ArticleWorker(PullConsumerWorker):
+    def __init__(self, nats_cfg: NatsConfig, cfg: ArticleWorkerConfig):
+        super().__init__(nats_cfg, cfg, nats_cfg.articleSubject, nats_cfg.articleConsumerName)
+
+    async def handle(self, msg) -> Tuple[str, Optional[float]]:
+        try:
+            data = json.loads(msg.data)
+            req = ChatRequest.model_validate(data)
+            model_id = data["model_id"]
+        except (ValueError, KeyError, TypeError, ValidationError) as e:
+            raise PermanentError(f"消息格式错误: {e}") from e
+        model = await aget_model_cached(model_id)
+        if model is None:
+            raise PermanentError(f"模型不存在: {model_id}")
+        messages = build_messages(req.prompt, [m.model_dump() for m in req.messages] if req.messages else None)
+        if messages is None:
+            raise PermanentError("prompt 或 messages 不能为空")
+
+        try:
+            status, content = await fetch_completion(model, {"model": model.type, "messages": messages})
+        except ModelOverloaded as e:
+            return self.retry_or_term(msg, e, e.retry_after)
+        except (HTTPException, OSError) as e:
+            return self.retry_or_term(msg, e)
+        if status >= 500:
+            action, delay = self.retry_or_term(msg, RuntimeError(f"HTTP {status}"))
+            if action == NAK:
+                return action, delay
+
+        reply = data.get("reply_subject") or (msg.headers or {}).get("Reply-To")
+        if reply:
+            body = json.dumps({"id": data.get("id"), "status": status, "data": content}, ensure_ascii=False)
+            await self.publish(reply, body.encode("utf-8"))
+        return ACK, None
+
+
+async def run_standalone() -> None:
+    """独立进程运行：初始化对话相关服务后一直消费，收到 SIGINT/SIGTERM 时优雅退出。"""
+    from app.db import init_async_db
+    from app.services.runtime import start_services, stop_services
+
+    settings = get_settings()
+    init_async_db(settings.db)
+    await start_services(settings)
+    worker = ArticleWorker(settings.nats, settings.article_worker)
+
+    async def stop() -> None:
+        await worker.stop()
+        await stop_services()
+
+    await run_until_signalled(worker.start, stop)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_standalone())
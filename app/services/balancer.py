@@ -0,0 +1,270 @@
+"""
+模型多上游地址的负载均衡与故障转移。
+
+- 地址池：t_model.endpoint（权重 1）加上 t_model_endpoint 中启用的地址，同一 URL 以后者的权重为准；
+- 选择：least_outstanding 按 (在途请求数 + 1) / 权重 取最小，ewma 再乘以首字节延迟的滑动平均；
+- 被动健康检查：连接失败、5xx、读取中断计为失败，连续失败达到阈值后熔断，
+  熔断到期放行一个试探请求，成功即恢复；所有地址都熔断时仍选最早到期的一个，不直接拒绝；
+- 重试：只在连接阶段失败（尚未收到任何字节）时换下一个地址，请求不会被上游处理两次。
+地址状态按 URL 保存在进程内，多个模型指向同一地址时共享健康状况。
+"""
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from app.config import BalancerConfig
+from app.models.model import Model
+from app.services.metrics import counter, histogram
+from app.services.upstream import get_upstream_client
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_FAILOVER = counter(
+    "upstream_failover_total",
+    "连接失败后换用其它上游地址重试的次数",
+    ("model_id",),
+)
+UPSTREAM_CIRCUIT_OPEN = counter(
+    "upstream_circuit_open_total",
+    "上游地址被熔断的次数",
+    ("endpoint",),
+)
+
+UPSTREAM_CONNECT_SECONDS = histogram(
+    "upstream_connect_seconds",
+    "新建上游连接的耗时（TCP 加 TLS），复用连接的请求不计入",
+    ("endpoint",),
+)
+UPSTREAM_HEADERS_SECONDS = histogram(
+    "upstream_response_headers_seconds",
+    "发出请求到收到上游响应头的耗时",
+    ("model_id",),
+)
+
+# 连接阶段的失败：请求尚未发出，可以安全地换地址重试
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class EndpointState:
+    __slots__ = ("url", "outstanding", "ewma", "failures", "open_until", "probing")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        # 首字节延迟（秒）的滑动平均，0 表示还没有样本（评分时按同池其它地址的平均值）
+        self.ewma = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+
+class EndpointLease:
+    """一次请求占用的上游地址；请求结束后必须 release()。"""
+
+    def __init__(self, balancer: "EndpointBalancer", state: EndpointState, probe: bool = False):
+        self._balancer = balancer
+        self._state = state
+        self._probe = probe
+        self._released = False
+
+    @property
+    def url(self) -> str:
+        return self._state.url
+
+    def record(self, ok: bool, latency: Optional[float] = None) -> None:
+        self._probe = False
+        self._balancer._record(self._state, ok, latency)
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._state.outstanding -= 1
+        if self._probe:
+            # 试探请求没有结果就结束了（如被取消），允许下一个请求继续试探
+            self._state.probing = False
+
+
+class EndpointBalancer:
+    def __init__(self, cfg: BalancerConfig):
+        self._cfg = cfg
+        self._states: Dict[str, EndpointState] = {}
+
+    @property
+    def max_attempts(self) -> int:
+        return max(1, self._cfg.max_attempts)
+
+    @staticmethod
+    def candidates(model: Model) -> List[Tuple[str, int]]:
+        """模型的有效地址池 [(url, 权重)]，按首次出现顺序去重。"""
+        pool: Dict[str, int] = {}
+        if model.endpoint:
+            pool[model.endpoint] = 1
+        for e in model.endpoints:
+            if e.enable == 1:
+                pool[e.endpoint] = max(1, e.weight)
+            else:
+                pool.pop(e.endpoint, None)
+        return list(pool.items())
+
+    def _state(self, url: str) -> EndpointState:
+        state = self._states.get(url)
+        if state is None:
+            state = EndpointState(url)
+            self._states[url] = state
+        return state
+
+    def _score(self, state: EndpointState, weight: int, seed: float) -> float:
+        score = (state.outstanding + 1) / weight
+        if self._cfg.strategy == "ewma":
+            score *= state.ewma or seed
+        return score
+
+    @staticmethod
+    def _ewma_seed(pool: Sequence[Tuple[EndpointState, int]]) -> float:
+        """还没有延迟样本的地址按池中已有样本的平均值评分，不会因为 0 分而接下所有请求。"""
+        sampled = [s.ewma for s, _ in pool if s.ewma > 0]
+        return sum(sampled) / len(sampled) if sampled else 1.0
+
+    def acquire(self, model: Model, exclude: Sequence[str] = ()) -> Optional[EndpointLease]:
+        """选择一个地址并占用；exclude 中的地址（本次请求已失败过）不再选择，没有可选地址时返回 None。"""
+        now = time.monotonic()
+        pool = [(self._state(url), w) for url, w in self.candidates(model) if url not in exclude]
+        if not pool:
+            return None
+        available = [(s, w) for s, w in pool if s.open_until <= now and not s.probing]
+        probe = False
+        if available:
+            seed = self._ewma_seed(pool)
+            state, _ = min(available, key=lambda sw: (self._score(*sw, seed), random.random()))
+            if state.open_until > 0:
+                # 熔断到期：只放行这一个试探请求
+                state.probing = probe = True
+        else:
+            # 全部熔断：选最早到期的地址，保持与单地址时一致的行为
+            state, _ = min(pool, key=lambda sw: sw[0].open_until)
+        state.outstanding += 1
+        return EndpointLease(self, state, probe)
+
+    def outstanding(self, model: Model) -> int:
+        """模型所有地址上的在途请求数之和。"""
+        return sum(self._state(url).outstanding for url, _ in self.candidates(model))
+
+    def _record(self, state: EndpointState, ok: bool, latency: Optional[float]) -> None:
+        if ok:
+            state.failures = 0
+            state.open_until = 0.0
+            state.probing = False
+            if latency is not None:
+                alpha = self._cfg.ewma_alpha
+                state.ewma = latency if state.ewma == 0 else alpha * latency + (1 - alpha) * state.ewma
+            return
+        state.failures += 1
+        if state.probing or state.failures >= self._cfg.failure_threshold:
+            if not state.probing:
+                logger.warning("上游地址连续失败 %d 次，熔断 %.0f 秒: %s",
+                               state.failures, self._cfg.open_seconds, state.url)
+            state.probing = False
+            state.open_until = time.monotonic() + self._cfg.open_seconds
+            UPSTREAM_CIRCUIT_OPEN.inc(state.url)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "endpoint": s.url,
+                "outstanding": s.outstanding,
+                "ewma_ms": round(s.ewma * 1000, 1),
+                "failures": s.failures,
+                "open": s.open_until > now,
+            }
+            for s in self._states.values()
+        ]
+
+
+_balancer: Optional[EndpointBalancer] = None
+
+
+def init_balancer(cfg: BalancerConfig) -> EndpointBalancer:
+    global _balancer
+    _balancer = EndpointBalancer(cfg)
+    return _balancer
+
+
+def get_balancer() -> EndpointBalancer:
+    """未经 lifespan 初始化时（如脚本）按默认配置懒加载。"""
+    if _balancer is None:
+        init_balancer(BalancerConfig())
+    return _balancer
+
+
+class _ConnectTrace:
+    """httpx 的 trace 回调：记录本次请求新建连接的耗时，复用连接时不会触发。"""
+
+    __slots__ = ("started", "seconds")
+
+    def __init__(self):
+        self.started = 0.0
+        self.seconds: Optional[float] = None
+
+    async def __call__(self, event: str, info: Dict[str, Any]) -> None:
+        if event == "connection.connect_tcp.started":
+            self.started = time.perf_counter()
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            self.seconds = time.perf_counter() - self.started
+
+
+async def open_upstream(
+        model: Model,
+        payload: Dict[str, Any],
+        headers: Dict[str, str],
+        timeout: httpx.Timeout,
+        exclude: Sequence[str] = (),
+        used: Optional[List[str]] = None,
+) -> Tuple[httpx.Response, EndpointLease]:
+    """
+    选择地址发出请求，收到响应头后返回 (未读取响应体的响应, 地址占用)。
+    连接阶段失败时换下一个地址，最多 max_attempts 次；调用方负责 aclose() 响应并 release() 占用。
+    exclude 中的地址不会被选择；传入 used 时每次选中的地址都会追加进去（对冲请求据此避开）。
+    timeout 用 upstream_timeout() 构造：请求级的超时会整体替换客户端的设置，连接超时也要在其中。
+    """
+    balancer = get_balancer()
+    tried: List[str] = []
+    while True:
+        lease = balancer.acquire(model, [*exclude, *tried])
+        if lease is None:
+            raise httpx.ConnectError(f"模型 {model.model_id} 没有可用的上游地址")
+        if used is not None:
+            used.append(lease.url)
+        start = time.monotonic()
+        trace = _ConnectTrace()
+        try:
+            client = await get_upstream_client(lease.url)
+            request = client.build_request(
+                "POST", lease.url, json=payload, headers=headers, timeout=timeout, extensions={"trace": trace},
+            )
+            resp = await client.send(request, stream=True)
+        except RETRYABLE_ERRORS:
+            lease.record(False)
+            lease.release()
+            tried.append(lease.url)
+            if len(tried) >= balancer.max_attempts or len(tried) + len(exclude) >= len(balancer.candidates(model)):
+                raise
+            UPSTREAM_FAILOVER.inc(model.model_id)
+            continue
+        except httpx.HTTPError:
+            lease.record(False)
+            lease.release()
+            raise
+        except BaseException:
+            lease.release()
+            raise
+        elapsed = time.monotonic() - start
+        if trace.seconds is not None:
+            UPSTREAM_CONNECT_SECONDS.observe(lease.url, value=trace.seconds)
+        UPSTREAM_HEADERS_SECONDS.observe(model.model_id, value=elapsed)
+        lease.record(resp.status_code < 500, elapsed)
+        return resp, lease
@@ -0,0 +1,269 @@
+"""
+一次上游流式生成的扇出缓冲。
+
+生产者（读取上游的后台任务）只管追加输出；每个订阅者（一个 SSE 客户端）从自己的位置开始读，
+后加入的订阅者会先补发已经生成的部分，因此多个相同请求可以共享同一次上游生成。
+设置 linger 时最后一个订阅者离开后不立即取消生成，等待这么久仍无人重新订阅（断线续传）才取消。
+
+背压：SSE 客户端用 attach / advance 登记自己已写出的位置，lag 为最慢的客户端落后生成的长度，
+所有流的 lag 之和见 total_lag()；生产者可用 wait_drained 等客户端追上后再继续读取上游，超时后用 drop_lagging 放弃落后的客户端。
+设置了 max_retained（开启背压时）的不可续传流，保留的内容超过该长度且每个订阅者都已登记游标时，
+丢弃所有客户端都已写出的分段（此后不再接受新的合并订阅）；未超过时保留全部，后加入的相同请求仍可合并。
+"""
+import asyncio
+from typing import Dict, List, Optional, Set, Union
+
+Chunk = Union[bytes, str]
+
+# 所有流的 lag 之和，以及 lag 大于 0 的流数
+_total_lag = 0
+_lagging = 0
+
+
+def total_lag() -> int:
+    return _total_lag
+
+
+def lagging_streams() -> int:
+    return _lagging
+
+
+class StreamBroadcast:
+    def __init__(
+            self,
+            key: Optional[str] = None,
+            as_bytes: bool = True,
+            linger: float = 0,
+            max_retained: Optional[int] = None,
+    ):
+        self.key = key
+        self.empty: Chunk = b"" if as_bytes else ""
+        # 仍保留的分段；之前的 base 段（共 base_offset 长度）已被丢弃
+        self.chunks: List[Chunk] = []
+        self.base = 0
+        self.base_offset = 0
+        # 保留内容超过该长度时才丢弃已写出的分段，None 表示从不丢弃
+        self.max_retained = max_retained
+        # 已追加内容的总长度（bytes 模式为字节数，text 模式为字符数）
+        self.size = 0
+        # 断线续传用的流 ID，未开启续传时为 None
+        self.stream_id: Optional[str] = None
+        self.linger = linger
+        # 无人订阅、linger 到期后被取消
+        self.abandoned = False
+        self._linger_handle: Optional[asyncio.TimerHandle] = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # 所有订阅者都离开后置为 True，此后不再接受新的订阅
+        self.closing = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        # 客户端游标：编号 -> 已写出的长度
+        self._cursors: Dict[int, int] = {}
+        # 因落后过多被放弃的游标，订阅者下次醒来时退出
+        self._dropped: Set[int] = set()
+        self._next_cursor = 0
+        # 最慢的客户端落后的长度
+        self.lag = 0
+        self._drained = asyncio.Event()
+
+    @property
+    def joinable(self) -> bool:
+        return not self.done and not self.closing and self.base == 0
+
+    @property
+    def count(self) -> int:
+        """已追加的分段数（含已丢弃的）。"""
+        return self.base + len(self.chunks)
+
+    @property
+    def retained(self) -> int:
+        """仍保留在内存中的内容长度。"""
+        return self.size - self.base_offset
+
+    def append(self, chunk: Chunk) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self._cursors:
+            self._update_lag()
+        elif self._dropped:
+            self._trim()
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def read_from(self, index: int) -> Chunk:
+        """取出第 index 段之后已生成的全部内容（多块时合并成一次写出）；index 早于已丢弃的部分时抛出 IndexError。"""
+        if index < self.base:
+            raise IndexError(f"第 {index} 段已被丢弃（已丢弃 {self.base} 段）")
+        index -= self.base
+        if len(self.chunks) - index == 1:
+            return self.chunks[index]
+        return self.empty.join(self.chunks[index:])
+
+    def changed(self) -> asyncio.Event:
+        """返回当前的变更事件；下一次 append / finish 时被 set。"""
+        return self._changed
+
+    def subscribe(self) -> None:
+        self.subscribers += 1
+        if self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._linger_handle = None
+
+    def unsubscribe(self) -> bool:
+        """
+        退订；最后一个订阅者离开且生成未结束时取消生产者，返回是否立即取消了上游。
+        设置了 linger 时改为延迟取消，期间仍可重新订阅。
+        """
+        self.subscribers -= 1
+        if self.subscribers > 0 or self.done:
+            return False
+        if self.linger > 0 and self.task is not None and not self.task.done():
+            self._linger_handle = asyncio.get_running_loop().call_later(self.linger, self._abandon)
+            return False
+        self.closing = True
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            return True
+        return False
+
+    def forget(self) -> None:
+        """不再供续传：按不可续传的流丢弃已写出的分段，正在延迟取消的生成立即取消。"""
+        self.stream_id = None
+        self.linger = 0
+        if self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._abandon()
+        self._trim()
+
+    def offset_of(self, index: int) -> int:
+        """前 index 段的总长度；index 早于已丢弃的部分时抛出 IndexError。"""
+        if index < self.base:
+            raise IndexError(f"第 {index} 段已被丢弃（已丢弃 {self.base} 段）")
+        if index >= self.count:
+            return self.size
+        return self.base_offset + sum(len(c) for c in self.chunks[:index - self.base])
+
+    def attach(self, position: int) -> int:
+        """登记一个从 position 开始写出的客户端，返回游标编号。"""
+        cursor = self._next_cursor
+        self._next_cursor += 1
+        self._cursors[cursor] = position
+        self._update_lag()
+        return cursor
+
+    def advance(self, cursor: int, position: int) -> None:
+        if cursor not in self._cursors:
+            return
+        self._cursors[cursor] = position
+        self._update_lag()
+        self._trim()
+
+    def detach(self, cursor: int) -> None:
+        self._cursors.pop(cursor, None)
+        self._dropped.discard(cursor)
+        self._update_lag()
+        self._trim()
+
+    def is_dropped(self, cursor: int) -> bool:
+        return cursor in self._dropped
+
+    def lag_of(self, cursor: int) -> int:
+        return self.size - self._cursors.get(cursor, self.size)
+
+    def over_budget(self, max_lag: int, max_total_lag: int) -> bool:
+        """最慢的客户端落后超过 max_lag，或本流有积压且所有流的 lag 之和超过 max_total_lag。"""
+        return self.lag > max_lag or (self.lag > 0 and _total_lag > max_total_lag)
+
+    async def wait_drained(self, max_lag: int, max_total_lag: int, timeout: float, poll: float = 0.1) -> bool:
+        """
+        等到 over_budget 不再成立，最多等待 timeout 秒（0 表示不限），返回是否已追上。
+        其它流的进度不会唤醒本流，超出总量时按 poll 秒轮询。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout > 0 else None
+        while self.over_budget(max_lag, max_total_lag):
+            wait = poll if self.lag <= max_lag else None
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                wait = remaining if wait is None else min(wait, remaining)
+            self._drained.clear()
+            try:
+                await asyncio.wait_for(self._drained.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    def drop_lagging(self, max_lag: int) -> int:
+        """
+        放弃落后超过 max_lag 的客户端（没有时放弃最慢的一个），返回放弃的个数。
+        被放弃的游标不再计入 lag，对应的订阅者下次醒来时退出。
+        """
+        lagging = [c for c, pos in self._cursors.items() if self.size - pos > max_lag]
+        if not lagging and self._cursors:
+            slowest = min(self._cursors, key=self._cursors.get)
+            if self._cursors[slowest] < self.size:
+                lagging = [slowest]
+        for cursor in lagging:
+            del self._cursors[cursor]
+            self._dropped.add(cursor)
+        if lagging:
+            self._update_lag()
+            self._trim()
+            self._notify()
+        return len(lagging)
+
+    def _trim(self) -> None:
+        """
+        保留内容超过 max_retained 时丢弃所有客户端都已写出的分段；
+        可续传的流、或有订阅者尚未登记游标（如刚加入、异步任务）时保留全部。
+        """
+        if self.max_retained is None or self.retained <= self.max_retained:
+            return
+        if self.stream_id is not None or not (self._cursors or self._dropped):
+            return
+        if self.subscribers != len(self._cursors) + len(self._dropped):
+            return
+        low = min(self._cursors.values()) if self._cursors else self.size
+        offset = self.base_offset
+        n = 0
+        for chunk in self.chunks:
+            if offset + len(chunk) > low:
+                break
+            offset += len(chunk)
+            n += 1
+        if n:
+            del self.chunks[:n]
+            self.base += n
+            self.base_offset = offset
+
+    def _update_lag(self) -> None:
+        global _total_lag, _lagging
+        lag = self.size - min(self._cursors.values()) if self._cursors else 0
+        _total_lag += lag - self.lag
+        _lagging += (lag > 0) - (self.lag > 0)
+        if lag < self.lag:
+            self._drained.set()
+        self.lag = lag
+
+    def _abandon(self) -> None:
+        self._linger_handle = None
+        if self.subscribers > 0 or self.done:
+            return
+        self.closing = True
+        self.abandoned = True
+        if self.task is not None:
+            self.task.cancel()
+
+    def _notify(self) -> None:
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
@@ -1,100 +1,576 @@
-from typing import Dict, Any
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 
+import asyncio
 import httpx
-from fastapi.responses import StreamingResponse, JSONResponse
-import codecs
+from fastapi import Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 import time
 
 from app.config import get_settings
 
 from app.models.model import Model
+from app.models.response import APIJSONResponse
+from app.services.balancer import open_upstream
+from app.services.broadcast import StreamBroadcast, lagging_streams, total_lag
+from app.services.hedge import open_hedged
+from app.services.limiter import concurrency_limiter
+from app.services.metrics import CHAT_STREAM_CANCELLED, counter, gauge, histogram, on_collect
+from app.services.ratelimit import estimate_tokens
+from app.services.response_cache import get_response_cache, chat_request_key
+from app.services.semantic_cache import get_semantic_cache
+from app.services.sse import relay_sse_bytes, relay_sse_text, with_event_id
+from app.services.stream_replay import get_stream_replay
+from app.services.upstream import upstream_timeout
+from app.services.usage import StreamUsage, get_usage_recorder, completion_usage
 
 
-async def stream_to_client(model: Model, payload: Dict[str, Any]) -> StreamingResponse:
+PROMPT_PATH = Path(__file__).resolve().parents[1] / "prompts" / "system_prompt.txt"
+SYSTEM_PROMPT = PROMPT_PATH.read_text(encoding="utf-8").strip()
+
+SSE_IDLE_TIMEOUT_EVENT = b'event: error\ndata: {"error": "upstream idle timeout"}\n\n'
+SSE_CLIENT_SLOW_EVENT = b'event: error\ndata: {"error": "client too slow"}\n\n'
+
+CHAT_COALESCED = counter(
+    "chat_coalesced_total",
+    "与进行中的相同请求合并、未单独请求上游的对话数",
+    ("model_id", "mode"),
+)
+
+CHAT_STREAM_FIRST_BYTE = histogram(
+    "chat_stream_first_byte_seconds",
+    "流式对话从请求上游到转发出第一段内容的耗时",
+    ("model_id",),
+)
+CHAT_STREAM_SECONDS = histogram(
+    "chat_stream_duration_seconds",
+    "流式对话上游生成的总耗时",
+    ("model_id",),
+)
+CHAT_STREAM_BYTES = counter(
+    "chat_stream_bytes_total",
+    "流式对话转发的字节数（text 模式为字符数）",
+    ("model_id",),
+)
+CHAT_STREAM_CHUNKS = counter(
+    "chat_stream_chunks_total",
+    "流式对话转发的分段数",
+    ("model_id",),
+)
+CHAT_STREAM_RESUMED = counter(
+    "chat_stream_resumed_total",
+    "带 Last-Event-ID 的重连：resumed 为从断点继续，miss 为无法续传、按新请求处理",
+    ("model_id", "result"),
+)
+CHAT_STREAM_PAUSED = histogram(
+    "chat_stream_paused_seconds",
+    "背压：客户端落后过多时暂停读取上游的时长",
+    ("model_id",),
+)
+SSE_CLIENT_LAG = gauge("sse_client_lag_bytes", "所有流中最慢的客户端落后生成的长度之和")
+CHAT_ONCE_SECONDS = histogram(
+    "chat_once_duration_seconds",
+    "非流式对话（call_model_once）的耗时，含缓存命中和排队",
+    ("model_id",),
+)
+
+# 进行中的相同请求：key 为 chat_request_key
+_inflight_streams: Dict[str, StreamBroadcast] = {}
+_inflight_calls: Dict[str, asyncio.Task] = {}
+
+
+def build_messages(prompt: Optional[str], messages: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+    """由 prompt 或 messages 构造对话消息，没有系统提示词时补上默认的；两者都为空时返回 None。"""
+    if messages:
+        result = [m for m in messages if m.get("content")]
+    elif prompt:
+        result = [
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ]
+    else:
+        return None
+
+    has_system = any(m.get("role") == "system" for m in result)
+    if not has_system:
+        result = [{"role": "system", "content": SYSTEM_PROMPT}] + result
+    return result
+
+
+async def _wait_disconnected(request: Request, interval: float) -> None:
+    """轮询直到客户端断开。"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def _produce_stream(model: Model, payload: Dict[str, Any], bc: StreamBroadcast) -> None:
     """
-    将下游大模型的 HTTP 流转换为 SSE 格式并转发给前端。
+    后台读取上游流并写入 bc；所有订阅者离开时会被取消，上游连接随之关闭。
+    模型配置了多个上游地址时由 open_upstream 选择，连接失败自动换地址；开启对冲时首段内容过慢会向备选上游再发一份。
+    sse_backpressure 为 pause 时，最慢的客户端落后超过上限就暂停读取上游，直到它追上；
+    暂停超过 sse_max_pause_seconds 仍未追上时断开落后的客户端，继续生成。
     """
+    server_cfg = get_settings().server
+    idle_timeout = server_cfg.sse_idle_timeout_seconds
+    as_bytes = isinstance(bc.empty, bytes)
+    replay = get_stream_replay() if bc.stream_id is not None else None
+    usage = StreamUsage() if get_usage_recorder() is not None else None
     headers = {
         "Content-Type": "application/json",
         "Accept": "text/event-stream",
         "Authorization": f"Bearer {model.api_key.strip()}",
     }
-    timeout = model.timeout or 30
-
-    async def event_stream():
-        heartbeat_interval = get_settings().server.sse_heartbeat_seconds
-        last_heartbeat = None
-        decoder = codecs.getincrementaldecoder("utf-8")()
-        buffer = ""
-        def to_sse_line(text: str) -> str:
-            if text.startswith(("data:", "event:", "id:", "retry:", ":")):
-                return f"{text}\n"
-            return f"data: {text}\n\n"
-
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            async with client.stream("POST", model.endpoint, json=payload, headers=headers) as r:
-                async for chunk in r.aiter_bytes():
-                    now = time.monotonic()
-                    if last_heartbeat is None:
-                        last_heartbeat = now
-                    if heartbeat_interval > 0 and now - last_heartbeat >= heartbeat_interval:
-                        last_heartbeat = now
-                        yield ": ping\n\n"
-                    if not chunk:
-                        continue
-                    buffer += decoder.decode(chunk)
-                    if "\n" not in buffer:
-                        # If upstream is SSE, wait for a full line before forwarding
-                        if buffer.startswith("data:"):
-                            continue
-                        # Otherwise, emit chunk immediately as SSE data for typewriter effect
-                        yield to_sse_line(buffer)
-                        buffer = ""
-                        continue
-                    while "\n" in buffer:
-                        line, buffer = buffer.split("\n", 1)
-                        line = line.rstrip("\r")
-                        if line == "":
-                            yield "\n"
-                            continue
-                        yield to_sse_line(line)
-                # flush remaining buffer
-                tail = buffer.strip()
-                if tail:
-                    yield to_sse_line(tail)
+    # 空闲截止由下面的计时器负责，关闭 httpx 的读超时，避免长时间思考时被提前打断
+    stream_timeout = upstream_timeout(model.timeout, read=idle_timeout <= 0)
+
+    def append(out) -> None:
+        bc.append(out)
+        if replay is not None:
+            replay.charge(bc, len(out))
+        if usage is not None:
+            usage.feed(out)
+
+    def upstream_idle() -> None:
+        # 上游长时间无输出：告知客户端后正常结束，不再挂起连接
+        CHAT_STREAM_CANCELLED.inc(model.model_id, "upstream_idle")
+        append(SSE_IDLE_TIMEOUT_EVENT if as_bytes else SSE_IDLE_TIMEOUT_EVENT.decode("utf-8"))
+
+    lease = None
+    start = time.monotonic()
+    chunks = size = status = 0
+    try:
+        try:
+            # 开启对冲时在这里等到第一段内容，同样受空闲截止约束
+            r, lease, body = await asyncio.wait_for(
+                open_hedged(model, payload, headers, stream_timeout, first_chunk=True),
+                idle_timeout if idle_timeout > 0 else None,
+            )
+        except asyncio.TimeoutError:
+            upstream_idle()
+            bc.finish()
+            return
+        status = r.status_code
+        try:
+            if as_bytes:
+                is_sse = r.headers.get("content-type", "").startswith("text/event-stream") or None
+                relay = relay_sse_bytes(body, is_sse)
+            else:
+                relay = relay_sse_text(body)
+            relay_iter = relay.__aiter__()
+            pause = server_cfg.sse_backpressure == "pause"
+            max_lag, max_total_lag = server_cfg.sse_client_max_lag_bytes, server_cfg.sse_max_lag_bytes
+            while True:
+                if pause and bc.over_budget(max_lag, max_total_lag):
+                    # 客户端跟不上：先不读上游，积压留在上游连接的 TCP 窗口里
+                    paused_at = time.monotonic()
+                    if not await bc.wait_drained(max_lag, max_total_lag, server_cfg.sse_max_pause_seconds):
+                        bc.drop_lagging(max_lag)
+                    CHAT_STREAM_PAUSED.observe(model.model_id, value=time.monotonic() - paused_at)
+                try:
+                    out = await asyncio.wait_for(relay_iter.__anext__(), idle_timeout if idle_timeout > 0 else None)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    upstream_idle()
+                    break
+                if not chunks:
+                    CHAT_STREAM_FIRST_BYTE.observe(model.model_id, value=time.monotonic() - start)
+                chunks += 1
+                size += len(out)
+                append(out)
+        except httpx.HTTPError:
+            # 已开始输出后的读取失败不重试，只计入该地址的健康状况
+            lease.record(False)
+            raise
+        finally:
+            await r.aclose()
+    except asyncio.CancelledError:
+        if bc.abandoned:
+            CHAT_STREAM_CANCELLED.inc(model.model_id, "resume_timeout")
+        bc.finish()
+        raise
+    except Exception as e:
+        bc.finish(e)
+    else:
+        bc.finish()
+    finally:
+        if replay is not None:
+            replay.finished(bc)
+        if lease is not None:
+            lease.release()
+            CHAT_STREAM_SECONDS.observe(model.model_id, value=time.monotonic() - start)
+            CHAT_STREAM_CHUNKS.inc(model.model_id, amount=chunks)
+            CHAT_STREAM_BYTES.inc(model.model_id, amount=size)
+        recorder = get_usage_recorder()
+        if recorder is not None and usage is not None:
+            tokens = usage.result(payload.get("messages") or [])
+            recorder.record(model.model_id, "stream", *tokens, time.monotonic() - start, status)
+        if bc.key is not None and _inflight_streams.get(bc.key) is bc:
+            del _inflight_streams[bc.key]
+
+
+async def _subscribe_stream(
+        model: Model,
+        bc: StreamBroadcast,
+        request: Optional[Request],
+        start: int = 0,
+):
+    """
+    单个 SSE 客户端的输出：从第 start 段起补发 bc 中已有内容，之后跟随生成进度；
+    同时负责该客户端的定时心跳和断开检测。开启续传时每次输出的最后一个事件带上事件 ID。
+    已写出的位置登记在 bc 中用于背压；sse_backpressure 为 drop 时，落后过多的客户端在下一次写出时被断开，
+    为 pause 时被生成方放弃（暂停超时）的客户端同样断开。
+    """
+    server_cfg = get_settings().server
+    heartbeat_interval = server_cfg.sse_heartbeat_seconds
+    heartbeat = b": ping\n\n" if isinstance(bc.empty, bytes) else ": ping\n\n"
+    watcher = None
+    if request is not None and server_cfg.sse_disconnect_poll_seconds > 0:
+        watcher = asyncio.ensure_future(_wait_disconnected(request, server_cfg.sse_disconnect_poll_seconds))
+    waiter = None
+    index = start
+    position = bc.offset_of(start)
+    cursor = bc.attach(position)
+    drop = server_cfg.sse_backpressure == "drop"
+    last_sent = time.monotonic()
+    reason = "closed"
+    try:
+        while True:
+            if bc.is_dropped(cursor):
+                reason = "client_slow"
+                yield SSE_CLIENT_SLOW_EVENT if isinstance(bc.empty, bytes) else SSE_CLIENT_SLOW_EVENT.decode("utf-8")
+                return
+            if index < bc.count:
+                if drop and _too_far_behind(bc.size - position, server_cfg):
+                    reason = "client_slow"
+                    yield SSE_CLIENT_SLOW_EVENT if isinstance(bc.empty, bytes) else SSE_CLIENT_SLOW_EVENT.decode("utf-8")
+                    return
+                out = bc.read_from(index)
+                index = bc.count
+                last_sent = time.monotonic()
+                yield out if bc.stream_id is None else with_event_id(out, f"{bc.stream_id}-{index}")
+                # yield 返回时这段输出已交给连接的发送缓冲
+                position += len(out)
+                bc.advance(cursor, position)
+                continue
+            if bc.done:
+                if bc.error is not None:
+                    raise bc.error
+                return
+
+            # 同时等待：新的输出、客户端断开、下一次心跳
+            waiter = asyncio.ensure_future(bc.changed().wait())
+            waits = (waiter, watcher) if watcher is not None else (waiter,)
+            wait_timeout = None
+            if heartbeat_interval > 0:
+                wait_timeout = max(0.0, last_sent + heartbeat_interval - time.monotonic())
+            await asyncio.wait(waits, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not waiter.done():
+                waiter.cancel()
+            waiter = None
+
+            if watcher is not None and watcher.done():
+                reason = "client_disconnect"
+                return
+            if heartbeat_interval > 0 and time.monotonic() - last_sent >= heartbeat_interval and index >= bc.count:
+                last_sent = time.monotonic()
+                yield heartbeat
+    except asyncio.CancelledError:
+        # Starlette 监听到 http.disconnect 后会直接取消响应任务
+        reason = "cancelled"
+        raise
+    finally:
+        bc.detach(cursor)
+        if watcher is not None:
+            watcher.cancel()
+        if waiter is not None:
+            waiter.cancel()
+        # 最后一个订阅者离开时取消上游生成（开启续传时延迟取消）；因落后过多被断开的客户端总是计入
+        if bc.unsubscribe() or reason == "client_slow":
+            CHAT_STREAM_CANCELLED.inc(model.model_id, reason)
+
+
+def _too_far_behind(lag: int, server_cfg) -> bool:
+    """drop 背压：单个客户端落后超过上限，或总量超限时落后超过平均份额。"""
+    if lag > server_cfg.sse_client_max_lag_bytes:
+        return True
+    return lag > 0 and total_lag() > server_cfg.sse_max_lag_bytes and lag * max(1, lagging_streams()) > server_cfg.sse_max_lag_bytes
+
+
+def _join_stream(model: Model, key: Optional[str]) -> Optional[StreamBroadcast]:
+    if key is None:
+        return None
+    bc = _inflight_streams.get(key)
+    if bc is None or not bc.joinable:
+        return None
+    bc.subscribe()
+    CHAT_COALESCED.inc(model.model_id, "stream")
+    return bc
+
+
+async def open_stream(model: Model, payload: Dict[str, Any]) -> StreamBroadcast:
+    """
+    启动（或加入进行中的相同）上游流式生成，返回已订阅的 StreamBroadcast。
+    新的生成需要先拿到模型的并发名额（可能排队，满时抛出 ModelOverloaded），名额占用到生成结束。
+    调用方读取完毕后需调用 unsubscribe()。
+    """
+    server_cfg = get_settings().server
+    coalesce = get_settings().coalesce.enabled
+    key = chat_request_key(model, payload) if coalesce else None
+    bc = _join_stream(model, key)
+    if bc is not None:
+        return bc
 
+    slot = await concurrency_limiter.acquire(model)
+    # 排队期间可能已有相同请求开始生成
+    bc = _join_stream(model, key)
+    if bc is not None:
+        slot.release()
+        return bc
+
+    replay = get_stream_replay()
+    # 开启续传时，客户端全部断开后生成继续 grace 秒等待重连；
+    # 开启背压时缓冲超过单个客户端的落后上限才丢弃已写出的部分，之前仍可合并相同请求
+    bc = StreamBroadcast(
+        key,
+        as_bytes=server_cfg.sse_relay_mode == "bytes",
+        linger=replay.grace_seconds if replay is not None else 0,
+        max_retained=server_cfg.sse_client_max_lag_bytes if server_cfg.sse_backpressure != "off" else None,
+    )
+    bc.subscribe()
+    if replay is not None:
+        replay.register(bc, model.model_id)
+    if key is not None:
+        _inflight_streams[key] = bc
+    bc.task = asyncio.create_task(_produce_stream(model, payload, bc))
+    # 用完成回调释放名额：任务在开始执行前被取消时 finally 不会运行
+    bc.task.add_done_callback(lambda _: slot.release())
+    return bc
+
+
+def _sse_response(model: Model, bc: StreamBroadcast, request: Optional[Request], start: int = 0) -> StreamingResponse:
+    headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Accel-Buffering": "no",
+    }
+    if bc.stream_id is not None:
+        headers["X-Stream-Id"] = bc.stream_id
     return StreamingResponse(
-        event_stream(),
+        _subscribe_stream(model, bc, request, start),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
+        headers=headers,
     )
 
 
-async def call_model_once(model: Model, payload: Dict[str, Any]) -> JSONResponse:
+async def stream_to_client(
+        model: Model,
+        payload: Dict[str, Any],
+        request: Optional[Request] = None,
+) -> StreamingResponse:
     """
-    非流式场景：一次性请求下游大模型并返回 JSON。
+    将下游大模型的 HTTP 流转换为 SSE 格式并转发给前端。
+    相同的请求并发到达时共享同一次上游生成，后到的客户端会先补发已生成的部分。
+    传入 request 时会检测客户端断开，所有客户端都断开后中止上游请求、释放连接（开启续传时等待 grace 秒后）。
+    """
+    bc = await open_stream(model, payload)
+    return _sse_response(model, bc, request)
+
+
+def follow_stream(model: Model, bc: StreamBroadcast, request: Optional[Request] = None) -> StreamingResponse:
+    """订阅已有的生成（如异步任务的流式输出）：从头补发已生成的部分，之后跟随生成进度。"""
+    bc.subscribe()
+    return _sse_response(model, bc, request)
+
+
+def resume_stream(model: Model, last_event_id: str, request: Optional[Request] = None) -> Optional[StreamingResponse]:
+    """
+    断线重连：Last-Event-ID 对应的生成仍在保留期内时，从断点继续输出，不再请求上游。
+    无法续传（未开启、已过期或被淘汰）时返回 None，调用方按新请求处理。
     """
+    replay = get_stream_replay()
+    resumed = replay.resume(last_event_id, model.model_id) if replay is not None else None
+    CHAT_STREAM_RESUMED.inc(model.model_id, "resumed" if resumed is not None else "miss")
+    if resumed is None:
+        return None
+    bc, start = resumed
+    return _sse_response(model, bc, request, start)
+
+
+async def _request_completion(model: Model, payload: Dict[str, Any]) -> Tuple[int, Any, int]:
+    """请求上游一次，返回 (状态码, JSON 内容, 响应字节数)；开启用量记录时记一条 once 用量。"""
+    start = time.monotonic()
+    status, content, size = 0, None, -1
+    try:
+        status, content, size = await _post_completion(model, payload)
+        return status, content, size
+    finally:
+        recorder = get_usage_recorder()
+        if recorder is not None:
+            tokens = completion_usage(payload.get("messages") or [], content)
+            recorder.record(model.model_id, "once", *tokens, time.monotonic() - start, status)
+
+
+async def _post_completion(model: Model, payload: Dict[str, Any]) -> Tuple[int, Any, int]:
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {model.api_key.strip()}",
     }
-    timeout = model.timeout or 30
+    timeout = upstream_timeout(model.timeout)
 
-    async with httpx.AsyncClient(timeout=timeout) as client:
+    try:
+        resp, lease, _ = await open_hedged(model, payload, headers, timeout, first_chunk=False)
         try:
-            resp = await client.post(model.endpoint, json=payload, headers=headers)
-        except httpx.HTTPError as e:
-            from fastapi import HTTPException
-
-            raise HTTPException(status_code=502, detail=f"大模型请求失败: {e}") from e
+            await resp.aread()
+        except httpx.HTTPError:
+            lease.record(False)
+            raise
+        finally:
+            await resp.aclose()
+            lease.release()
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"大模型请求失败: {e}") from e
 
     try:
         content = resp.json()
     except Exception:
-        content = {"error": resp.text or f"HTTP {resp.status_code}"}
+        # 非 JSON 响应不进入缓存
+        return resp.status_code, {"error": resp.text or f"HTTP {resp.status_code}"}, -1
+    return resp.status_code, content, len(resp.content)
+
+
+async def fetch_completion(model: Model, payload: Dict[str, Any]) -> Tuple[int, Any]:
+    """
+    非流式对话：依次经过响应缓存、语义缓存、进行中的相同请求合并、模型并发名额，最后才请求上游。
+    返回 (状态码, JSON 内容)；并发已满时抛出 ModelOverloaded。
+    """
+    cache = get_response_cache()
+    cache_key = None
+    cache_ttl = 0.0
+    if cache is not None:
+        enabled, cache_ttl = cache.settings_for(model.model_id)
+        if enabled:
+            cache_key = chat_request_key(model, payload)
+            content = await cache.get(model.model_id, cache_key)
+            if content is not None:
+                return 200, content
+
+    # 精确缓存未命中后再查语义缓存（需要一次向量化调用）
+    semantic = get_semantic_cache()
+    probe = None
+    if semantic is not None:
+        content, probe = await semantic.lookup(model, payload)
+        if content is not None:
+            return 200, content
+
+    async def run() -> Tuple[int, Any]:
+        slot = await concurrency_limiter.acquire(model)
+        try:
+            status, content, size = await _request_completion(model, payload)
+        finally:
+            slot.release()
+        if cache_key is not None and status == 200 and size >= 0:
+            cache.put(cache_key, content, size, cache_ttl)
+        if probe is not None and status == 200 and size >= 0:
+            semantic.store(probe, content)
+        return status, content
+
+    if not get_settings().coalesce.enabled:
+        return await run()
+
+    key = cache_key or chat_request_key(model, payload)
+    task = _inflight_calls.get(key)
+    if task is not None:
+        CHAT_COALESCED.inc(model.model_id, "once")
+    else:
+        # 上游请求放在独立任务里，发起者断开不影响其他等待者
+        task = asyncio.ensure_future(run())
+        _inflight_calls[key] = task
+        task.add_done_callback(lambda t: _inflight_calls.pop(key, None) if _inflight_calls.get(key) is t else None)
+    return await asyncio.shield(task)
+
+
+def _can_passthrough(model: Model) -> bool:
+    """透传只在不需要解析响应内容时使用：响应缓存、语义缓存都要保存解析后的回答。"""
+    if not get_settings().server.chat_passthrough:
+        return False
+    cache = get_response_cache()
+    if cache is not None and cache.settings_for(model.model_id)[0]:
+        return False
+    semantic = get_semantic_cache()
+    return semantic is None or not semantic.settings_for(model.model_id)[0]
+
+
+async def _passthrough_completion(model: Model, payload: Dict[str, Any]) -> StreamingResponse:
+    """
+    非流式透传：收到上游响应头后，把状态码、Content-Type 和原始响应体字节直接转发给客户端。
+    不经过请求合并；并发名额和上游地址占用到响应体转发完毕（或客户端断开）为止。
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {model.api_key.strip()}",
+    }
+    slot = await concurrency_limiter.acquire(model)
+    start = time.monotonic()
+    try:
+        resp, lease = await open_upstream(model, payload, headers, upstream_timeout(model.timeout))
+    except httpx.HTTPError as e:
+        slot.release()
+        raise HTTPException(status_code=502, detail=f"大模型请求失败: {e}") from e
+    except BaseException:
+        slot.release()
+        raise
+
+    recorded = False
+
+    async def cleanup() -> None:
+        nonlocal recorded
+        await resp.aclose()
+        lease.release()
+        slot.release()
+        recorder = get_usage_recorder()
+        if recorder is not None and not recorded:
+            # 透传不解析响应体，只记录估算的输入 token
+            recorded = True
+            prompt = estimate_tokens(payload.get("messages") or [])
+            recorder.record(model.model_id, "passthrough", prompt, 0, "estimated", time.monotonic() - start, resp.status_code)
+
+    async def body():
+        try:
+            async for chunk in resp.aiter_raw():
+                yield chunk
+        except httpx.HTTPError:
+            lease.record(False)
+            raise
+        finally:
+            await cleanup()
+
+    out_headers = {k: resp.headers[k] for k in ("content-type", "content-encoding", "content-length") if k in resp.headers}
+    # 客户端在响应开始前断开时 body() 不会被迭代，由后台任务兜底释放（重复释放无副作用）
+    return StreamingResponse(body(), status_code=resp.status_code, headers=out_headers, background=BackgroundTask(cleanup))
+
+
+async def call_model_once(model: Model, payload: Dict[str, Any]) -> Response:
+    """
+    非流式场景：一次性请求下游大模型并返回 JSON。
+    开启响应缓存时，相同的 (模型, 消息, 采样参数) 直接返回缓存结果；并发的相同请求只请求上游一次。
+    开启 server.chat_passthrough 且该模型不走缓存时，上游响应体原样透传。
+    """
+    start = time.monotonic()
+    try:
+        if _can_passthrough(model):
+            return await _passthrough_completion(model, payload)
+        status, content = await fetch_completion(model, payload)
+    finally:
+        CHAT_ONCE_SECONDS.observe(model.model_id, value=time.monotonic() - start)
+    return APIJSONResponse(status_code=status, content=content)
+
+
+def _collect_lag() -> None:
+    SSE_CLIENT_LAG.set(value=total_lag())
+
 
-    return JSONResponse(status_code=resp.status_code, content=content)
+on_collect(_collect_lag)
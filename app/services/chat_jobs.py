@@ -0,0 +1,350 @@
+"""
+异步对话任务（POST /api/v1/models/chat/{model_id}?mode=async）：提交后立即返回 job_id，生成在后台的有界 worker 池中执行。
+
+- worker 数固定，排队任务数有上限，队列满时拒绝提交（429）；
+- 非流式任务复用 fetch_completion（响应缓存、请求合并、并发名额照常生效），结果为上游的状态码和 JSON；
+- 流式任务（同时带 stream=1）复用 open_stream，生成期间可随时订阅 SSE，结束后结果为完整的 SSE 文本；
+  订阅时任务仍在排队则最多等待 max_wait_seconds，仍未开始返回 202，已失败返回 409（均带任务状态）；
+- 结束的任务保留 ttl_seconds；内存中的结果超过 max_memory_bytes 时，最早结束的写入 spill_dir（未配置则丢弃），查询时读回。
+任务只存在于接受提交的进程中，进程重启后未结束的任务丢失；多进程部署时共享的 spill_dir 中已落盘的结果各进程都能读到。
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import orjson
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from pydantic_core import to_jsonable_python
+
+from app.config import ChatJobsConfig
+from app.models.model import Model
+from app.services.broadcast import StreamBroadcast
+from app.services.chat import fetch_completion, follow_stream, open_stream
+from app.services.limiter import ModelOverloaded
+from app.services.metrics import counter, gauge, on_collect
+
+logger = logging.getLogger(__name__)
+
+CHAT_JOBS = counter(
+    "chat_jobs_total",
+    "异步对话任务数：submitted / rejected 为提交结果，done / failed 为执行结果，evicted 为超出内存上限被丢弃",
+    ("model_id", "result"),
+)
+CHAT_JOBS_QUEUED = gauge("chat_jobs_queued", "排队中的异步对话任务数")
+CHAT_JOBS_RUNNING = gauge("chat_jobs_running", "执行中的异步对话任务数")
+CHAT_JOBS_MEMORY_BYTES = gauge("chat_jobs_memory_bytes", "内存中保存的任务结果大小")
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class ChatJobsFull(Exception):
+    def __init__(self, retry_after: int = 1):
+        super().__init__("异步任务队列已满，请稍后重试")
+        self.retry_after = retry_after
+
+
+class ChatJobNotStreaming(Exception):
+    """流式任务在等待时间内没有开始生成（202），或已经失败（409）。"""
+
+    def __init__(self, status_code: int, msg: str, info: Dict[str, Any]):
+        super().__init__(msg)
+        self.status_code = status_code
+        self.info = info
+
+
+class ChatJob:
+    def __init__(self, model: Model, payload: Dict[str, Any], stream: bool):
+        self.job_id = uuid4().hex
+        self.model = model
+        self.payload = payload
+        self.stream = stream
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # 非流式为上游的 (状态码, JSON)，流式为生成结束后保存的完整 SSE 文本
+        self.status_code: Optional[int] = None
+        self.content: Any = None
+        # 流式任务生成期间的 StreamBroadcast，结果保存后置为 None
+        self.bc: Optional[StreamBroadcast] = None
+        self.error: Optional[str] = None
+        self.size = 0
+        # 流式任务开始生成（或未生成就结束）时 set，订阅方据此等待
+        self.started = asyncio.Event()
+        self.finished = asyncio.Event()
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        if self.stream:
+            return {"status_code": 200, "content": self.content} if self.content is not None else None
+        if self.status_code is None:
+            return None
+        return {"status_code": self.status_code, "content": self.content}
+
+    def info(self) -> Dict[str, Any]:
+        done = self.status in ("done", "failed")
+        return {
+            "job_id": self.job_id,
+            "model_id": self.model.model_id,
+            "status": self.status,
+            "stream": self.stream,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result() if done else None,
+            "error": self.error,
+        }
+
+
+class ChatJobs:
+    def __init__(self, cfg: ChatJobsConfig):
+        self._cfg = cfg
+        self._queue: "asyncio.Queue[ChatJob]" = asyncio.Queue(cfg.max_queue)
+        self._jobs: Dict[str, ChatJob] = {}
+        # 已结束、结果仍在内存中的任务，按结束顺序：job_id -> 过期时间
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        self._bytes = 0
+        self._running = 0
+        self._spill_dir: Optional[Path] = Path(cfg.spill_dir) if cfg.spill_dir else None
+        if self._spill_dir is not None:
+            self._spill_dir.mkdir(parents=True, exist_ok=True)
+        self._tasks: List[asyncio.Task] = []
+        self._pending_writes: set = set()
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self._cfg.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._pending_writes, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, model: Model, payload: Dict[str, Any], stream: bool) -> ChatJob:
+        """排队一个任务；队列已满时抛出 ChatJobsFull。"""
+        job = ChatJob(model, payload, stream)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            CHAT_JOBS.inc(model.model_id, "rejected")
+            raise ChatJobsFull()
+        self._jobs[job.job_id] = job
+        CHAT_JOBS.inc(model.model_id, "submitted")
+        return job
+
+    async def get(self, job_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        查询任务；wait > 0 时长轮询：任务未结束则最多等待 wait 秒（不超过 max_wait_seconds）。
+        任务不存在或已过期时返回 None。
+        """
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        job = self._jobs.get(job_id)
+        if job is None:
+            return await self._spill_read(job_id)
+        wait = min(wait, self._cfg.max_wait_seconds)
+        if wait > 0 and not job.finished.is_set():
+            try:
+                await asyncio.wait_for(job.finished.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return job.info()
+
+    async def stream(self, job_id: str, request: Optional[Request] = None, wait: Optional[float] = None) -> Optional[Response]:
+        """
+        订阅流式任务的 SSE 输出：从头补发已生成的部分后跟随进度；任务还在排队时最多等待 wait 秒
+        （默认且不超过 max_wait_seconds），仍未开始或已经失败时抛出 ChatJobNotStreaming。
+        结果已落盘时一次性返回完整的 SSE 文本。任务不存在时返回 None，不是流式任务时抛出 HTTPException。
+        """
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        job = self._jobs.get(job_id)
+        if job is None:
+            info = await self._spill_read(job_id)
+            if info is None:
+                return None
+            if not info["stream"]:
+                raise HTTPException(status_code=400, detail="该任务不是流式任务")
+            return Response((info["result"] or {}).get("content") or "", media_type="text/event-stream")
+        if not job.stream:
+            raise HTTPException(status_code=400, detail="该任务不是流式任务")
+        wait = self._cfg.max_wait_seconds if wait is None else min(wait, self._cfg.max_wait_seconds)
+        if wait > 0 and not job.started.is_set():
+            try:
+                await asyncio.wait_for(job.started.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        if not job.started.is_set():
+            raise ChatJobNotStreaming(202, "任务尚未开始生成，请稍后重试", job.info())
+        if job.status == "failed" or (job.bc is None and job.content is None):
+            raise ChatJobNotStreaming(409, job.error or "任务执行失败", job.info())
+        if job.content is not None:
+            return Response(job.content, media_type="text/event-stream")
+        return follow_stream(job.model, job.bc, request)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            self._running += 1
+            try:
+                if job.stream:
+                    await self._run_stream(job)
+                else:
+                    job.status_code, job.content = await fetch_completion(job.model, job.payload)
+                    job.size = len(orjson.dumps(job.content, default=to_jsonable_python))
+                job.status = "done"
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "服务停止，任务已中止"
+                raise
+            except (HTTPException, ModelOverloaded) as e:
+                job.status = "failed"
+                job.error = e.detail if isinstance(e, HTTPException) else str(e)
+            except Exception as e:
+                logger.exception("异步对话任务执行失败: %s", job.job_id)
+                job.status = "failed"
+                job.error = str(e) or type(e).__name__
+            finally:
+                self._running -= 1
+                job.finished_at = time.time()
+                job.started.set()
+                job.finished.set()
+                CHAT_JOBS.inc(job.model.model_id, job.status)
+                self._retain(job)
+
+    async def _run_stream(self, job: ChatJob) -> None:
+        """
+        任务自身保持一个订阅，订阅方全部断开也不会中止生成。
+        退订前保存完整结果：任务的订阅不登记游标，退订后其余订阅者推进时可能丢弃已写出的分段。
+        """
+        bc = await open_stream(job.model, job.payload)
+        job.bc = bc
+        job.started.set()
+        try:
+            while not bc.done:
+                await bc.changed().wait()
+            out = bc.read_from(0)
+            job.content = out.decode("utf-8", errors="replace") if isinstance(out, bytes) else out
+            job.size = len(out)
+            job.bc = None
+        finally:
+            bc.unsubscribe()
+        if bc.error is not None:
+            raise bc.error
+
+    def _retain(self, job: ChatJob) -> None:
+        """结果计入内存，超出上限时最早结束的任务落盘或丢弃。"""
+        if job.job_id not in self._jobs:
+            return
+        self._finished[job.job_id] = job.finished_at + self._cfg.ttl_seconds
+        self._bytes += job.size
+        while self._bytes > self._cfg.max_memory_bytes and self._finished:
+            job_id, expire_at = self._finished.popitem(last=False)
+            old = self._jobs.pop(job_id)
+            self._bytes -= old.size
+            if self._spill_dir is None:
+                CHAT_JOBS.inc(old.model.model_id, "evicted")
+                continue
+            # 落盘期间仍可查询：先写文件，写完再从内存移除
+            self._jobs[job_id] = old
+            task = asyncio.create_task(asyncio.to_thread(self._spill_write, old.info(), expire_at))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+            task.add_done_callback(lambda _, job_id=job_id: self._jobs.pop(job_id, None))
+
+    async def _sweep(self) -> None:
+        """定期移除过期的结果（内存和磁盘）。"""
+        interval = max(1.0, min(60.0, self._cfg.ttl_seconds / 2))
+        while True:
+            await asyncio.sleep(interval)
+            now = time.time()
+            while self._finished:
+                job_id, expire_at = next(iter(self._finished.items()))
+                if expire_at > now:
+                    break
+                del self._finished[job_id]
+                job = self._jobs.pop(job_id, None)
+                if job is not None:
+                    self._bytes -= job.size
+            if self._spill_dir is not None:
+                try:
+                    await asyncio.to_thread(self._spill_sweep, now)
+                except Exception:
+                    logger.exception("清理过期的异步任务结果文件失败")
+
+    def _spill_path(self, job_id: str) -> Path:
+        return self._spill_dir / job_id[:2] / f"{job_id}.json"
+
+    async def _spill_read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self._spill_dir is None:
+            return None
+        return await asyncio.to_thread(self._spill_load, job_id, time.time())
+
+    def _spill_load(self, job_id: str, now: float) -> Optional[Dict[str, Any]]:
+        path = self._spill_path(job_id)
+        try:
+            data = json.loads(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("异步任务结果文件损坏，已删除: %s", path)
+            path.unlink(missing_ok=True)
+            return None
+        if data.get("expire_at", 0) <= now:
+            path.unlink(missing_ok=True)
+            return None
+        return data["info"]
+
+    def _spill_write(self, info: Dict[str, Any], expire_at: float) -> None:
+        path = self._spill_path(info["job_id"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(orjson.dumps({"expire_at": expire_at, "info": info}, default=to_jsonable_python))
+        os.replace(tmp, path)
+
+    def _spill_sweep(self, now: float) -> None:
+        # 文件按修改时间判断，避免逐个解析；过期时间 = 写入时间之后最多 ttl_seconds
+        cutoff = now - self._cfg.ttl_seconds
+        for path in self._spill_dir.glob("*/*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+
+    def collect(self) -> None:
+        CHAT_JOBS_QUEUED.set(value=self._queue.qsize())
+        CHAT_JOBS_RUNNING.set(value=self._running)
+        CHAT_JOBS_MEMORY_BYTES.set(value=self._bytes)
+
+
+_jobs: Optional[ChatJobs] = None
+
+
+def init_chat_jobs(cfg: ChatJobsConfig) -> Optional[ChatJobs]:
+    """按配置创建任务池，调用方负责 start() / stop()；关闭时不创建。"""
+    global _jobs
+    _jobs = ChatJobs(cfg) if cfg.enabled and cfg.workers > 0 else None
+    return _jobs
+
+
+def get_chat_jobs() -> Optional[ChatJobs]:
+    return _jobs
+
+
+def _collect() -> None:
+    if _jobs is not None:
+        _jobs.collect()
+
+
+on_collect(_collect)
@@ -0,0 +1,217 @@
+"""
+OpenAI 风格的向量化转发。
+
+入库任务通常是大量并发的单条文本请求：同一模型的单条请求先进入微批队列，
+凑满 embedding.max_batch_size 条或等待 embedding.max_wait_ms 毫秒后合并为一次上游批量调用，
+结果按顺序分发回各个请求；上游因输入本身拒绝整批（400 / 413 / 422）时二分重试，只让有问题的文本失败。
+多条文本的请求按批大小切分后直接调用，同时进行的调用数不超过 embedding.max_concurrent_batches。
+上游的 4xx（含 429）原样返回状态码，其余失败为 502。返回前按模型的 dimensions 校验向量长度（0 表示不校验）。
+"""
+import asyncio
+import base64
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from app.config import get_settings
+from app.models.model import Model
+from app.services.balancer import open_upstream
+from app.services.limiter import concurrency_limiter
+from app.services.metrics import counter
+from app.services.upstream import upstream_timeout
+
+EMBED_UPSTREAM_CALLS = counter(
+    "embed_upstream_calls_total",
+    "向量化接口对上游的批量调用次数",
+    ("model_id",),
+)
+EMBED_TEXTS = counter(
+    "embed_texts_total",
+    "向量化的文本条数",
+    ("model_id", "mode"),
+)
+
+Vector = List[float]
+
+# 上游因输入内容拒绝请求的状态码：整批失败时拆开重试
+_INPUT_ERRORS = (400, 413, 422)
+
+
+def encode_base64(vector: Vector) -> str:
+    """float32 小端字节的 base64，与 OpenAI encoding_format=base64 一致。"""
+    buf = array("f", vector)
+    if sys.byteorder == "big":
+        buf.byteswap()
+    return base64.b64encode(buf.tobytes()).decode("ascii")
+
+
+async def embed_texts(model: Model, texts: Sequence[str]) -> Tuple[List[Vector], int]:
+    """一次上游批量调用，返回 (与 texts 等长的向量列表, prompt_tokens)。"""
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {model.api_key.strip()}",
+    }
+    payload = {"model": model.type, "input": list(texts)}
+    timeout = upstream_timeout(model.timeout)
+
+    slot = await concurrency_limiter.acquire(model)
+    try:
+        EMBED_UPSTREAM_CALLS.inc(model.model_id)
+        resp, lease = await open_upstream(model, payload, headers, timeout)
+        try:
+            await resp.aread()
+        except httpx.HTTPError:
+            lease.record(False)
+            raise
+        finally:
+            await resp.aclose()
+            lease.release()
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"向量化请求失败: {e}") from e
+    finally:
+        slot.release()
+
+    if resp.status_code != 200:
+        status = resp.status_code if 400 <= resp.status_code < 500 else 502
+        headers = {"Retry-After": resp.headers["retry-after"]} if "retry-after" in resp.headers else None
+        raise HTTPException(
+            status_code=status,
+            detail=f"向量化请求失败: HTTP {resp.status_code} {resp.text[:200]}",
+            headers=headers,
+        )
+    try:
+        body = resp.json()
+        items = sorted(body["data"], key=lambda d: d.get("index", 0))
+        vectors = [item["embedding"] for item in items]
+    except Exception as e:
+        raise HTTPException(status_code=502, detail="向量化响应格式错误") from e
+    if len(vectors) != len(texts):
+        raise HTTPException(status_code=502, detail=f"向量化响应条数不符: 期望 {len(texts)}，实际 {len(vectors)}")
+    if model.dimensions > 0:
+        for v in vectors:
+            if not isinstance(v, list) or len(v) != model.dimensions:
+                actual = len(v) if isinstance(v, list) else type(v).__name__
+                raise HTTPException(
+                    status_code=502,
+                    detail=f"向量维度与模型配置不一致: 期望 {model.dimensions}，实际 {actual}",
+                )
+    usage = body.get("usage") or {}
+    return vectors, int(usage.get("prompt_tokens") or 0)
+
+
+class _MicroBatcher:
+    """单个模型的微批队列。"""
+
+    def __init__(self):
+        self._model: Optional[Model] = None
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    def submit(self, model: Model, text: str) -> asyncio.Future:
+        cfg = get_settings().embedding
+        fut = asyncio.get_running_loop().create_future()
+        # 批量调用使用最新的模型配置
+        self._model = model
+        self._pending.append((text, fut))
+        if len(self._pending) >= cfg.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(cfg.max_wait_ms / 1000, self._flush)
+        return fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = self._pending, []
+        if not items:
+            return
+        task = asyncio.create_task(self._run(self._model, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run(model: Model, items: List[Tuple[str, asyncio.Future]]) -> None:
+        # 调用方已经放弃（如客户端断开）的条目不再发送
+        items = [(text, fut) for text, fut in items if not fut.done()]
+        if not items:
+            return
+        try:
+            vectors, tokens = await embed_texts(model, [text for text, _ in items])
+        except Exception as e:
+            if len(items) > 1 and isinstance(e, HTTPException) and e.status_code in _INPUT_ERRORS:
+                # 可能只是其中某条文本有问题：拆成两半分别重试，不连累同批的其它请求
+                mid = len(items) // 2
+                await asyncio.gather(_MicroBatcher._run(model, items[:mid]), _MicroBatcher._run(model, items[mid:]))
+                return
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        total_chars = sum(len(text) for text, _ in items) or 1
+        for (text, fut), vector in zip(items, vectors):
+            if not fut.done():
+                # 批量调用的 usage 按字符数比例分摊
+                fut.set_result((vector, round(tokens * len(text) / total_chars)))
+
+
+_batchers: Dict[str, _MicroBatcher] = {}
+
+
+async def embed_one(model: Model, text: str) -> Tuple[Vector, int]:
+    """向量化单条文本（经过微批队列），返回 (向量, 分摊的 prompt_tokens)。"""
+    batcher = _batchers.get(model.model_id)
+    if batcher is None:
+        batcher = _MicroBatcher()
+        _batchers[model.model_id] = batcher
+    fut = batcher.submit(model, text)
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+
+
+async def embed(model: Model, inputs: List[str], encoding_format: str = "float") -> Dict[str, Any]:
+    """
+    向量化 inputs，返回 OpenAI 风格的响应体。
+    单条文本走微批队列；多条文本按 max_batch_size 切分后并发调用（最多 max_concurrent_batches 个），任一批失败时取消其余批次。
+    """
+    if len(inputs) == 1:
+        EMBED_TEXTS.inc(model.model_id, "batched")
+        vector, tokens = await embed_one(model, inputs[0])
+        vectors = [vector]
+    else:
+        EMBED_TEXTS.inc(model.model_id, "direct", amount=len(inputs))
+        cfg = get_settings().embedding
+        size = max(1, cfg.max_batch_size)
+        sem = asyncio.Semaphore(max(1, cfg.max_concurrent_batches))
+
+        async def run(batch: List[str]) -> Tuple[List[Vector], int]:
+            async with sem:
+                return await embed_texts(model, batch)
+
+        tasks = [asyncio.ensure_future(run(inputs[i:i + size])) for i in range(0, len(inputs), size)]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        vectors = [v for batch, _ in results for v in batch]
+        tokens = sum(t for _, t in results)
+
+    encode = encode_base64 if encoding_format == "base64" else None
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": encode(v) if encode else v}
+            for i, v in enumerate(vectors)
+        ],
+        "model": model.type,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
@@ -0,0 +1,260 @@
+"""
+对话请求对冲（按需开启），压低个别慢副本造成的首字节长尾。
+
+- 请求发出后超过 delay 仍未收到首字节，向备选上游再发一份相同请求：优先同模型的其它地址，
+  没有时选 type 相同的其它已启用模型；先开始输出的一方胜出，另一方立即取消并释放连接；
+- delay 取该模型最近 window 次首字节耗时的 percentile 分位数，限制在 [min_delay_ms, max_delay_ms]，样本不足时不对冲；
+- 对冲预算：每个请求存入 budget_percent% 个额度，每次对冲消耗 1 个（最多积累 budget_burst 个），
+  因此对冲请求数不超过总请求数的 budget_percent%，不会让上游负载翻倍。
+流式请求以第一段响应体为首字节，非流式以响应头为准。对冲到其它模型时不占用该模型的并发名额。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from app.config import HedgeConfig
+from app.models.model import Model
+from app.models.registry import model_registry
+from app.services.balancer import EndpointLease, get_balancer, open_upstream
+from app.services.metrics import counter
+from app.services.upstream import upstream_timeout
+
+CHAT_HEDGE = counter(
+    "chat_hedge_total",
+    "对话请求对冲：won / lost 为对冲请求胜出 / 落败，over_budget / no_alternate 为超过 delay 但未对冲",
+    ("model_id", "result"),
+)
+
+# (收到响应头的响应, 地址占用, 响应体迭代器)；非流式请求不读取响应体，迭代器为 None
+Opened = Tuple[httpx.Response, EndpointLease, Optional[AsyncIterator[bytes]]]
+
+
+class _ModelHedge:
+    __slots__ = ("samples", "fresh", "delay", "tokens")
+
+    def __init__(self, window: int):
+        # 最近的首字节耗时（秒）
+        self.samples: Deque[float] = deque(maxlen=window)
+        # 上次计算 delay 之后新增的样本数
+        self.fresh = 0
+        self.delay: Optional[float] = None
+        self.tokens = 0.0
+
+
+class Hedger:
+    # 每新增这么多样本重新计算一次分位数
+    RECOMPUTE_EVERY = 16
+
+    def __init__(self, cfg: HedgeConfig):
+        self._cfg = cfg
+        self._states: Dict[str, _ModelHedge] = {}
+
+    def enabled_for(self, model_id: str) -> bool:
+        override = self._cfg.models.get(model_id)
+        if override is not None and override.enabled is not None:
+            return override.enabled
+        return self._cfg.enabled
+
+    def state(self, model_id: str) -> _ModelHedge:
+        state = self._states.get(model_id)
+        if state is None:
+            state = _ModelHedge(max(1, self._cfg.window))
+            self._states[model_id] = state
+        return state
+
+    def observe(self, state: _ModelHedge, seconds: float) -> None:
+        state.samples.append(seconds)
+        state.fresh += 1
+        if len(state.samples) < self._cfg.min_samples:
+            return
+        if state.delay is None or state.fresh >= self.RECOMPUTE_EVERY:
+            ordered = sorted(state.samples)
+            rank = math.ceil(self._cfg.percentile / 100 * len(ordered)) - 1
+            value = ordered[min(len(ordered) - 1, max(0, rank))]
+            state.delay = min(max(value, self._cfg.min_delay_ms / 1000), self._cfg.max_delay_ms / 1000)
+            state.fresh = 0
+
+    def deposit(self, state: _ModelHedge) -> None:
+        state.tokens = min(self._cfg.budget_burst, state.tokens + self._cfg.budget_percent / 100)
+
+    def spend(self, state: _ModelHedge) -> bool:
+        if state.tokens < 1:
+            return False
+        state.tokens -= 1
+        return True
+
+    def alternate(self, model: Model, used: Sequence[str]) -> Optional[Tuple[Model, Sequence[str]]]:
+        """备选上游 (模型, 需避开的地址)：同模型未用过的地址优先，其次 type 相同的其它启用模型中在途请求最少的。"""
+        balancer = get_balancer()
+        if any(url not in used for url, _ in balancer.candidates(model)):
+            return model, tuple(used)
+        if not self._cfg.alternate_models or not model.type:
+            return None
+        others = [
+            m for m in model_registry.all()
+            if m.model_id != model.model_id and m.type == model.type and m.enable == 1
+            and (m.api_key or "").strip() and balancer.candidates(m)
+        ]
+        if not others:
+            return None
+        return min(others, key=balancer.outstanding), ()
+
+    def stats(self) -> List[Dict[str, object]]:
+        return [
+            {
+                "model_id": model_id,
+                "samples": len(s.samples),
+                "delay_ms": round(s.delay * 1000, 1) if s.delay is not None else None,
+                "tokens": round(s.tokens, 2),
+            }
+            for model_id, s in self._states.items()
+        ]
+
+
+async def _prepend(first: Optional[bytes], rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    if first is not None:
+        yield first
+    async for chunk in rest:
+        yield chunk
+
+
+async def _attempt(
+        model: Model,
+        payload: Dict,
+        headers: Dict[str, str],
+        timeout: httpx.Timeout,
+        first_chunk: bool,
+        exclude: Sequence[str] = (),
+        used: Optional[List[str]] = None,
+) -> Tuple[Opened, float]:
+    """发出一次请求，等到首字节后返回 (结果, 首字节耗时)。"""
+    start = time.monotonic()
+    resp, lease = await open_upstream(model, payload, headers, timeout, exclude, used)
+    if not first_chunk:
+        return (resp, lease, None), time.monotonic() - start
+    body = resp.aiter_bytes()
+    try:
+        first = await body.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException as e:
+        if isinstance(e, httpx.HTTPError):
+            lease.record(False)
+        lease.release()
+        await resp.aclose()
+        raise
+    return (resp, lease, _prepend(first, body)), time.monotonic() - start
+
+
+def _discard(task: "asyncio.Future[Tuple[Opened, float]]") -> None:
+    """取消落败的一方；已经拿到响应的关闭响应、释放地址。"""
+    def close(t: asyncio.Future) -> None:
+        if t.cancelled() or t.exception() is not None:
+            return
+        (resp, lease, _), _ = t.result()
+        lease.release()
+        asyncio.ensure_future(resp.aclose())
+
+    task.cancel()
+    task.add_done_callback(close)
+
+
+def _timeout_for(model: Model, timeout: httpx.Timeout) -> httpx.Timeout:
+    """对冲到其它模型时按该模型自己的超时；沿用调用方是否限制读超时（流式请求不限制）。"""
+    return upstream_timeout(model.timeout, read=timeout.read is not None)
+
+
+def _usable(task: asyncio.Future) -> bool:
+    """成功拿到首字节且不是 5xx。"""
+    if task.exception() is not None:
+        return False
+    (resp, _, _), _ = task.result()
+    return resp.status_code < 500
+
+
+async def open_hedged(
+        model: Model,
+        payload: Dict,
+        headers: Dict[str, str],
+        timeout: httpx.Timeout,
+        first_chunk: bool,
+) -> Opened:
+    """
+    open_upstream 的对冲版本；first_chunk 为 True 时等到第一段响应体，返回的迭代器会先给出这一段。
+    未开启对冲时等同于 open_upstream。调用方负责 aclose() 响应并 release() 占用。
+    """
+    hedger = get_hedger()
+    if hedger is None or not hedger.enabled_for(model.model_id):
+        resp, lease = await open_upstream(model, payload, headers, timeout)
+        return resp, lease, resp.aiter_bytes() if first_chunk else None
+
+    state = hedger.state(model.model_id)
+    hedger.deposit(state)
+    used: List[str] = []
+    start = time.monotonic()
+    primary = asyncio.ensure_future(_attempt(model, payload, headers, timeout, first_chunk, used=used))
+    tasks = [primary]
+    try:
+        if state.delay is not None:
+            await asyncio.wait(tasks, timeout=state.delay)
+            if not primary.done():
+                alt = hedger.alternate(model, used)
+                if alt is None:
+                    CHAT_HEDGE.inc(model.model_id, "no_alternate")
+                elif not hedger.spend(state):
+                    CHAT_HEDGE.inc(model.model_id, "over_budget")
+                else:
+                    alt_model, exclude = alt
+                    alt_headers, alt_timeout = headers, timeout
+                    if alt_model is not model:
+                        alt_headers = {**headers, "Authorization": f"Bearer {alt_model.api_key.strip()}"}
+                        alt_timeout = _timeout_for(alt_model, timeout)
+                    tasks.append(asyncio.ensure_future(
+                        _attempt(alt_model, payload, alt_headers, alt_timeout, first_chunk, exclude)
+                    ))
+        # 先拿到可用首字节的一方胜出；都不可用时取最后结束的一方（异常则抛出）
+        pending = set(tasks)
+        winner = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            usable = [t for t in tasks if t in done and _usable(t)]
+            if usable:
+                winner = usable[0]
+                break
+            winner = next(iter(done))
+            if pending:
+                _discard(winner)
+    except BaseException:
+        for task in tasks:
+            _discard(task)
+        raise
+    for task in tasks:
+        if task is not winner and not (task.done() and task.exception() is not None):
+            _discard(task)
+    if len(tasks) > 1:
+        CHAT_HEDGE.inc(model.model_id, "won" if winner is tasks[1] else "lost")
+    opened, elapsed = winner.result()
+    # 只记录主请求的首字节耗时；对冲胜出时主请求至少已等了这么久，避免样本被对冲结果压低
+    hedger.observe(state, elapsed if winner is primary else time.monotonic() - start)
+    return opened
+
+
+_hedger: Optional[Hedger] = None
+
+
+def init_hedger(cfg: HedgeConfig) -> Optional[Hedger]:
+    """全局关闭且没有按模型开启时不创建。"""
+    global _hedger
+    if not cfg.enabled and not any(m.enabled for m in cfg.models.values()):
+        _hedger = None
+        return None
+    _hedger = Hedger(cfg)
+    return _hedger
+
+
+def get_hedger() -> Optional[Hedger]:
+    return _hedger
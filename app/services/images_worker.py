@@ -0,0 +1,194 @@
+"""
+nats.imagesProcSubject 的图片预处理消费者。
+
+消息体为 JSON：
+    {"id": "...", "url": "..." | "path": "...", "reply_subject": "..."}
+解码、缩放裁剪、标准化都在 ProcessPoolExecutor 里完成（image_ops.preprocess），API 的事件循环只负责下载和收发消息：
+- 远程图片边下载边写入共享内存，子进程按名字挂载读取，图片字节不经过 pickle；本地文件由子进程直接 mmap；
+- 结果写到 output_dir/{id}.npy（float32，CHW），回复 {"id", "status", "data": {"output", "shape", "source_size"}}；
+- 处理中的消息数不超过 concurrency，进程池排满后拉取循环随之暂停；
+- path 必须位于 input_dir 之下（解析符号链接后判断），url 及其重定向的协议和主机必须在 url_schemes / url_hosts 之内，否则直接 term。
+依赖 Pillow 和 numpy（可选依赖 images）。
+
+单独运行：python -m app.services.images_worker（配置同样来自 MYAPI_CONFIG）。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from typing import Optional, Tuple
+
+import httpx
+
+from app.config import ImagesProcConfig, NatsConfig, get_settings
+from app.services import image_ops
+from app.services.jetstream_worker import ACK, PermanentError, PullConsumerWorker, run_until_signalled
+from app.services.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+IMAGES_PROCESSED = counter(
+    "images_processed_total",
+    "预处理完成的图片数",
+    ("source",),
+)
+
+
+class ImagesProcWorker(PullConsumerWorker):
+    def __init__(self, nats_cfg: NatsConfig, cfg: ImagesProcConfig):
+        super().__init__(nats_cfg, cfg, nats_cfg.imagesProcSubject, nats_cfg.imagesProcConsumerName)
+        self._images_cfg = cfg
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._http: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        cfg = self._images_cfg
+        os.makedirs(cfg.output_dir, exist_ok=True)
+        self._pool = ProcessPoolExecutor(
+            max_workers=cfg.workers or os.cpu_count() or 1,
+            mp_context=get_context(cfg.mp_context),
+            initializer=image_ops.warm_up,
+        )
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(30, connect=10),
+            follow_redirects=True,
+            # 每次请求（含重定向）都检查目标地址
+            event_hooks={"request": [self._check_request]},
+        )
+        await super().start()
+
+    async def stop(self, timeout: float = 30) -> None:
+        await super().stop(timeout)
+        if self._http is not None:
+            await self._http.aclose()
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, True, cancel_futures=True)
+
+    async def handle(self, msg) -> Tuple[str, Optional[float]]:
+        try:
+            data = json.loads(msg.data)
+        except ValueError as e:
+            raise PermanentError(f"消息格式错误: {e}") from e
+        if not isinstance(data, dict) or not (data.get("url") or data.get("path")):
+            raise PermanentError("消息缺少 url 或 path")
+
+        image_id = str(data.get("id") or hashlib.sha1(msg.data).hexdigest())
+        cfg = self._images_cfg
+        params = {
+            "width": cfg.target_width,
+            "height": cfg.target_height,
+            "mean": cfg.mean,
+            "std": cfg.std,
+            "output": os.path.join(cfg.output_dir, f"{_safe_name(image_id)}.npy"),
+        }
+        loop = asyncio.get_running_loop()
+        shm = None
+        try:
+            if data.get("path"):
+                source = {"path": self._local_path(str(data["path"]))}
+            else:
+                shm, size = await self._download(data["url"])
+                source = {"shm": shm.name, "size": size}
+            result = await loop.run_in_executor(self._pool, image_ops.preprocess, source, params)
+        except (httpx.HTTPError, BrokenProcessPool) as e:
+            return self.retry_or_term(msg, e)
+        except (OSError, ValueError) as e:
+            # 文件不存在、无法识别的图片格式等：重试也不会成功
+            raise PermanentError(f"图片无法处理: {e}") from e
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        IMAGES_PROCESSED.inc("path" if "path" in source else "url")
+
+        reply = data.get("reply_subject") or (msg.headers or {}).get("Reply-To")
+        if reply:
+            body = json.dumps({"id": data.get("id"), "status": 200, "data": result}, ensure_ascii=False)
+            await self.publish(reply, body.encode("utf-8"))
+        return ACK, None
+
+    def _local_path(self, path: str) -> str:
+        """解析为 input_dir 下的真实路径；不在其中时抛出 PermanentError。"""
+        if not self._images_cfg.input_dir:
+            raise PermanentError("未配置 input_dir，不接受 path")
+        root = os.path.realpath(self._images_cfg.input_dir)
+        real = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, real]) != root:
+            raise PermanentError(f"path 不在 input_dir 之下: {path}")
+        return real
+
+    async def _check_request(self, request: httpx.Request) -> None:
+        if not _url_allowed(request.url, self._images_cfg):
+            raise PermanentError(f"url 不在允许范围内: {request.url}")
+
+    async def _download(self, url: str) -> Tuple[shared_memory.SharedMemory, int]:
+        """下载到共享内存；已知长度时直接写入，不在父进程里另存一份 bytes。"""
+        limit = self._images_cfg.max_image_bytes
+        async with self._http.stream("GET", url) as r:
+            if 400 <= r.status_code < 500:
+                raise PermanentError(f"下载图片失败: HTTP {r.status_code}")
+            r.raise_for_status()
+            length = int(r.headers.get("content-length") or 0)
+            if length > limit:
+                raise PermanentError(f"图片过大: {length} 字节")
+            if length and not r.headers.get("content-encoding"):
+                shm = shared_memory.SharedMemory(create=True, size=length)
+                pos = 0
+                try:
+                    async for chunk in r.aiter_raw():
+                        end = pos + len(chunk)
+                        if end > length:
+                            raise httpx.ReadError("响应长度超过 Content-Length")
+                        shm.buf[pos:end] = chunk
+                        pos = end
+                    if pos != length:
+                        raise httpx.ReadError("响应长度不足 Content-Length")
+                except BaseException:
+                    shm.close()
+                    shm.unlink()
+                    raise
+                return shm, length
+
+            buf = bytearray()
+            async for chunk in r.aiter_bytes():
+                buf += chunk
+                if len(buf) > limit:
+                    raise PermanentError(f"图片过大: 超过 {limit} 字节")
+        if not buf:
+            raise PermanentError("图片内容为空")
+        shm = shared_memory.SharedMemory(create=True, size=len(buf))
+        shm.buf[:len(buf)] = buf
+        return shm, len(buf)
+
+
+def _url_allowed(url: httpx.URL, cfg: ImagesProcConfig) -> bool:
+    if url.scheme not in cfg.url_schemes:
+        return False
+    host = url.host.lower().rstrip(".")
+    for allowed in cfg.url_hosts:
+        allowed = allowed.lower()
+        if host == allowed or (allowed.startswith("*.") and host.endswith(allowed[1:])):
+            return True
+    return False
+
+
+def _safe_name(name: str) -> str:
+    """id 用作文件名：只保留安全字符，其余情况用哈希。"""
+    if name.replace("-", "").replace("_", "").replace(".", "").isalnum() and not name.startswith("."):
+        return name
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+
+async def run_standalone() -> None:
+    settings = get_settings()
+    worker = ImagesProcWorker(settings.nats, settings.images_proc)
+    await run_until_signalled(worker.start, worker.stop)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_standalone())
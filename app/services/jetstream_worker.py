@@ -0,0 +1,219 @@
+"""
+JetStream 拉取消费者的公共部分，article / imagesProc 两个 worker 共用。
+
+- 按 batch_size 批量拉取，处理中的消息数不超过 concurrency，满了就暂停拉取，慢消息自然形成背压；
+- 确认攒到 ack_flush_ms 一起发出，再做一次 flush；
+- 可重试的失败（含 handle 抛出的未预期异常）按 backoff_seconds 延迟 nak，超过 max_deliver 次或消息本身有问题时直接 term；
+- 处理时间较长时定期发送 in_progress，避免超过 ack_wait 被重投。
+子类实现 handle(msg)，返回 (ACK / NAK / TERM, nak 延迟秒数)。
+"""
+import abc
+import asyncio
+import logging
+import signal
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from nats.errors import TimeoutError as NatsTimeoutError
+from nats.js.api import AckPolicy, ConsumerConfig
+
+from app.config import NatsConfig, PullWorkerConfig
+from app.services.metrics import counter
+from app.services.nats_client import connect_nats, nats_subject
+
+logger = logging.getLogger(__name__)
+
+JETSTREAM_MESSAGES = counter(
+    "jetstream_messages_total",
+    "JetStream 消息的处理结果",
+    ("consumer", "result"),
+)
+
+ACK, NAK, TERM = "ack", "nak", "term"
+
+
+class PermanentError(Exception):
+    """消息本身有问题，重投也不会成功。"""
+
+
+class PullConsumerWorker(abc.ABC):
+    def __init__(self, nats_cfg: NatsConfig, cfg: PullWorkerConfig, subject: str, consumer: str):
+        self._nats_cfg = nats_cfg
+        self._cfg = cfg
+        self.subject = nats_subject(subject, nats_cfg.clientId)
+        self.consumer = consumer
+        self._nc = None
+        self._sub = None
+        self._fetch_task: Optional[asyncio.Task] = None
+        self._ack_task: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._slot_freed = asyncio.Event()
+        # (消息, 动作, nak 延迟)
+        self._acks: List[Tuple[object, str, Optional[float]]] = []
+        self._ack_ready = asyncio.Event()
+        self._stopping = False
+
+    @abc.abstractmethod
+    async def handle(self, msg) -> Tuple[str, Optional[float]]:
+        """处理一条消息，返回 (ACK / NAK / TERM, nak 延迟秒数)；PermanentError 直接 term，其它异常按可重试处理。"""
+
+    async def start(self) -> None:
+        cfg = self._cfg
+        self._nc = await connect_nats(self._nats_cfg, f"{self._nats_cfg.clientId}-{self.consumer}")
+        js = self._nc.jetstream()
+        self._sub = await js.pull_subscribe(
+            self.subject,
+            durable=self.consumer,
+            stream=self._nats_cfg.streamName,
+            config=ConsumerConfig(
+                ack_policy=AckPolicy.EXPLICIT,
+                ack_wait=cfg.ack_wait_seconds,
+                max_deliver=cfg.max_deliver,
+                # 不设置服务端 backoff：设置后 ack_wait 会被其第一项取代，长耗时的处理会被提前重投
+                max_ack_pending=max(cfg.concurrency, cfg.batch_size) * 2,
+            ),
+        )
+        self._fetch_task = asyncio.create_task(self._fetch_loop())
+        self._ack_task = asyncio.create_task(self._ack_loop())
+        logger.info("JetStream worker 已启动: subject=%s consumer=%s", self.subject, self.consumer)
+
+    async def stop(self, timeout: float = 30) -> None:
+        """停止拉取，等待处理中的消息（最多 timeout 秒），发出剩余确认后断开。"""
+        self._stopping = True
+        if self._fetch_task is not None:
+            self._fetch_task.cancel()
+            await asyncio.gather(self._fetch_task, return_exceptions=True)
+        if self._inflight:
+            _, pending = await asyncio.wait(self._inflight, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            # 被取消的消息不确认，ack_wait 到期后由服务端重投
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._ack_task is not None:
+            self._ack_task.cancel()
+            await asyncio.gather(self._ack_task, return_exceptions=True)
+        await self._flush_acks()
+        if self._sub is not None:
+            # 被取消的 fetch 留下的收件箱会让 drain 一直等到超时；只退订收件箱，durable consumer 保留
+            try:
+                await self._sub.unsubscribe()
+            except Exception as e:
+                logger.warning("退订 %s 失败: %s", self.subject, e)
+        if self._nc is not None:
+            await self._nc.drain()
+
+    def backoff(self, msg) -> float:
+        """第 n 次投递失败后的重投等待时间。"""
+        delays = self._cfg.backoff_seconds or [0]
+        attempt = msg.metadata.num_delivered
+        return delays[min(attempt, len(delays)) - 1]
+
+    def retry_or_term(self, msg, error: BaseException, min_delay: float = 0) -> Tuple[str, Optional[float]]:
+        """可重试的失败：未超过 max_deliver 时延迟 nak，否则 term。"""
+        if msg.metadata.num_delivered >= self._cfg.max_deliver:
+            logger.warning("%s 消息重试 %d 次仍失败，放弃: %s", self.consumer, msg.metadata.num_delivered, error)
+            return TERM, None
+        return NAK, max(self.backoff(msg), min_delay)
+
+    async def _fetch_loop(self) -> None:
+        cfg = self._cfg
+        while not self._stopping:
+            free = cfg.concurrency - len(self._inflight)
+            if free <= 0:
+                self._slot_freed.clear()
+                await self._slot_freed.wait()
+                continue
+            try:
+                msgs = await self._sub.fetch(min(cfg.batch_size, free), timeout=cfg.fetch_timeout_seconds)
+            except NatsTimeoutError:
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("拉取 %s 消息失败: %s", self.subject, e)
+                await asyncio.sleep(1)
+                continue
+            for msg in msgs:
+                task = asyncio.create_task(self._process(msg))
+                self._inflight.add(task)
+                task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._inflight.discard(task)
+        self._slot_freed.set()
+
+    async def _process(self, msg) -> None:
+        keepalive = asyncio.create_task(self._keep_in_progress(msg))
+        try:
+            try:
+                action, delay = await self.handle(msg)
+            except PermanentError as e:
+                logger.warning("%s 消息无法处理，不再重投: %s", self.consumer, e)
+                action, delay = TERM, None
+            except Exception as e:
+                # 未预期的异常同样要确认，否则消息会一直占着 max_ack_pending 直到 ack_wait 到期
+                logger.exception("%s 处理消息失败", self.consumer)
+                action, delay = self.retry_or_term(msg, e)
+        finally:
+            keepalive.cancel()
+        JETSTREAM_MESSAGES.inc(self.consumer, action)
+        self._acks.append((msg, action, delay))
+        if len(self._acks) >= self._cfg.batch_size:
+            self._ack_ready.set()
+
+    async def _keep_in_progress(self, msg) -> None:
+        interval = self._cfg.ack_wait_seconds / 2
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await msg.in_progress()
+            except Exception as e:
+                logger.warning("发送 in_progress 失败: %s", e)
+
+    async def _ack_loop(self) -> None:
+        interval = self._cfg.ack_flush_ms / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self._ack_ready.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._ack_ready.clear()
+            await self._flush_acks()
+
+    async def _flush_acks(self) -> None:
+        """把攒下的确认一起写出，只做一次 flush。"""
+        if not self._acks:
+            return
+        acks, self._acks = self._acks, []
+        for msg, action, delay in acks:
+            try:
+                if action == ACK:
+                    await msg.ack()
+                elif action == NAK:
+                    await msg.nak(delay=delay)
+                else:
+                    await msg.term()
+            except Exception as e:
+                logger.warning("发送 %s 失败: %s", action, e)
+        try:
+            await self._nc.flush()
+        except Exception as e:
+            logger.warning("flush 确认失败: %s", e)
+
+    async def publish(self, subject: str, data: bytes) -> None:
+        await self._nc.publish(subject, data)
+
+
+async def run_until_signalled(
+        start: Callable[[], Awaitable[None]],
+        stop: Callable[[], Awaitable[None]],
+) -> None:
+    """独立进程运行：start 后一直等待，收到 SIGINT/SIGTERM 时调用 stop 优雅退出。"""
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    try:
+        await start()
+        await stopped.wait()
+    finally:
+        await stop()
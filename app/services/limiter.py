@@ -0,0 +1,166 @@
+"""
+按模型限制对话并发。
+
+每个模型最多 max_concurrency 个请求同时访问上游（流式请求占用到流结束），
+超出的请求按到达顺序排队，释放的名额直接交给队首，后来者不会插队；
+队列已满或排队超过 queue_timeout 秒时抛出 ModelOverloaded，由路由返回 429 和 Retry-After。
+合并到进行中相同请求的调用不占用名额。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from app.models.model import Model
+from app.services.metrics import counter, gauge
+
+MODEL_INFLIGHT = gauge(
+    "model_inflight_requests",
+    "占用并发名额、正在访问上游的对话请求数",
+    ("model_id",),
+)
+MODEL_QUEUE_DEPTH = gauge(
+    "model_queue_depth",
+    "等待并发名额的对话请求数",
+    ("model_id",),
+)
+MODEL_QUEUE_WAIT_SECONDS = counter(
+    "model_queue_wait_seconds_total",
+    "排队后获得并发名额的请求累计等待时间（秒）",
+    ("model_id",),
+)
+MODEL_QUEUE_ADMITTED = counter(
+    "model_queue_admitted_total",
+    "排队后获得并发名额的请求数",
+    ("model_id",),
+)
+MODEL_REJECTED = counter(
+    "model_rejected_total",
+    "因并发已满被拒绝（429）的对话请求数",
+    ("model_id", "reason"),
+)
+
+
+class ModelOverloaded(Exception):
+    def __init__(self, model_id: str, reason: str, retry_after: int):
+        super().__init__("模型繁忙，请稍后重试" if reason == "queue_full" else "排队超时，请稍后重试")
+        self.model_id = model_id
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ConcurrencySlot:
+    """一个并发名额；release() 可重复调用。"""
+
+    def __init__(self, limiter: Optional["_ModelLimiter"] = None):
+        self._limiter = limiter
+        self._acquired_at = time.monotonic()
+
+    def release(self) -> None:
+        limiter, self._limiter = self._limiter, None
+        if limiter is not None:
+            limiter.release(time.monotonic() - self._acquired_at)
+
+
+class _ModelLimiter:
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.limit = 0
+        self.in_use = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # 名额平均占用时长（秒），用于估算 Retry-After
+        self.hold_ewma = 1.0
+
+    def retry_after(self) -> int:
+        rounds = (len(self.waiters) + 1) / max(1, self.limit)
+        return max(1, math.ceil(self.hold_ewma * rounds))
+
+    def release(self, held: float) -> None:
+        self.hold_ewma = 0.2 * held + 0.8 * self.hold_ewma
+        self.in_use -= 1
+        self.wake()
+        MODEL_INFLIGHT.set(self.model_id, value=self.in_use)
+
+    def wake(self) -> None:
+        """把空出的名额按顺序交给排队者。"""
+        while self.waiters and self.in_use < self.limit:
+            fut = self.waiters.popleft()
+            if fut.done():
+                continue
+            self.in_use += 1
+            fut.set_result(None)
+        MODEL_QUEUE_DEPTH.set(self.model_id, value=len(self.waiters))
+
+    def reject(self, reason: str) -> ModelOverloaded:
+        MODEL_REJECTED.inc(self.model_id, reason)
+        return ModelOverloaded(self.model_id, reason, self.retry_after())
+
+    async def acquire(self, model: Model) -> ConcurrencySlot:
+        # 每次按模型记录上的最新配置调整上限，调大后立即放行排队者
+        self.limit = model.max_concurrency
+        self.wake()
+        if self.in_use < self.limit and not self.waiters:
+            self.in_use += 1
+            MODEL_INFLIGHT.set(self.model_id, value=self.in_use)
+            return ConcurrencySlot(self)
+        if len(self.waiters) >= model.max_queue:
+            raise self.reject("queue_full")
+
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        MODEL_QUEUE_DEPTH.set(self.model_id, value=len(self.waiters))
+        start = time.monotonic()
+        try:
+            await asyncio.wait((fut,), timeout=model.queue_timeout or None)
+        except asyncio.CancelledError:
+            # 等待者自己被取消（如客户端断开）：已分到的名额要还回去
+            if fut.done() and not fut.cancelled():
+                self.release(0.0)
+            else:
+                self._drop(fut)
+            raise
+        if not fut.done():
+            self._drop(fut)
+            raise self.reject("timeout")
+        MODEL_QUEUE_WAIT_SECONDS.inc(self.model_id, amount=time.monotonic() - start)
+        MODEL_QUEUE_ADMITTED.inc(self.model_id)
+        MODEL_INFLIGHT.set(self.model_id, value=self.in_use)
+        return ConcurrencySlot(self)
+
+    def _drop(self, fut: asyncio.Future) -> None:
+        fut.cancel()
+        try:
+            self.waiters.remove(fut)
+        except ValueError:
+            pass
+        MODEL_QUEUE_DEPTH.set(self.model_id, value=len(self.waiters))
+
+
+class ConcurrencyLimiter:
+    def __init__(self):
+        self._models: Dict[str, _ModelLimiter] = {}
+
+    async def acquire(self, model: Model) -> ConcurrencySlot:
+        """获取一个并发名额，必要时排队；未配置上限的模型直接返回空名额。"""
+        limiter = self._models.get(model.model_id)
+        if model.max_concurrency <= 0 and limiter is None:
+            return ConcurrencySlot()
+        if limiter is None:
+            limiter = _ModelLimiter(model.model_id)
+            self._models[model.model_id] = limiter
+        if model.max_concurrency <= 0:
+            # 上限被取消：放行所有排队者
+            limiter.limit = math.inf
+            limiter.wake()
+            return ConcurrencySlot()
+        return await limiter.acquire(model)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            model_id: {"limit": m.limit, "in_use": m.in_use, "queued": len(m.waiters)}
+            for model_id, m in self._models.items()
+        }
+
+
+concurrency_limiter = ConcurrencyLimiter()
@@ -0,0 +1,220 @@
+"""
+进程内指标，GET /metrics 按 Prometheus 文本格式输出。
+
+只做最简单的计数、瞬时值和直方图，热路径上就是一次加锁的字典累加（直方图多一次二分查找）。
+连接池占用这类瞬时值不在热路径上维护，由 on_collect 注册的回调在输出前读取。
+"""
+import asyncio
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+
+class Counter:
+    """带标签的单调递增计数器。"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}" for labels, v in self.samples()]
+
+
+class Gauge(Counter):
+    """带标签的瞬时值，可增可减。"""
+
+    type = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+# 耗时类直方图的默认分桶（秒）：大模型调用从几毫秒的缓存命中到几十秒的长输出都有
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    """带标签的直方图，按 Prometheus 的 le 分桶累计。"""
+
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            help_text: str,
+            labelnames: Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数（不累计，最后一格为 +Inf）, 总和]
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels: str, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[labels] = entry
+            entry[0][idx] += 1
+            entry[1][0] += value
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], Tuple[int, float]]]:
+        """各标签的 (次数, 总和)。"""
+        with self._lock:
+            return [(labels, (sum(counts), total[0])) for labels, (counts, total) in self._values.items()]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+        lines = []
+        names = self.labelnames + ("le",)
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+Metric = Union[Counter, Histogram]
+
+_registry: Dict[str, Metric] = {}
+_collectors: List[Callable[[], None]] = []
+
+
+def counter(name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    """注册（或取回已注册的）计数器。"""
+    metric = _registry.get(name)
+    if metric is None:
+        metric = Counter(name, help_text, labelnames)
+        _registry[name] = metric
+    return metric
+
+
+def gauge(name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+    """注册（或取回已注册的）瞬时值指标。"""
+    metric = _registry.get(name)
+    if metric is None:
+        metric = Gauge(name, help_text, labelnames)
+        _registry[name] = metric
+    return metric
+
+
+def histogram(
+        name: str,
+        help_text: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+) -> Histogram:
+    """注册（或取回已注册的）直方图。"""
+    metric = _registry.get(name)
+    if metric is None:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        _registry[name] = metric
+    return metric
+
+
+def all_metrics() -> List[Metric]:
+    return list(_registry.values())
+
+
+def on_collect(callback: Callable[[], None]) -> None:
+    """注册输出前执行的回调，用来刷新不在热路径上维护的瞬时值。"""
+    _collectors.append(callback)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus() -> str:
+    """全部指标的 Prometheus 文本格式（text/plain; version=0.0.4）。"""
+    for callback in _collectors:
+        callback()
+    lines = []
+    for metric in all_metrics():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+EVENT_LOOP_LAG = histogram(
+    "event_loop_lag_seconds",
+    "事件循环调度延迟：定时器实际唤醒时间比预期晚多少",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+_loop_lag_task: Optional[asyncio.Task] = None
+
+
+async def _watch_loop_lag(interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(value=max(0.0, loop.time() - start - interval))
+
+
+def start_loop_lag_monitor(interval: float) -> None:
+    """每 interval 秒采样一次事件循环延迟，interval 为 0 时不采样。"""
+    global _loop_lag_task
+    if interval > 0 and _loop_lag_task is None:
+        _loop_lag_task = asyncio.create_task(_watch_loop_lag(interval))
+
+
+async def stop_loop_lag_monitor() -> None:
+    global _loop_lag_task
+    task, _loop_lag_task = _loop_lag_task, None
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+CHAT_STREAM_CANCELLED = counter(
+    "chat_stream_cancelled_total",
+    "客户端断开导致中止的流式对话数",
+    ("model_id", "reason"),
+)
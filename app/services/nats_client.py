@@ -0,0 +1,49 @@
+"""
+NATS 连接：按 nats 配置中的默认账号认证（nkey 种子或用户名密码）。
+"""
+import logging
+from typing import Optional
+
+import nats
+from nats.aio.client import Client as NATS
+
+from app.config import NatsConfig
+
+logger = logging.getLogger(__name__)
+
+
+def nats_subject(template: str, client_id: str) -> str:
+    """填充主题模板中的 clientId（配置里两种写法都有）。"""
+    return template.replace("{clientId}", client_id).replace("{ClientID}", client_id)
+
+
+async def connect_nats(cfg: NatsConfig, name: Optional[str] = None) -> NATS:
+    options = {
+        "servers": [s.strip() for s in cfg.endpoint.split(",") if s.strip()],
+        "name": name or cfg.clientId,
+        # 默认无限重连，断线期间由客户端缓冲发布
+        "max_reconnect_attempts": -1,
+    }
+    account = cfg.account.get(cfg.defaultAccountName)
+    if account is not None:
+        if account.seed:
+            options["nkeys_seed_str"] = account.seed
+        elif account.username:
+            options["user"] = account.username
+            options["password"] = account.password or ""
+
+    async def on_error(e: Exception) -> None:
+        logger.warning("NATS 连接错误: %s", e)
+
+    async def on_disconnected() -> None:
+        logger.info("NATS 连接断开")
+
+    async def on_reconnected() -> None:
+        logger.info("NATS 已重新连接")
+
+    return await nats.connect(
+        error_cb=on_error,
+        disconnected_cb=on_disconnected,
+        reconnected_cb=on_reconnected,
+        **options,
+    )
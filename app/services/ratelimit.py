@@ -0,0 +1,231 @@
+"""
+按模型、按调用方的令牌桶限流（按需开启）。
+
+每次对话请求在访问上游之前检查最多四个桶：模型请求数、模型 token 数、调用方请求数、调用方 token 数，
+全部有余量才一起扣减，任一不足即拒绝并给出需要等待的秒数，被拒绝的请求不会建立上游连接。
+token 数在请求前按消息字符数估算（约 4 字符 1 token），不含输出部分。
+调用方按已认证的身份区分：认证中间件给出的用户，或 api_keys 中登记过的 API Key；其余请求按客户端 IP，
+请求头里任意填写的 Key 不会得到独立的额度。
+
+桶状态的存放：
+- LocalBucketStore：进程内字典，每次检查 O(1)，各 worker 各自计数；
+- RedisBucketStore：一段 Lua 脚本原子地完成检查与扣减，多个 worker 共享额度（需要安装 redis）。
+"""
+import hashlib
+import math
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+
+from app.config import RateLimitConfig, RateLimitRule
+from app.services.metrics import counter
+
+RATE_LIMITED = counter(
+    "rate_limited_total",
+    "被令牌桶限流拒绝（429）的对话请求数",
+    ("model_id", "bucket"),
+)
+
+# (桶 key, 每秒补充量, 容量, 本次消耗)
+BucketRequest = Tuple[str, float, float, float]
+
+
+class RateLimited(Exception):
+    def __init__(self, bucket: str, retry_after: int):
+        super().__init__("请求过于频繁，请稍后重试")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+class LocalBucketStore:
+    """进程内令牌桶；与 RedisBucketStore 语义一致，单进程部署或测试时使用。"""
+
+    def __init__(self, max_keys: int = 100000):
+        # key -> [剩余令牌, 上次更新时间]
+        self._buckets: Dict[str, List[float]] = {}
+        self._max_keys = max_keys
+
+    async def take(self, requests: Sequence[BucketRequest]) -> Tuple[float, int]:
+        """
+        全部桶都有余量时一起扣减并返回 (0, -1)；
+        否则不扣减，返回 (需要等待的秒数, 等待最久的桶的下标)。
+        """
+        now = time.monotonic()
+        states = []
+        wait, blocked = 0.0, -1
+        for i, (key, rate, capacity, cost) in enumerate(requests):
+            state = self._buckets.get(key)
+            tokens = capacity if state is None else min(capacity, state[0] + (now - state[1]) * rate)
+            states.append(tokens)
+            if tokens < cost and (cost - tokens) / rate > wait:
+                wait, blocked = (cost - tokens) / rate, i
+        if blocked >= 0:
+            return wait, blocked
+        if len(self._buckets) + len(requests) > self._max_keys:
+            self._sweep(now)
+        for (key, rate, capacity, cost), tokens in zip(requests, states):
+            self._buckets[key] = [tokens - cost, now]
+        return 0.0, -1
+
+    def _sweep(self, now: float) -> None:
+        """
+        丢弃已经补满的桶（与不存在等价），防止调用方标识过多时无限增长。
+        桶容量是每分钟额度，60 秒没有更新的桶必然已经补满。
+        """
+        idle = [k for k, (_, ts) in self._buckets.items() if now - ts > 60]
+        for k in idle:
+            del self._buckets[k]
+
+    async def aclose(self) -> None:
+        pass
+
+
+_REDIS_TAKE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local blocked = -1
+local left = {}
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[i * 3 - 2])
+  local capacity = tonumber(ARGV[i * 3 - 1])
+  local cost = tonumber(ARGV[i * 3])
+  local v = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(v[1])
+  if tokens == nil then
+    tokens = capacity
+  else
+    tokens = math.min(capacity, tokens + math.max(0, now - tonumber(v[2])) * rate)
+  end
+  left[i] = tokens - cost
+  if tokens < cost and (cost - tokens) / rate > wait then
+    wait = (cost - tokens) / rate
+    blocked = i - 1
+  end
+end
+if blocked >= 0 then
+  return {tostring(wait), blocked}
+end
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[i * 3 - 2])
+  local capacity = tonumber(ARGV[i * 3 - 1])
+  redis.call('HSET', key, 'tokens', left[i], 'ts', now)
+  redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return {'0', -1}
+"""
+
+
+class RedisBucketStore:
+    """多个 worker 共享的令牌桶；检查与扣减在 Redis 内原子完成，时间取 Redis 服务器时间。"""
+
+    def __init__(self, url: str, prefix: str = "myapi:rl:"):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("rate_limit.backend 为 redis 时需要安装 redis 包") from e
+        self._redis = aioredis.from_url(url)
+        self._script = self._redis.register_script(_REDIS_TAKE)
+        self._prefix = prefix
+
+    async def take(self, requests: Sequence[BucketRequest]) -> Tuple[float, int]:
+        keys = [self._prefix + key for key, _, _, _ in requests]
+        args: List[float] = []
+        for _, rate, capacity, cost in requests:
+            args.extend((rate, capacity, cost))
+        wait, blocked = await self._script(keys=keys, args=args)
+        return float(wait), int(blocked)
+
+    async def aclose(self) -> None:
+        await self._redis.aclose()
+
+
+def estimate_tokens(messages: Sequence[Dict]) -> int:
+    """粗略估算输入 token 数：约 4 个字符 1 个 token。"""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 4 + 1
+
+
+class RateLimiter:
+    def __init__(self, cfg: RateLimitConfig, store):
+        self._cfg = cfg
+        self._store = store
+
+    def caller_of(self, request: Request) -> str:
+        """调用方名称：认证过的用户、登记过的 API Key 对应的名称，否则为 ip:{客户端地址}。"""
+        user = request.scope.get("user")
+        if user is not None and getattr(user, "is_authenticated", False):
+            return f"user:{user.display_name}"
+        value = request.headers.get(self._cfg.caller_header)
+        if not value:
+            auth = request.headers.get("authorization", "")
+            value = auth[7:].strip() if auth[:7].lower() == "bearer " else ""
+        name = self._cfg.api_keys.get(value) if value else None
+        if name:
+            return name
+        return f"ip:{request.client.host if request.client else 'unknown'}"
+
+    @staticmethod
+    def _buckets(scope: str, rule: RateLimitRule, tokens: int) -> List[Tuple[str, BucketRequest]]:
+        out = []
+        if rule.requests_per_minute > 0:
+            cap = rule.requests_per_minute
+            out.append(("requests", (f"{scope}:req", cap / 60, cap, 1)))
+        if rule.tokens_per_minute > 0:
+            cap = rule.tokens_per_minute
+            out.append(("tokens", (f"{scope}:tok", cap / 60, cap, min(tokens, cap))))
+        return out
+
+    async def check(self, model_id: str, caller: str, tokens: int) -> None:
+        """额度不足时抛出 RateLimited；通过时已扣减。"""
+        model_rule = self._cfg.models.get(model_id, self._cfg.model)
+        caller_rule = self._cfg.callers.get(caller, self._cfg.caller)
+        # 调用方名称可能含任意字符，只用它的哈希作为桶 key
+        caller_key = hashlib.sha1(caller.encode("utf-8")).hexdigest()[:16]
+        named = (
+            [(f"model_{kind}", req) for kind, req in self._buckets(f"m:{model_id}", model_rule, tokens)]
+            + [(f"caller_{kind}", req) for kind, req in self._buckets(f"c:{caller_key}", caller_rule, tokens)]
+        )
+        if not named:
+            return
+        wait, blocked = await self._store.take([req for _, req in named])
+        if blocked < 0:
+            return
+        bucket = named[blocked][0]
+        RATE_LIMITED.inc(model_id, bucket)
+        raise RateLimited(bucket, max(1, math.ceil(wait)))
+
+    async def aclose(self) -> None:
+        await self._store.aclose()
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def init_rate_limiter(cfg: RateLimitConfig) -> Optional[RateLimiter]:
+    """按配置初始化限流器；关闭时不创建。"""
+    global _limiter
+    if not cfg.enabled:
+        _limiter = None
+        return None
+    if cfg.backend == "redis":
+        if not cfg.redis_url:
+            raise ValueError("rate_limit.backend 为 redis 时必须配置 redis_url")
+        store = RedisBucketStore(cfg.redis_url)
+    else:
+        store = LocalBucketStore()
+    _limiter = RateLimiter(cfg, store)
+    return _limiter
+
+
+async def close_rate_limiter() -> None:
+    global _limiter
+    if _limiter is None:
+        return
+    limiter, _limiter = _limiter, None
+    await limiter.aclose()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    return _limiter
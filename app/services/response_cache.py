@@ -0,0 +1,231 @@
+"""
+非流式对话的响应缓存（按需开启）。
+
+key 为 (model_id, model.type, messages 及其它采样参数) 的哈希：
+- 内存层：LRU，按字节总量封顶，条目带 TTL；
+- 磁盘层（可选）：每个 key 一个 JSON 文件，进程重启后仍可命中；文件的修改时间设为过期时间，
+  读取时和每 disk_sweep_seconds 清理过期文件，总大小超过 disk_max_bytes 时先删除最早过期的。
+是否缓存、TTL 可按 model_id 单独配置，命中/未命中计入 metrics。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import ResponseCacheConfig
+from app.models.model import Model
+from app.services.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+CHAT_CACHE_REQUESTS = counter(
+    "chat_cache_requests_total",
+    "非流式对话响应缓存查询次数",
+    ("model_id", "result"),
+)
+
+
+def chat_request_key(model: Model, payload: Dict[str, Any]) -> str:
+    """对话请求指纹：(model_id, model.type, 除 model/stream 外的全部参数) 的哈希，缓存与合并请求共用。"""
+    params = {k: v for k, v in payload.items() if k not in ("model", "stream")}
+    raw = json.dumps(
+        [model.model_id, model.type, params],
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cfg: ResponseCacheConfig):
+        self._cfg = cfg
+        # key -> (过期时间, 响应内容, 字节数)
+        self._entries: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._disk_dir: Optional[Path] = Path(cfg.disk_dir) if cfg.disk_dir else None
+        if self._disk_dir is not None:
+            self._disk_dir.mkdir(parents=True, exist_ok=True)
+        self._pending_writes: set = set()
+        # 磁盘层的大致总大小：写入时累加，清理时按实际文件重新统计
+        self._disk_bytes = 0
+        self._sweep_now = asyncio.Event()
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._disk_dir is not None:
+            self._sweep_task = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            await asyncio.gather(self._sweep_task, return_exceptions=True)
+            self._sweep_task = None
+        await asyncio.gather(*self._pending_writes, return_exceptions=True)
+
+    def settings_for(self, model_id: str) -> Tuple[bool, float]:
+        """返回该模型的 (是否启用, TTL 秒)。"""
+        enabled, ttl = self._cfg.enabled, self._cfg.ttl_seconds
+        override = self._cfg.models.get(model_id)
+        if override is not None:
+            if override.enabled is not None:
+                enabled = override.enabled
+            if override.ttl_seconds is not None:
+                ttl = override.ttl_seconds
+        return enabled and ttl > 0, ttl
+
+    async def get(self, model_id: str, key: str) -> Optional[Any]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                CHAT_CACHE_REQUESTS.inc(model_id, "hit")
+                return entry[1]
+            self._evict(key)
+        if self._disk_dir is not None:
+            found = await asyncio.to_thread(self._disk_read, key, now)
+            if found is not None:
+                expire_at, content, size = found
+                self._store(key, expire_at, content, size)
+                CHAT_CACHE_REQUESTS.inc(model_id, "disk_hit")
+                return content
+        CHAT_CACHE_REQUESTS.inc(model_id, "miss")
+        return None
+
+    def put(self, key: str, content: Any, size: int, ttl: float) -> None:
+        if size > self._cfg.max_entry_bytes:
+            return
+        expire_at = time.time() + ttl
+        self._store(key, expire_at, content, size)
+        if self._disk_dir is not None:
+            # 落盘不阻塞响应
+            task = asyncio.create_task(self._write(key, expire_at, content))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def _store(self, key: str, expire_at: float, content: Any, size: int) -> None:
+        self._evict(key)
+        self._entries[key] = (expire_at, content, size)
+        self._bytes += size
+        while self._bytes > self._cfg.max_bytes and self._entries:
+            _, (_, _, old_size) = self._entries.popitem(last=False)
+            self._bytes -= old_size
+
+    def _evict(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _disk_path(self, key: str) -> Path:
+        return self._disk_dir / key[:2] / f"{key}.json"
+
+    def _disk_read(self, key: str, now: float) -> Optional[Tuple[float, Any, int]]:
+        path = self._disk_path(key)
+        try:
+            raw = path.read_bytes()
+            data = json.loads(raw)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("响应缓存文件损坏，已删除: %s", path)
+            path.unlink(missing_ok=True)
+            return None
+        if data.get("expire_at", 0) <= now:
+            path.unlink(missing_ok=True)
+            return None
+        return data["expire_at"], data["content"], len(raw)
+
+    async def _write(self, key: str, expire_at: float, content: Any) -> None:
+        try:
+            self._disk_bytes += await asyncio.to_thread(self._disk_write, key, expire_at, content)
+        except Exception as e:
+            logger.warning("写入响应缓存文件失败: %s", e)
+            return
+        if self._disk_bytes > self._cfg.disk_max_bytes:
+            self._sweep_now.set()
+
+    def _disk_write(self, key: str, expire_at: float, content: Any) -> int:
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        raw = json.dumps({"expire_at": expire_at, "content": content}, ensure_ascii=False).encode("utf-8")
+        tmp.write_bytes(raw)
+        # 修改时间即过期时间，清理时不必逐个解析
+        os.utime(tmp, (expire_at, expire_at))
+        os.replace(tmp, path)
+        return len(raw)
+
+    async def _sweep(self) -> None:
+        """每 disk_sweep_seconds（或磁盘层超出上限时）清理一次磁盘层。"""
+        while True:
+            try:
+                await asyncio.wait_for(self._sweep_now.wait(), self._cfg.disk_sweep_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._sweep_now.clear()
+            try:
+                self._disk_bytes = await asyncio.to_thread(self._disk_sweep, time.time())
+            except Exception:
+                logger.exception("清理响应缓存文件失败")
+
+    def _disk_sweep(self, now: float) -> int:
+        """删除过期文件和遗留的临时文件，超出 disk_max_bytes 时再按过期时间从早到晚删除，返回剩余总大小。"""
+        files = []
+        total = 0
+        for path in self._disk_dir.glob("*/*"):
+            try:
+                st = path.stat()
+                if path.suffix == ".tmp":
+                    # 写入中途退出留下的临时文件
+                    if st.st_ctime < now - self._cfg.disk_sweep_seconds:
+                        path.unlink(missing_ok=True)
+                    continue
+                if st.st_mtime <= now:
+                    path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total > self._cfg.disk_max_bytes:
+            files.sort()
+            for _, size, path in files:
+                if total <= self._cfg.disk_max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+        return total
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def init_response_cache(cfg: ResponseCacheConfig) -> Optional[ResponseCache]:
+    """按配置初始化响应缓存；全局关闭且没有按模型开启时不创建。"""
+    global _cache
+    if not cfg.enabled and not any(m.enabled for m in cfg.models.values()):
+        _cache = None
+        return None
+    _cache = ResponseCache(cfg)
+    _cache.start()
+    return _cache
+
+
+async def close_response_cache() -> None:
+    global _cache
+    cache, _cache = _cache, None
+    if cache is not None:
+        await cache.stop()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _cache
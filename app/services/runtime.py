@@ -0,0 +1,45 @@
+"""
+对话相关服务的启动与关闭，供 API 进程的 lifespan 和独立的后台 worker 共用。
+调用前需已初始化异步数据库连接（init_async_db）。
+"""
+from app.config import Settings
+from app.db import close_async_db
+from app.models.model import alist_models, amodel_fingerprint
+from app.models.registry import model_registry
+from app.services.balancer import init_balancer
+from app.services.hedge import init_hedger
+from app.services.metrics import start_loop_lag_monitor, stop_loop_lag_monitor
+from app.services.ratelimit import init_rate_limiter, close_rate_limiter
+from app.services.response_cache import init_response_cache, close_response_cache
+from app.services.semantic_cache import init_semantic_cache
+from app.services.stream_replay import init_stream_replay
+from app.services.upstream import init_upstream_clients, close_upstream_clients
+from app.services.usage import init_usage_recorder, close_usage_recorder
+
+
+async def start_services(settings: Settings) -> None:
+    # 上游大模型连接池：按 origin 复用连接，关闭时统一释放
+    init_upstream_clients(settings.upstream)
+    # 多上游地址的负载均衡与熔断状态
+    init_balancer(settings.balancer)
+    init_hedger(settings.hedge)
+    init_response_cache(settings.response_cache)
+    init_stream_replay(settings.server.sse_resume_grace_seconds, settings.server.sse_replay_max_bytes)
+    init_semantic_cache(settings.semantic_cache, settings.milvus)
+    init_rate_limiter(settings.rate_limit)
+    # 用量记录写后批量落库，关闭时先写完缓冲再释放数据库连接
+    init_usage_recorder(settings.usage)
+    # 模型注册表：启动时全量加载，之后按指纹轮询
+    model_registry.configure(settings.registry)
+    await model_registry.start(alist_models, amodel_fingerprint)
+    start_loop_lag_monitor(settings.server.loop_lag_interval_seconds)
+
+
+async def stop_services() -> None:
+    await stop_loop_lag_monitor()
+    await model_registry.stop()
+    await close_upstream_clients()
+    await close_rate_limiter()
+    await close_response_cache()
+    await close_usage_recorder()
+    await close_async_db()
@@ -0,0 +1,342 @@
+"""
+非流式对话的语义缓存（按需开启）。
+
+精确缓存未命中后，用 semantic_cache.embedding_model_id 指定的向量模型把问题向量化，
+在同一模型、同一上下文（系统提示词与采样参数一致）的已有问题中找最相似的一条，
+余弦相似度不低于阈值时直接返回它的回答。只处理单轮问题，多轮对话不参与。
+
+索引后端：
+- NumpyIndex：进程内，每个模型一个归一化后的 float32 矩阵，查询是一次矩阵乘法；
+  条目带 TTL，数量超过 max_entries 时淘汰最久未命中的；
+- MilvusIndex：使用 milvus 配置中的实例，多个 worker 共享（需要安装 pymilvus）。
+向量化失败时跳过缓存，不影响对话本身。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import MilvusConfig, SemanticCacheConfig
+from app.models.model import Model, aget_model_cached
+from app.services.embedding import embed_one
+from app.services.metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_REQUESTS = counter(
+    "semantic_cache_requests_total",
+    "语义缓存查询次数",
+    ("model_id", "result"),
+)
+SEMANTIC_CACHE_EVICTIONS = counter(
+    "semantic_cache_evictions_total",
+    "语义缓存淘汰的条目数",
+    ("model_id", "reason"),
+)
+SEMANTIC_CACHE_ENTRIES = gauge(
+    "semantic_cache_entries",
+    "语义缓存当前条目数（仅进程内索引）",
+    ("model_id",),
+)
+
+
+def semantic_query(model: Model, payload: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+    """
+    返回 (待向量化的问题, 上下文指纹)；不是单轮问题时返回 None。
+    上下文指纹覆盖模型、系统提示词和除 messages 外的采样参数，只有指纹相同的条目才会互相命中。
+    """
+    messages = payload.get("messages") or []
+    system = [m for m in messages if m.get("role") == "system"]
+    rest = [m for m in messages if m.get("role") != "system"]
+    if len(rest) != 1 or rest[0].get("role") != "user" or not rest[0].get("content"):
+        return None
+    params = {k: v for k, v in payload.items() if k not in ("model", "stream", "messages")}
+    raw = json.dumps(
+        [model.model_id, model.type, system, params],
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    scope = int.from_bytes(hashlib.sha256(raw.encode("utf-8")).digest()[:8], "big", signed=True)
+    return rest[0]["content"], scope
+
+
+class NumpyIndex:
+    """单个模型的进程内向量索引。"""
+
+    def __init__(self, model_id: str, max_entries: int):
+        import numpy as np
+
+        self._np = np
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.size = 0
+        self._vectors = None
+        self._scopes = np.zeros(0, dtype=np.int64)
+        self._expire_at = np.zeros(0, dtype=np.float64)
+        self._last_hit = np.zeros(0, dtype=np.float64)
+        self._contents: List[Any] = []
+
+    def search(self, vector, scope: int, threshold: float) -> Optional[Any]:
+        np = self._np
+        if self.size == 0 or vector.shape[0] != self._vectors.shape[1]:
+            return None
+        n = self.size
+        now = time.time()
+        sims = self._vectors[:n] @ vector
+        sims[(self._scopes[:n] != scope) | (self._expire_at[:n] <= now)] = -np.inf
+        i = int(np.argmax(sims))
+        if sims[i] < threshold:
+            return None
+        self._last_hit[i] = now
+        return self._contents[i]
+
+    def add(self, vector, scope: int, content: Any, ttl: float) -> None:
+        np = self._np
+        if self._vectors is None or vector.shape[0] != self._vectors.shape[1]:
+            # 首次写入，或向量模型换了维度：重建
+            self._reset(vector.shape[0])
+        now = time.time()
+        if self.size >= self.max_entries:
+            self._evict(now)
+        if self.size == self._vectors.shape[0]:
+            self._grow()
+        i = self.size
+        self._vectors[i] = vector
+        self._scopes[i] = scope
+        self._expire_at[i] = now + ttl
+        self._last_hit[i] = now
+        self._contents.append(content)
+        self.size += 1
+        SEMANTIC_CACHE_ENTRIES.set(self.model_id, value=self.size)
+
+    def _reset(self, dim: int) -> None:
+        np = self._np
+        cap = min(self.max_entries, 64)
+        self._vectors = np.zeros((cap, dim), dtype=np.float32)
+        self._scopes = np.zeros(cap, dtype=np.int64)
+        self._expire_at = np.zeros(cap, dtype=np.float64)
+        self._last_hit = np.zeros(cap, dtype=np.float64)
+        self._contents = []
+        self.size = 0
+
+    def _grow(self) -> None:
+        np = self._np
+        cap = min(self.max_entries, max(1, self._vectors.shape[0] * 2))
+        extra = cap - self._vectors.shape[0]
+        self._vectors = np.vstack([self._vectors, np.zeros((extra, self._vectors.shape[1]), dtype=np.float32)])
+        self._scopes = np.concatenate([self._scopes, np.zeros(extra, dtype=np.int64)])
+        self._expire_at = np.concatenate([self._expire_at, np.zeros(extra, dtype=np.float64)])
+        self._last_hit = np.concatenate([self._last_hit, np.zeros(extra, dtype=np.float64)])
+
+    def _evict(self, now: float) -> None:
+        """先清理过期条目；仍然满时淘汰最久未命中的一条。"""
+        np = self._np
+        expired = np.nonzero(self._expire_at[:self.size] <= now)[0]
+        if len(expired):
+            # 从后往前删，交换删除不会影响尚未处理的下标
+            for i in sorted(expired.tolist(), reverse=True):
+                self._remove(int(i))
+            SEMANTIC_CACHE_EVICTIONS.inc(self.model_id, "ttl", amount=len(expired))
+            return
+        self._remove(int(np.argmin(self._last_hit[:self.size])))
+        SEMANTIC_CACHE_EVICTIONS.inc(self.model_id, "capacity")
+
+    def _remove(self, i: int) -> None:
+        """把最后一条移到 i 处，保持矩阵紧凑。"""
+        last = self.size - 1
+        if i != last:
+            self._vectors[i] = self._vectors[last]
+            self._scopes[i] = self._scopes[last]
+            self._expire_at[i] = self._expire_at[last]
+            self._last_hit[i] = self._last_hit[last]
+            self._contents[i] = self._contents[last]
+        self._contents.pop()
+        self.size = last
+
+
+def _milvus_str(value: str) -> str:
+    """Milvus 过滤表达式中的字符串字面量：转义反斜杠和双引号，值不会改变表达式结构。"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class MilvusIndex:
+    """Milvus 上的共享索引，所有模型共用一个集合，按 model_id 和上下文指纹过滤。"""
+
+    def __init__(self, cfg: MilvusConfig, collection: str):
+        try:
+            from pymilvus import MilvusClient
+        except ImportError as e:
+            raise RuntimeError("semantic_cache.backend 为 milvus 时需要安装 pymilvus") from e
+        uri = cfg.host if "://" in cfg.host else f"http://{cfg.host}"
+        self._client = MilvusClient(uri=uri, user=cfg.username, password=cfg.password, db_name=cfg.dbname)
+        self._collection = collection
+        self._ready = False
+
+    def _ensure(self, dim: int) -> None:
+        if self._ready:
+            return
+        if not self._client.has_collection(self._collection):
+            self._client.create_collection(
+                collection_name=self._collection,
+                dimension=dim,
+                metric_type="COSINE",
+                id_type="string",
+                max_length=64,
+                auto_id=False,
+            )
+        self._ready = True
+
+    def search(self, model_id: str, vector: List[float], scope: int, threshold: float) -> Optional[Any]:
+        self._ensure(len(vector))
+        hits = self._client.search(
+            collection_name=self._collection,
+            data=[vector],
+            limit=1,
+            filter=f"model_id == {_milvus_str(model_id)} and scope == {int(scope)} and expire_at > {time.time()}",
+            output_fields=["content"],
+        )
+        if not hits or not hits[0] or hits[0][0]["distance"] < threshold:
+            return None
+        return json.loads(hits[0][0]["entity"]["content"])
+
+    def add(self, model_id: str, vector: List[float], scope: int, content: Any, ttl: float) -> None:
+        self._ensure(len(vector))
+        now = time.time()
+        key = hashlib.sha1(f"{model_id}:{scope}:{now}".encode("utf-8")).hexdigest()
+        self._client.insert(
+            collection_name=self._collection,
+            data=[{
+                "id": key,
+                "vector": vector,
+                "model_id": model_id,
+                "scope": scope,
+                "expire_at": now + ttl,
+                "content": json.dumps(content, ensure_ascii=False),
+            }],
+        )
+
+    def purge_expired(self) -> None:
+        self._client.delete(collection_name=self._collection, filter=f"expire_at <= {time.time()}")
+
+
+class SemanticProbe:
+    """一次查询的中间结果；未命中时用于随后写入回答。"""
+
+    def __init__(self, model_id: str, vector, scope: int):
+        self.model_id = model_id
+        self.vector = vector
+        self.scope = scope
+
+
+class SemanticCache:
+    def __init__(self, cfg: SemanticCacheConfig, milvus: Optional[MilvusConfig] = None):
+        self._cfg = cfg
+        self._indexes: Dict[str, NumpyIndex] = {}
+        self._milvus: Optional[MilvusIndex] = None
+        self._last_purge = 0.0
+        if cfg.backend == "milvus":
+            self._milvus = MilvusIndex(milvus, cfg.milvus_collection)
+        else:
+            import numpy  # noqa: F401  提前暴露缺少依赖的问题
+
+    def settings_for(self, model_id: str) -> Tuple[bool, float]:
+        """返回该模型的 (是否启用, 相似度阈值)。"""
+        enabled, threshold = self._cfg.enabled, self._cfg.threshold
+        override = self._cfg.models.get(model_id)
+        if override is not None:
+            if override.enabled is not None:
+                enabled = override.enabled
+            if override.threshold is not None:
+                threshold = override.threshold
+        return enabled and bool(self._cfg.embedding_model_id), threshold
+
+    async def lookup(self, model: Model, payload: Dict[str, Any]) -> Tuple[Optional[Any], Optional[SemanticProbe]]:
+        """返回 (命中的回答, 未命中时用于写入的 probe)；不参与缓存时两者都是 None。"""
+        enabled, threshold = self.settings_for(model.model_id)
+        if not enabled:
+            return None, None
+        query = semantic_query(model, payload)
+        if query is None:
+            SEMANTIC_CACHE_REQUESTS.inc(model.model_id, "skip")
+            return None, None
+        text, scope = query
+        embedder = await aget_model_cached(self._cfg.embedding_model_id)
+        if embedder is None:
+            SEMANTIC_CACHE_REQUESTS.inc(model.model_id, "error")
+            return None, None
+        try:
+            vector, _ = await embed_one(embedder, text)
+        except Exception as e:
+            logger.warning("语义缓存向量化失败，跳过: %s", e)
+            SEMANTIC_CACHE_REQUESTS.inc(model.model_id, "error")
+            return None, None
+
+        if self._milvus is not None:
+            content = await asyncio.to_thread(self._milvus.search, model.model_id, vector, scope, threshold)
+            probe = SemanticProbe(model.model_id, vector, scope)
+        else:
+            import numpy as np
+
+            v = np.asarray(vector, dtype=np.float32)
+            norm = float(np.linalg.norm(v))
+            if norm == 0:
+                SEMANTIC_CACHE_REQUESTS.inc(model.model_id, "skip")
+                return None, None
+            v /= norm
+            index = self._indexes.get(model.model_id)
+            content = index.search(v, scope, threshold) if index is not None else None
+            probe = SemanticProbe(model.model_id, v, scope)
+        SEMANTIC_CACHE_REQUESTS.inc(model.model_id, "hit" if content is not None else "miss")
+        return content, (None if content is not None else probe)
+
+    def store(self, probe: SemanticProbe, content: Any) -> None:
+        ttl = self._cfg.ttl_seconds
+        if self._milvus is not None:
+            task = asyncio.create_task(asyncio.to_thread(self._milvus_add, probe, content, ttl))
+            task.add_done_callback(_log_task_error)
+            return
+        index = self._indexes.get(probe.model_id)
+        if index is None:
+            index = NumpyIndex(probe.model_id, self._cfg.max_entries)
+            self._indexes[probe.model_id] = index
+        index.add(probe.vector, probe.scope, content, ttl)
+
+    def _milvus_add(self, probe: SemanticProbe, content: Any, ttl: float) -> None:
+        self._milvus.add(probe.model_id, probe.vector, probe.scope, content, ttl)
+        # 过期条目由写入方顺带清理，间隔不短于 TTL 的十分之一
+        now = time.time()
+        if now - self._last_purge > ttl / 10:
+            self._last_purge = now
+            self._milvus.purge_expired()
+
+    def stats(self) -> Dict[str, int]:
+        return {model_id: index.size for model_id, index in self._indexes.items()}
+
+
+def _log_task_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("语义缓存写入失败: %s", task.exception())
+
+
+_cache: Optional[SemanticCache] = None
+
+
+def init_semantic_cache(cfg: SemanticCacheConfig, milvus: Optional[MilvusConfig] = None) -> Optional[SemanticCache]:
+    """按配置初始化语义缓存；全局关闭且没有按模型开启时不创建。"""
+    global _cache
+    if not cfg.enabled and not any(m.enabled for m in cfg.models.values()):
+        _cache = None
+        return None
+    if not cfg.embedding_model_id:
+        logger.warning("semantic_cache 已开启但未配置 embedding_model_id，语义缓存不生效")
+        _cache = None
+        return None
+    _cache = SemanticCache(cfg, milvus)
+    return _cache
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    return _cache
@@ -0,0 +1,240 @@
+"""
+上游流 -> SSE 的转发实现。
+
+- relay_sse_bytes：字节级转发（默认）。上游已是 SSE 时按事件边界原样转发，不做解码/重编码；
+  上游不是 SSE 时才逐行包装成 `data: ...`。
+- relay_sse_text：原有的 str 实现，保留用于对比和回退（server.sse_relay_mode = text）。
+两者都只在完整的行/事件边界输出，调用方可以在两次输出之间安全地插入心跳。
+"""
+import codecs
+from typing import AsyncIterator, Optional, Union
+
+SSE_FIELD_PREFIXES = (b"data:", b"event:", b"id:", b"retry:", b":")
+_SSE_FIELD_PREFIXES_STR = ("data:", "event:", "id:", "retry:", ":")
+
+
+def looks_like_sse(data: bytes) -> Optional[bool]:
+    """根据开头内容判断上游是否已经是 SSE；内容太短还无法判断时返回 None。"""
+    head = data.lstrip(b"\xef\xbb\xbf\r\n\t ")
+    if head.startswith(SSE_FIELD_PREFIXES):
+        return True
+    if any(p.startswith(head) for p in SSE_FIELD_PREFIXES):
+        return None
+    return False
+
+
+def _utf8_complete_len(data) -> int:
+    """返回 data 中以完整 UTF-8 字符结尾的最长前缀长度，末尾被截断的多字节字符留到下一块。"""
+    n = len(data)
+    for back in range(1, min(4, n) + 1):
+        b = data[n - back]
+        if b < 0x80:
+            return n
+        if b >= 0xC0:
+            need = 2 if b < 0xE0 else 3 if b < 0xF0 else 4
+            return n if back >= need else n - back
+    return n
+
+
+def _wrap_line(line) -> bytes:
+    if bytes(line[:6]).startswith(SSE_FIELD_PREFIXES):
+        return bytes(line) + b"\n"
+    return b"data: " + line + b"\n\n"
+
+
+class SSELineFramer:
+    """
+    增量行切分：只扫描新到的字节，用偏移量而不是反复切片整段缓冲区，
+    单块包含大量行时也是线性复杂度。
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, chunk: bytes):
+        """喂入一块数据，返回其中完整的行（memoryview，不含换行符，已去掉行尾 \\r）。"""
+        if self._buf:
+            self._buf += chunk
+            raw = self._buf
+            self._buf = bytearray()
+        else:
+            raw = chunk
+        data = memoryview(raw)
+        lines = []
+        pos = 0
+        while True:
+            idx = raw.find(b"\n", pos)
+            if idx < 0:
+                break
+            end = idx - 1 if idx > pos and raw[idx - 1] == 0x0D else idx
+            lines.append(data[pos:end])
+            pos = idx + 1
+        if pos < len(raw):
+            self._buf = bytearray(data[pos:])
+        return lines
+
+    def pending(self) -> bytes:
+        return bytes(self._buf)
+
+    def take_pending(self, limit: Optional[int] = None) -> bytes:
+        """取出未成行的缓冲（可限定长度，剩余部分继续保留）。"""
+        if limit is None or limit >= len(self._buf):
+            out = bytes(self._buf)
+            self._buf = bytearray()
+            return out
+        out = bytes(self._buf[:limit])
+        del self._buf[:limit]
+        return out
+
+
+class SSEEventFramer:
+    """
+    上游已是 SSE 时使用：累积到最后一个事件边界（空行）为止，边界之前的字节整体原样输出。
+    上游按事件 flush 时（最常见），输入块直接透传，不产生任何拷贝。
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    @staticmethod
+    def _last_boundary(data, start: int) -> int:
+        """返回最后一个事件边界之后的位置，没有边界时返回 -1。"""
+        lf = data.rfind(b"\n\n", start)
+        crlf = data.rfind(b"\n\r\n", start)
+        if lf < 0 and crlf < 0:
+            return -1
+        return max(lf + 2 if lf >= 0 else -1, crlf + 3 if crlf >= 0 else -1)
+
+    def feed(self, chunk: bytes) -> Optional[bytes]:
+        if not self._buf:
+            if chunk.endswith((b"\n\n", b"\r\n\r\n")):
+                return chunk
+            end = self._last_boundary(chunk, 0)
+            if end < 0:
+                self._buf += chunk
+                return None
+            self._buf += memoryview(chunk)[end:]
+            return chunk[:end]
+        start = max(0, len(self._buf) - 2)
+        self._buf += chunk
+        end = self._last_boundary(self._buf, start)
+        if end < 0:
+            return None
+        out = bytes(self._buf[:end])
+        del self._buf[:end]
+        return out
+
+    def take_pending(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf = bytearray()
+        return out
+
+
+async def relay_sse_bytes(
+        chunks: AsyncIterator[bytes],
+        upstream_is_sse: Optional[bool] = None,
+) -> AsyncIterator[bytes]:
+    """
+    字节级转发。upstream_is_sse 为 None 时根据首块内容判断（通常由 Content-Type 给出）。
+    """
+    event_framer: Optional[SSEEventFramer] = None
+    line_framer: Optional[SSELineFramer] = None
+    head = b""
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if event_framer is None and line_framer is None:
+            if upstream_is_sse is None:
+                head += chunk
+                upstream_is_sse = looks_like_sse(head)
+                if upstream_is_sse is None:
+                    continue
+                chunk, head = head, b""
+            if upstream_is_sse:
+                event_framer = SSEEventFramer()
+            else:
+                line_framer = SSELineFramer()
+
+        if event_framer is not None:
+            out = event_framer.feed(chunk)
+            if out:
+                yield out
+            continue
+
+        lines = line_framer.feed(chunk)
+        if not lines:
+            # 非 SSE 且没有换行：立即作为一条 data 发出（打字机效果），截断的多字节字符留到下一块
+            pending = line_framer.pending()
+            cut = _utf8_complete_len(pending)
+            if cut:
+                yield _wrap_line(line_framer.take_pending(cut))
+            continue
+        parts = []
+        for line in lines:
+            parts.append(_wrap_line(line) if len(line) else b"\n")
+        yield b"".join(parts)
+
+    # 上游结束：输出缓冲中剩余的内容（未以换行或空行结尾的最后一行 / 事件）
+    if head.strip():
+        yield _wrap_line(head.strip())
+    elif event_framer is not None:
+        tail = event_framer.take_pending().strip()
+        if tail:
+            yield tail + b"\n\n"
+    elif line_framer is not None:
+        tail = line_framer.take_pending().strip()
+        if tail:
+            yield _wrap_line(tail)
+
+
+def with_event_id(out: Union[bytes, str], event_id: str) -> Union[bytes, str]:
+    """
+    给 out 中最后一个事件加上 id 字段（插在结束空行之前），客户端重连时会带上 Last-Event-ID。
+    out 不以事件边界结尾时原样返回。
+    """
+    if isinstance(out, bytes):
+        if out.endswith(b"\r\n\r\n"):
+            return b"".join((memoryview(out)[:-2], b"id: ", event_id.encode("ascii"), b"\r\n\r\n"))
+        if out.endswith(b"\n\n"):
+            return b"".join((memoryview(out)[:-1], b"id: ", event_id.encode("ascii"), b"\n\n"))
+        return out
+    if out.endswith("\r\n\r\n"):
+        return f"{out[:-2]}id: {event_id}\r\n\r\n"
+    if out.endswith("\n\n"):
+        return f"{out[:-1]}id: {event_id}\n\n"
+    return out
+
+
+def _to_sse_line(text: str) -> str:
+    if text.startswith(_SSE_FIELD_PREFIXES_STR):
+        return f"{text}\n"
+    return f"data: {text}\n\n"
+
+
+async def relay_sse_text(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """原有的 str 实现：逐块解码后按行切分再包装。"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += decoder.decode(chunk)
+        if "\n" not in buffer:
+            # 上游是 SSE 时等到完整的一行再转发
+            if buffer.startswith("data:"):
+                continue
+            # 否则立即作为一条 data 发出（打字机效果）
+            yield _to_sse_line(buffer)
+            buffer = ""
+            continue
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            line = line.rstrip("\r")
+            if line == "":
+                yield "\n"
+                continue
+            yield _to_sse_line(line)
+    # 上游结束：输出缓冲中剩余的内容
+    tail = buffer.strip()
+    if tail:
+        yield _to_sse_line(tail)
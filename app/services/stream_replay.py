@@ -0,0 +1,113 @@
+"""
+SSE 断线续传：按 stream_id 保存进行中和刚结束的流式生成，客户端带 Last-Event-ID 重连时从断点继续。
+
+- 缓冲区就是生成本身的 StreamBroadcast（请求合并也用它），续传不需要额外拷贝；
+- 生成结束后保留 grace_seconds，之后移出；最后一个客户端断开后生成也会继续 grace_seconds 等待重连；
+- 所有登记中的流的内容总量不超过 max_bytes，超出时按最近使用顺序淘汰：被淘汰的流不能再续传，
+  不再保留已写出的分段，无人订阅、正在等待重连的生成立即取消，使内存实际回落到上限以内。
+事件 ID 的格式为 "{stream_id}-{已发送的分段数}"。
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Optional, Tuple
+from uuid import uuid4
+
+from app.services.broadcast import StreamBroadcast
+from app.services.metrics import counter, gauge, on_collect
+
+SSE_REPLAY_BYTES = gauge("sse_replay_bytes", "可续传的流占用的缓冲区大小")
+SSE_REPLAY_STREAMS = gauge("sse_replay_streams", "可续传的流数量")
+SSE_REPLAY_EVICTIONS = counter(
+    "sse_replay_evictions_total",
+    "续传缓冲区被移出的次数",
+    ("reason",),
+)
+
+
+class StreamReplay:
+    def __init__(self, grace_seconds: float, max_bytes: int):
+        self.grace_seconds = grace_seconds
+        self.max_bytes = max_bytes
+        # stream_id -> (生成, model_id)，按最近使用排序
+        self._entries: "OrderedDict[str, Tuple[StreamBroadcast, str]]" = OrderedDict()
+        self._bytes = 0
+
+    def register(self, bc: StreamBroadcast, model_id: str) -> None:
+        """为新的生成分配 stream_id 并登记。"""
+        bc.stream_id = uuid4().hex
+        self._entries[bc.stream_id] = (bc, model_id)
+        self._bytes += bc.size
+
+    def charge(self, bc: StreamBroadcast, size: int) -> None:
+        """生成追加了 size 长度的内容；超出总量上限时淘汰最久未使用的流。"""
+        if bc.stream_id not in self._entries:
+            return
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            stream_id = next(iter(self._entries))
+            self._remove(stream_id)
+            SSE_REPLAY_EVICTIONS.inc("memory")
+
+    def finished(self, bc: StreamBroadcast) -> None:
+        """生成结束：保留 grace_seconds 供重连，之后移出；被取消的生成不能续传，直接移出。"""
+        if bc.stream_id not in self._entries:
+            return
+        if bc.closing:
+            self._remove(bc.stream_id)
+            return
+        self._entries.move_to_end(bc.stream_id)
+        asyncio.get_running_loop().call_later(self.grace_seconds, self._expire, bc)
+
+    def resume(self, last_event_id: str, model_id: str) -> Optional[Tuple[StreamBroadcast, int]]:
+        """
+        解析 Last-Event-ID，返回 (生成, 续传起点)；流已过期、被淘汰、已取消或 ID 不合法时返回 None。
+        成功时已为调用方订阅。
+        """
+        stream_id, _, index = last_event_id.strip().rpartition("-")
+        entry = self._entries.get(stream_id)
+        if entry is None or not index.isdigit():
+            return None
+        bc, owner = entry
+        start = int(index)
+        if owner != model_id or start > bc.count or bc.closing:
+            return None
+        self._entries.move_to_end(stream_id)
+        bc.subscribe()
+        return bc, start
+
+    def _expire(self, bc: StreamBroadcast) -> None:
+        entry = self._entries.get(bc.stream_id)
+        if entry is not None and entry[0] is bc:
+            self._remove(bc.stream_id)
+            SSE_REPLAY_EVICTIONS.inc("expired")
+
+    def _remove(self, stream_id: str) -> None:
+        bc, _ = self._entries.pop(stream_id)
+        self._bytes -= bc.size
+        bc.forget()
+
+    def collect(self) -> None:
+        SSE_REPLAY_BYTES.set(value=self._bytes)
+        SSE_REPLAY_STREAMS.set(value=len(self._entries))
+
+
+_replay: Optional[StreamReplay] = None
+
+
+def init_stream_replay(grace_seconds: float, max_bytes: int) -> Optional[StreamReplay]:
+    """grace_seconds 为 0 时不开启续传。"""
+    global _replay
+    _replay = StreamReplay(grace_seconds, max_bytes) if grace_seconds > 0 and max_bytes > 0 else None
+    return _replay
+
+
+def get_stream_replay() -> Optional[StreamReplay]:
+    return _replay
+
+
+def _collect() -> None:
+    if _replay is not None:
+        _replay.collect()
+
+
+on_collect(_collect)
@@ -0,0 +1,92 @@
+"""
+上游大模型 HTTP 客户端池。
+
+按上游 origin（scheme://host:port）复用 httpx.AsyncClient，避免每次请求都重新建立 TCP/TLS 连接。
+在 FastAPI lifespan 中初始化与关闭，见 app.main。
+"""
+import asyncio
+from typing import Dict, Optional
+
+import httpx
+
+from app.config import UpstreamConfig
+
+
+class UpstreamClients:
+    """以上游 origin 为 key 的 AsyncClient 注册表。"""
+
+    def __init__(self, cfg: UpstreamConfig):
+        self._cfg = cfg
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def origin_of(url: str) -> str:
+        u = httpx.URL(url)
+        port = u.port or (443 if u.scheme == "https" else 80)
+        return f"{u.scheme}://{u.host}:{port}"
+
+    def _build_client(self) -> httpx.AsyncClient:
+        cfg = self._cfg
+        limits = httpx.Limits(
+            max_connections=cfg.max_connections,
+            max_keepalive_connections=cfg.max_keepalive_connections,
+            keepalive_expiry=cfg.keepalive_expiry,
+        )
+        # 请求级的 timeout 会整体替换这里的设置，每次请求都应经 upstream_timeout() 传入
+        timeout = httpx.Timeout(30.0, connect=cfg.connect_timeout)
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=cfg.http2)
+
+    async def get(self, url: str) -> httpx.AsyncClient:
+        origin = self.origin_of(url)
+        client = self._clients.get(origin)
+        if client is not None:
+            return client
+        async with self._lock:
+            client = self._clients.get(origin)
+            if client is None:
+                client = self._build_client()
+                self._clients[origin] = client
+            return client
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+
+_clients: Optional[UpstreamClients] = None
+
+
+def init_upstream_clients(cfg: UpstreamConfig) -> UpstreamClients:
+    """初始化全局客户端池（lifespan 启动时调用）。"""
+    global _clients
+    if _clients is None:
+        _clients = UpstreamClients(cfg)
+    return _clients
+
+
+async def close_upstream_clients() -> None:
+    """关闭全部上游连接（lifespan 关闭时调用）。"""
+    global _clients
+    if _clients is None:
+        return
+    clients, _clients = _clients, None
+    await clients.aclose()
+
+
+def upstream_timeout(seconds: Optional[float], read: bool = True) -> httpx.Timeout:
+    """
+    单次上游请求的超时：读、写和等待连接池按 seconds（模型的 timeout，未设置时 30 秒），建立连接按 connect_timeout。
+    read 为 False 时不限制读超时（流式输出的空闲截止由调用方负责）。
+    """
+    cfg = _clients._cfg if _clients is not None else UpstreamConfig()
+    seconds = seconds or 30
+    return httpx.Timeout(seconds, read=seconds if read else None, connect=cfg.connect_timeout)
+
+
+async def get_upstream_client(url: str) -> httpx.AsyncClient:
+    """获取 url 对应 origin 的共享客户端；未经 lifespan 初始化时（如脚本）按默认配置懒加载。"""
+    if _clients is None:
+        init_upstream_clients(UpstreamConfig())
+    return await _clients.get(url)
@@ -0,0 +1,199 @@
+"""
+对话用量记录（t_usage），写后批量落库：请求路径上只把记录放进内存缓冲，不额外执行同步 INSERT。
+
+- 缓冲达到 batch_size 条或距上次写入超过 flush_interval_seconds 时，后台任务用一次多行 executemany 写入；
+- 缓冲（含写入中的）上限 max_pending 条，超出时丢弃新记录并计数；写入失败的批次同样丢弃并计数，不重试；
+- 停止时写完缓冲中的全部记录。
+token 数优先取上游返回的 usage；流式没有 usage 时按含内容的分段数计数（随输出逐段累计），输入 token 按字符数估算。
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import insert
+
+from app.config import UsageConfig
+from app.db import UsageRecord, get_async_db_session
+from app.services.metrics import counter, gauge, histogram, on_collect
+from app.services.ratelimit import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+USAGE_RECORDS = counter(
+    "usage_records_total",
+    "用量记录数：written 为已写入，dropped 为缓冲已满被丢弃，failed 为写入失败被丢弃",
+    ("result",),
+)
+USAGE_PENDING = gauge("usage_records_pending", "等待写入的用量记录数")
+USAGE_FLUSH_SECONDS = histogram("usage_flush_seconds", "一批用量记录写入数据库的耗时")
+
+# 流式分段中内容为空的 delta（如只带 role 的首段）不计入输出 token
+_EMPTY_CONTENT = re.compile(r'"content"\s*:\s*(""|null)')
+
+
+def completion_usage(messages: Sequence[Dict], content: Any) -> Tuple[int, int, str]:
+    """非流式响应的 (输入 token, 输出 token, 来源)。"""
+    usage = content.get("usage") if isinstance(content, dict) else None
+    if isinstance(usage, dict) and "prompt_tokens" in usage:
+        return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0), "upstream"
+    completion = 0
+    if isinstance(content, dict):
+        choices = content.get("choices") or []
+        completion = estimate_tokens([c.get("message") or {} for c in choices if isinstance(c, dict)]) if choices else 0
+    return estimate_tokens(messages), completion, "estimated"
+
+
+class StreamUsage:
+    """流式输出的用量，随分段逐步累计，不保留完整输出；跨分段的行先缓存到下一段。"""
+
+    def __init__(self) -> None:
+        self.usage: Optional[Dict] = None
+        self.pieces = 0
+        self._tail = ""
+
+    def feed(self, chunk: Union[bytes, str]) -> None:
+        text = chunk.decode("utf-8", errors="replace") if isinstance(chunk, bytes) else chunk
+        lines = (self._tail + text).split("\n")
+        self._tail = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def result(self, messages: Sequence[Dict]) -> Tuple[int, int, str]:
+        """(输入 token, 输出 token, 来源)；上游在末尾给出 usage 时以其为准。"""
+        if self._tail:
+            self._line(self._tail)
+            self._tail = ""
+        usage = self.usage
+        if isinstance(usage, dict) and "prompt_tokens" in usage:
+            return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0), "upstream"
+        return estimate_tokens(messages), self.pieces, "stream"
+
+    def _line(self, line: str) -> None:
+        if not line.startswith("data:"):
+            return
+        data = line[5:].strip()
+        if not data.startswith("{"):
+            return
+        if '"usage"' in data:
+            try:
+                self.usage = json.loads(data).get("usage") or self.usage
+            except ValueError:
+                pass
+        if '"content"' in data and not _EMPTY_CONTENT.search(data):
+            self.pieces += 1
+
+
+class UsageRecorder:
+    def __init__(self, cfg: UsageConfig):
+        self._cfg = cfg
+        self._buffer: List[Dict[str, Any]] = []
+        # 正在写入的条数，同样占用 max_pending
+        self._flushing = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台任务，写完缓冲中剩余的记录。"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self._flush()
+
+    def record(
+            self,
+            model_id: str,
+            mode: str,
+            prompt_tokens: int,
+            completion_tokens: int,
+            token_source: str,
+            latency: float,
+            status: int,
+    ) -> None:
+        """放入缓冲，不等待写入；缓冲已满时丢弃。"""
+        if len(self._buffer) + self._flushing >= self._cfg.max_pending:
+            USAGE_RECORDS.inc("dropped")
+            return
+        self._buffer.append({
+            "model_id": model_id,
+            "mode": mode,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "token_source": token_source,
+            "latency_ms": int(latency * 1000),
+            "status": status,
+            "created_at": datetime.now(),
+        })
+        if len(self._buffer) >= self._cfg.batch_size:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._cfg.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+
+    async def _flush(self) -> None:
+        while self._buffer:
+            rows = self._buffer[:self._cfg.batch_size]
+            del self._buffer[:self._cfg.batch_size]
+            self._flushing = len(rows)
+            start = time.perf_counter()
+            try:
+                async with get_async_db_session() as session:
+                    # 传入多行参数时 SQLAlchemy 走 executemany（MySQL 驱动会合并为多行 INSERT）
+                    await session.execute(insert(UsageRecord), rows)
+            except Exception as e:
+                logger.warning("写入用量记录失败，丢弃 %d 条: %s", len(rows), e)
+                USAGE_RECORDS.inc("failed", amount=len(rows))
+            else:
+                USAGE_RECORDS.inc("written", amount=len(rows))
+            finally:
+                self._flushing = 0
+                USAGE_FLUSH_SECONDS.observe(value=time.perf_counter() - start)
+
+    def collect(self) -> None:
+        USAGE_PENDING.set(value=len(self._buffer) + self._flushing)
+
+
+_recorder: Optional[UsageRecorder] = None
+
+
+def init_usage_recorder(cfg: UsageConfig) -> Optional[UsageRecorder]:
+    """按配置创建并启动用量记录；关闭时不创建，get_usage_recorder() 返回 None。"""
+    global _recorder
+    _recorder = UsageRecorder(cfg) if cfg.enabled else None
+    if _recorder is not None:
+        _recorder.start()
+    return _recorder
+
+
+async def close_usage_recorder() -> None:
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        await recorder.stop()
+
+
+def get_usage_recorder() -> Optional[UsageRecorder]:
+    return _recorder
+
+
+def _collect() -> None:
+    if _recorder is not None:
+        _recorder.collect()
+
+
+on_collect(_collect)
@@ -0,0 +1,382 @@
+"""
+对话接口负载基准：本地 mock 上游 + SQLite 模型表，离线测量代理本身带来的开销。
+
+流程：
+1. 启动 benchmarks.mock_llm 作为上游（首字延迟、生成速度、分块大小可调）；
+2. 建一个 SQLite 库并写入指向 mock 的模型，生成临时配置（db.url），启动代理进程；
+3. 对每个模式（stream / once）和并发数，分别直连 mock、经代理请求 /api/v1/models/chat/{model_id}，
+   统计 TTFT（首个 data: 事件）与总耗时的 p50/p99、吞吐，以及代理进程每个并发流的内存增量；
+   代理增加的延迟 = 经代理 − 直连；
+4. 结果写入 benchmarks/results/（JSON），--baseline 指定以前的结果时逐项对比。
+每个请求的 prompt 都不同，不会命中缓存或被合并。负载由单个 Python 进程产生，并发很高时压测端本身可能先成为瓶颈。
+
+用法（仓库根目录，需要 aiosqlite：pip install '.[bench]'）：
+    python -m benchmarks.chat_load
+    python -m benchmarks.chat_load --concurrency 1,32,128 --modes stream --tokens 500 --tokens-per-sec 50
+    python -m benchmarks.chat_load --baseline benchmarks/results/chat-load-20260101-120000.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import yaml
+
+from benchmarks.mock_llm import add_arguments as add_mock_arguments
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+RESULTS_DIR = REPO_DIR / "benchmarks" / "results"
+
+
+def seed_database(db_path: Path, upstream_url: str) -> str:
+    """建表并写入一个指向 mock 上游的模型，返回 model_id。"""
+    from sqlalchemy import create_engine
+
+    from app.config import DBConfig
+    from app.db import Base, init_db
+    from app.models.model import ModelCreateRequest, create_model_entry
+
+    url = f"sqlite:///{db_path}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    init_db(DBConfig(host="", port=0, username="", password="", database="", maxConnections=1, url=url))
+    model = create_model_entry(ModelCreateRequest(
+        name="bench-mock",
+        endpoint=upstream_url,
+        api_key="bench",
+        type="mock",
+        timeout=300,
+    ))
+    return model.model_id
+
+
+def write_config(base_config: Path, path: Path, db_path: Path, port: int) -> None:
+    """在现有配置的基础上改用 SQLite，并关闭会影响测量的缓存、限流和后台消费者。"""
+    with base_config.open("r", encoding="utf-8") as f:
+        raw = yaml.safe_load(f)
+    raw.setdefault("server", {})["port"] = port
+    raw["db"]["url"] = f"sqlite:///{db_path}"
+    for section in ("response_cache", "semantic_cache", "rate_limit", "article_worker", "images_proc"):
+        raw.setdefault(section, {})["enabled"] = False
+    with path.open("w", encoding="utf-8") as f:
+        yaml.safe_dump(raw, f, allow_unicode=True)
+
+
+def spawn(args: List[str], log_path: Path, env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    full_env = {**os.environ, "PYTHONPATH": str(REPO_DIR), **(env or {})}
+    log = log_path.open("wb")
+    return subprocess.Popen([sys.executable, *args], cwd=REPO_DIR, env=full_env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url: str, proc: subprocess.Popen, log_path: Path, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"进程启动失败：\n{log_path.read_text(errors='replace')}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"等待 {url} 超时：\n{log_path.read_text(errors='replace')}")
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """进程常驻内存（Linux /proc），其它平台返回 None。"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+class Target:
+    """被测对象：直连 mock 或经代理。"""
+
+    def __init__(self, name: str, url: str, stream_url: str, model: str, via_proxy: bool):
+        self.name = name
+        self.url = url
+        self.stream_url = stream_url
+        self.model = model
+        self.via_proxy = via_proxy
+
+    def body(self, prompt: str, stream: bool) -> Dict[str, Any]:
+        if self.via_proxy:
+            return {"prompt": prompt}
+        body = {"model": self.model, "messages": [{"role": "user", "content": prompt}]}
+        if stream:
+            body["stream"] = True
+        return body
+
+
+async def _one_stream(client: httpx.AsyncClient, target: Target, prompt: str) -> Dict[str, float]:
+    start = time.perf_counter()
+    ttft = None
+    size = 0
+    async with client.stream("POST", target.stream_url, json=target.body(prompt, True)) as r:
+        if r.status_code != 200 or not r.headers.get("content-type", "").startswith("text/event-stream"):
+            await r.aread()
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+        async for chunk in r.aiter_raw():
+            if ttft is None and b"data:" in chunk:
+                ttft = time.perf_counter() - start
+            size += len(chunk)
+    return {"ttft": ttft if ttft is not None else time.perf_counter() - start,
+            "latency": time.perf_counter() - start, "bytes": size}
+
+
+async def _one_call(client: httpx.AsyncClient, target: Target, prompt: str) -> Dict[str, float]:
+    start = time.perf_counter()
+    r = await client.post(target.url, json=target.body(prompt, False))
+    if r.status_code != 200 or "choices" not in r.json():
+        raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+    return {"latency": time.perf_counter() - start, "bytes": len(r.content)}
+
+
+async def run_level(
+        target: Target,
+        mode: str,
+        concurrency: int,
+        requests: int,
+        tag: str,
+        pid: Optional[int] = None,
+) -> Dict[str, Any]:
+    """以固定并发发出 requests 个请求，返回统计结果；传入 pid 时同时采样该进程的内存。"""
+    one = _one_stream if mode == "stream" else _one_call
+    samples: List[Dict[str, float]] = []
+    errors: List[str] = []
+    counter = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(300, connect=10)) as client:
+        async def worker() -> None:
+            for i in counter:
+                try:
+                    samples.append(await one(client, target, f"{tag} #{i} {time.time_ns()}"))
+                except Exception as e:
+                    errors.append(str(e))
+
+        rss_idle = rss_bytes(pid) if pid else None
+        rss_peak = rss_idle
+        workers = asyncio.gather(*(worker() for _ in range(concurrency)))
+        start = time.perf_counter()
+        while not workers.done():
+            await asyncio.wait([workers], timeout=0.05)
+            if pid:
+                rss = rss_bytes(pid)
+                if rss is not None and (rss_peak is None or rss > rss_peak):
+                    rss_peak = rss
+        wall = time.perf_counter() - start
+        await workers
+
+    latency = [s["latency"] for s in samples]
+    result: Dict[str, Any] = {
+        "requests": len(samples),
+        "errors": len(errors),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(samples) / wall, 2) if wall > 0 else None,
+        "bytes_per_sec": round(sum(s["bytes"] for s in samples) / wall) if wall > 0 else None,
+        "latency_ms": {"p50": _ms(percentile(latency, 0.5)), "p99": _ms(percentile(latency, 0.99))},
+    }
+    if mode == "stream":
+        ttft = [s["ttft"] for s in samples]
+        result["ttft_ms"] = {"p50": _ms(percentile(ttft, 0.5)), "p99": _ms(percentile(ttft, 0.99))}
+    if rss_idle is not None and rss_peak is not None:
+        result["rss_idle_mb"] = round(rss_idle / 2 ** 20, 1)
+        result["rss_peak_mb"] = round(rss_peak / 2 ** 20, 1)
+        result["rss_per_stream_kb"] = round((rss_peak - rss_idle) / 1024 / concurrency, 1)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def _added(direct: Dict[str, Any], proxy: Dict[str, Any], key: str) -> Dict[str, Optional[float]]:
+    out = {}
+    for p in ("p50", "p99"):
+        a, b = direct.get(key, {}).get(p), proxy.get(key, {}).get(p)
+        out[p] = round(b - a, 2) if a is not None and b is not None else None
+    return out
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    print(f"{'mode':>6} {'conc':>5} {'direct p50':>11} {'proxy p50':>10} {'proxy p99':>10} "
+          f"{'added p50':>10} {'added p99':>10} {'rps':>8} {'err':>4} {'KB/stream':>10}")
+    for r in results:
+        key = "ttft_ms" if r["mode"] == "stream" else "latency_ms"
+        d, p, added = r["direct"][key], r["proxy"][key], r["proxy_added_ms"]
+        rss = r["proxy"].get("rss_per_stream_kb")
+        print(f"{r['mode']:>6} {r['concurrency']:>5} {d['p50']:>11} {p['p50']:>10} {p['p99']:>10} "
+              f"{added['p50']:>10} {added['p99']:>10} {r['proxy']['throughput_rps']:>8} "
+              f"{r['proxy']['errors']:>4} {rss if rss is not None else '-':>10}")
+    print("（stream 为 TTFT，once 为总耗时，单位 ms；added = 经代理 − 直连）")
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: Path) -> None:
+    with baseline_path.open("r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["mode"], r["concurrency"]): r for r in baseline["results"]}
+    if not any((r["mode"], r["concurrency"]) in old for r in results):
+        print(f"\n基线 {baseline_path} 中没有相同的模式和并发档位，无法对比")
+        return
+    print(f"\n与基线对比：{baseline_path}（{baseline['meta'].get('git_revision')} @ {baseline['meta'].get('timestamp')}）")
+    print(f"{'mode':>6} {'conc':>5} {'metric':>16} {'baseline':>10} {'current':>10} {'change':>8}")
+    for r in results:
+        b = old.get((r["mode"], r["concurrency"]))
+        if b is None:
+            continue
+        rows = [
+            ("added p50 ms", b["proxy_added_ms"]["p50"], r["proxy_added_ms"]["p50"]),
+            ("added p99 ms", b["proxy_added_ms"]["p99"], r["proxy_added_ms"]["p99"]),
+            ("proxy rps", b["proxy"]["throughput_rps"], r["proxy"]["throughput_rps"]),
+            ("KB/stream", b["proxy"].get("rss_per_stream_kb"), r["proxy"].get("rss_per_stream_kb")),
+        ]
+        for name, before, after in rows:
+            change = "-"
+            if before and after is not None:
+                change = f"{(after - before) / abs(before) * 100:+.1f}%"
+            print(f"{r['mode']:>6} {r['concurrency']:>5} {name:>16} {before!s:>10} {after!s:>10} {change:>8}")
+
+
+async def run(args: argparse.Namespace, proxy: Target, direct: Target, proxy_pid: int) -> List[Dict[str, Any]]:
+    results = []
+    # 预热：建立连接、加载模型注册表
+    for mode in args.modes:
+        await run_level(proxy, mode, 4, 8, "warmup")
+        await run_level(direct, mode, 4, 8, "warmup")
+    for mode in args.modes:
+        for concurrency in args.concurrency:
+            requests = args.requests or max(50, concurrency * 4)
+            d = await run_level(direct, mode, concurrency, requests, f"direct-{mode}-{concurrency}")
+            p = await run_level(proxy, mode, concurrency, requests, f"proxy-{mode}-{concurrency}", proxy_pid)
+            key = "ttft_ms" if mode == "stream" else "latency_ms"
+            results.append({
+                "mode": mode,
+                "concurrency": concurrency,
+                "requests": requests,
+                "direct": d,
+                "proxy": p,
+                "proxy_added_ms": _added(d, p, key),
+            })
+            print(f"  {mode} x{concurrency}: 完成 {p['requests']}/{requests}，错误 {p['errors'] + d['errors']}", flush=True)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Chat proxy load benchmark against a local mock upstream")
+    parser.add_argument("--concurrency", default="1,16,64", help="并发数列表，逗号分隔")
+    parser.add_argument("--modes", default="stream,once", help="stream、once 或两者")
+    parser.add_argument("--requests", type=int, default=0, help="每档请求数，默认 max(50, 并发数×4)")
+    parser.add_argument("--config", default=str(REPO_DIR / "etc" / "config.yaml"), help="作为基础的配置文件")
+    parser.add_argument("--proxy-port", type=int, default=18090)
+    parser.add_argument("--upstream-port", type=int, default=18091)
+    parser.add_argument("--proxy-arg", action="append", default=[], help="追加给 uvicorn 的参数，可多次指定")
+    parser.add_argument("--output", help=f"结果文件，默认写到 {RESULTS_DIR.relative_to(REPO_DIR)}/")
+    parser.add_argument("--baseline", help="以前的结果文件，打印对比")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    args.modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+
+    mock_args = [
+        "--latency-ms", str(args.latency_ms),
+        "--tokens", str(args.tokens),
+        "--tokens-per-sec", str(args.tokens_per_sec),
+        "--chunk-tokens", str(args.chunk_tokens),
+    ]
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}/v1/chat/completions"
+    proxy_base = f"http://127.0.0.1:{args.proxy_port}"
+
+    with tempfile.TemporaryDirectory(prefix="chat-load-") as tmp:
+        tmp_dir = Path(tmp)
+        db_path = tmp_dir / "bench.db"
+        config_path = tmp_dir / "config.yaml"
+        model_id = seed_database(db_path, upstream_url)
+        write_config(Path(args.config), config_path, db_path, args.proxy_port)
+
+        procs = []
+        try:
+            upstream_log = tmp_dir / "upstream.log"
+            procs.append(spawn(["-m", "benchmarks.mock_llm", "--port", str(args.upstream_port), *mock_args], upstream_log))
+            wait_ready(f"http://127.0.0.1:{args.upstream_port}/", procs[-1], upstream_log)
+
+            proxy_log = tmp_dir / "proxy.log"
+            procs.append(spawn(
+                ["-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.proxy_port),
+                 "--log-level", "warning", "--no-access-log", *args.proxy_arg],
+                proxy_log,
+                env={"MYAPI_CONFIG": str(config_path)},
+            ))
+            wait_ready(f"{proxy_base}/", procs[-1], proxy_log)
+
+            chat_url = f"{proxy_base}/api/v1/models/chat/{model_id}"
+            proxy = Target("proxy", chat_url, f"{chat_url}?stream=1", "mock", True)
+            direct = Target("direct", upstream_url, upstream_url, "mock", False)
+            print(f"mock 上游：{' '.join(mock_args)}")
+            results = asyncio.run(run(args, proxy, direct, procs[-1].pid))
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                try:
+                    proc.wait(10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    print()
+    print_results(results)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("baseline", "output")},
+        },
+        "results": results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"chat-load-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存：{output}")
+    if args.baseline:
+        compare(results, Path(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
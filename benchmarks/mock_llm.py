@@ -0,0 +1,112 @@
+"""
+基准测试用的本地 OpenAI 兼容上游：不访问真实模型，按参数模拟首字延迟、生成速度和分块大小。
+
+- 请求体 "stream": true 时返回 SSE（chat.completion.chunk，最后是 data: [DONE]），否则返回一次性的 JSON；
+- 任意 POST 路径都按对话接口处理，便于直接把模型的 endpoint 指向它。
+用法（仓库根目录）：
+    python -m benchmarks.mock_llm --port 18091
+    python -m benchmarks.mock_llm --port 18091 --latency-ms 300 --tokens 500 --tokens-per-sec 80 --chunk-tokens 4
+"""
+import argparse
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class MockConfig:
+    # 收到请求到输出第一段内容的延迟
+    latency_ms: float = 200
+    # 每次回复的 token 数
+    tokens: int = 200
+    # 单个请求的生成速度，0 表示不限速
+    tokens_per_sec: float = 100
+    # 每个 SSE 事件包含的 token 数
+    chunk_tokens: int = 1
+    token: str = "你好"
+
+
+def create_app(cfg: MockConfig) -> FastAPI:
+    app = FastAPI(title="mock llm")
+    interval = cfg.chunk_tokens / cfg.tokens_per_sec if cfg.tokens_per_sec > 0 else 0
+
+    def chunk(i: int, content: str) -> bytes:
+        data = {
+            "id": f"chatcmpl-mock-{i}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "mock",
+            "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+        }
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+    async def sse():
+        await asyncio.sleep(cfg.latency_ms / 1000)
+        sent = 0
+        i = 0
+        while sent < cfg.tokens:
+            n = min(cfg.chunk_tokens, cfg.tokens - sent)
+            yield chunk(i, cfg.token * n)
+            sent += n
+            i += 1
+            if sent < cfg.tokens and interval:
+                await asyncio.sleep(interval)
+        yield b"data: [DONE]\n\n"
+
+    @app.post("/{path:path}")
+    async def chat(path: str, request: Request):
+        payload = await request.json()
+        if payload.get("stream"):
+            return StreamingResponse(sse(), media_type="text/event-stream")
+        generate = cfg.tokens / cfg.tokens_per_sec if cfg.tokens_per_sec > 0 else 0
+        await asyncio.sleep(cfg.latency_ms / 1000 + generate)
+        return JSONResponse({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model") or "mock",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": cfg.token * cfg.tokens},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": cfg.tokens, "total_tokens": cfg.tokens},
+        })
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = MockConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="首段内容前的延迟（毫秒）")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="每次回复的 token 数")
+    parser.add_argument("--tokens-per-sec", type=float, default=defaults.tokens_per_sec, help="单个请求的生成速度，0 不限速")
+    parser.add_argument("--chunk-tokens", type=int, default=defaults.chunk_tokens, help="每个 SSE 事件的 token 数")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency_ms=args.latency_ms,
+        tokens=args.tokens,
+        tokens_per_sec=args.tokens_per_sec,
+        chunk_tokens=max(1, args.chunk_tokens),
+    )
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18091)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+SSE 转发微基准：对比 relay_sse_text（原实现）与 relay_sse_bytes（字节级转发）。
+
+不依赖网络，直接把构造好的上游分块喂给两种实现，统计吞吐。
+用法（仓库根目录）：
+    python -m benchmarks.sse_relay_bench
+    python -m benchmarks.sse_relay_bench --events 20000 --chunk-size 65536 --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.services.sse import relay_sse_bytes, relay_sse_text
+
+
+def build_upstream(events: int, token: str) -> bytes:
+    lines = []
+    for i in range(events):
+        delta = {"id": f"chatcmpl-{i}", "choices": [{"index": 0, "delta": {"content": token}}]}
+        lines.append(f"data: {json.dumps(delta, ensure_ascii=False)}\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+
+def split_chunks(body: bytes, chunk_size: int):
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+async def _aiter(chunks):
+    for c in chunks:
+        yield c
+
+
+async def _drain(relay) -> int:
+    total = 0
+    async for out in relay:
+        total += len(out)
+    return total
+
+
+async def run_case(name: str, make_relay, chunks, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await _drain(make_relay(_aiter(chunks)))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="SSE relay micro-benchmark")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--token", default="你好")
+    parser.add_argument("--chunk-size", type=int, action="append",
+                        help="上游分块大小（字节），可多次指定；默认 64 / 4096 / 65536 / 整体一块")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    body = build_upstream(args.events, args.token)
+    sizes = args.chunk_size or [64, 4096, 65536, len(body)]
+    print(f"upstream: {args.events} events, {len(body)} bytes")
+    print(f"{'chunk':>10} {'text (ms)':>12} {'bytes (ms)':>12} {'speedup':>8}")
+    for size in sizes:
+        chunks = split_chunks(body, size)
+        t_text = await run_case("text", relay_sse_text, chunks, args.repeat)
+        t_bytes = await run_case("bytes", lambda it: relay_sse_bytes(it, True), chunks, args.repeat)
+        print(f"{size:>10} {t_text * 1000:>12.2f} {t_bytes * 1000:>12.2f} {t_text / t_bytes:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -15,6 +15,10 @@ HOST_CONFIG_FILE="${HOST_ETC_DIR}/etc/config.yaml"
 # 容器路径
 CONTAINER_CONFIG_PATH="/app/my-api-server/etc/config.yaml"
 
+# 容器停止等待时间 = server.shutdown_timeout_seconds + 余量，进行中的 SSE 流才能正常结束
+STOP_TIMEOUT_MARGIN=10
+DEFAULT_SHUTDOWN_TIMEOUT=30
+
 # 端口配置
 HOST_PORT=3000
 CONTAINER_PORT=3000
@@ -37,6 +41,21 @@ check_env() {
 
 }
 
+# -------------------------------
+# 从配置文件读取 server.shutdown_timeout_seconds（未配置时取默认值），向上取整后加余量
+# -------------------------------
+stop_timeout() {
+    local shutdown
+    shutdown=$(awk '
+        /^[^[:space:]#]/ { in_server = ($0 ~ /^server:/) }
+        in_server && $1 == "shutdown_timeout_seconds:" { gsub(/["\047]/, "", $2); print $2; exit }
+    ' "${HOST_CONFIG_FILE}")
+    if ! [[ "${shutdown}" =~ ^[0-9]+(\.[0-9]+)?$ ]]; then
+        shutdown=${DEFAULT_SHUTDOWN_TIMEOUT}
+    fi
+    awk -v s="${shutdown}" -v m="${STOP_TIMEOUT_MARGIN}" 'BEGIN { n = int(s); if (n < s) n++; print n + m }'
+}
+
 # -------------------------------
 # 镜像检查与拉取
 # -------------------------------
@@ -85,8 +104,12 @@ start_container() {
 
     ensure_image
 
+    local timeout
+    timeout=$(stop_timeout)
+    print_info "容器停止等待时间: ${timeout} 秒"
     docker run -d \
         --name "${CONTAINER_NAME}" \
+        --stop-timeout "${timeout}" \
         -p "${HOST_PORT}:${CONTAINER_PORT}" \
         -v "${HOST_CONFIG_FILE}:${CONTAINER_CONFIG_PATH}" \
         "${FULL_IMAGE_NAME}"
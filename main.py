@@ -1,7 +1,12 @@
 """
 兼容入口文件，便于使用 `uvicorn main:app` 启动。
 实际应用代码位于 `app/` 包内。
+
+python main.py          生产模式：按 server 配置的端口、进程数、事件循环启动，停止时等待进行中的请求
+python main.py --dev    开发模式：单进程，代码变更自动重载
 """
+import argparse
+import os
 
 from app.main import app  # noqa: F401
 from app.config import get_settings
@@ -10,11 +15,27 @@ from app.config import get_settings
 if __name__ == "__main__":
     import uvicorn
 
-    settings = get_settings()
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=settings.server.port,
-        reload=True,
-    )
+    parser = argparse.ArgumentParser(description="MyAPI Python Server")
+    parser.add_argument("--dev", action="store_true", help="开发模式：单进程，代码变更自动重载")
+    args = parser.parse_args()
 
+    settings = get_settings()
+    server = settings.server
+    if args.dev:
+        uvicorn.run(
+            "main:app",
+            host=server.host,
+            port=server.port,
+            reload=True,
+        )
+    else:
+        uvicorn.run(
+            # 多进程时每个子进程按导入路径重新加载应用
+            "app.main:app",
+            host=server.host,
+            port=server.port,
+            workers=server.workers or os.cpu_count() or 1,
+            loop=server.loop,
+            http=server.http,
+            timeout_graceful_shutdown=server.shutdown_timeout_seconds,
+        )
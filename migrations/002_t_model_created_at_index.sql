@@ -0,0 +1,3 @@
+-- 模型列表按 (created_at, model_id) 排序分页（LIMIT/OFFSET 与 keyset 游标），补充联合索引避免全表排序
+
+CREATE INDEX idx_t_model_created_at_model_id ON t_model (created_at, model_id);
@@ -0,0 +1,11 @@
+-- 模型上游地址表：一个模型可配置多个带权重的上游地址，用于负载均衡与故障转移
+-- t_model.endpoint 仍作为默认地址（权重 1），本表中同一地址的记录可覆盖其权重
+
+CREATE TABLE IF NOT EXISTS t_model_endpoint (
+    id         BIGINT        PRIMARY KEY AUTO_INCREMENT,
+    model_id   VARCHAR(64)   NOT NULL,
+    endpoint   VARCHAR(255)  NOT NULL,
+    weight     INT           NOT NULL DEFAULT 1,
+    enable     INT           NOT NULL DEFAULT 1,
+    KEY idx_t_model_endpoint_model_id (model_id)
+);
@@ -0,0 +1,7 @@
+-- 按模型限制并发：max_concurrency 为同时进行的对话请求上限（0 表示不限制），
+-- 超出后最多 max_queue 个请求按到达顺序排队，排队超过 queue_timeout 秒（0 表示一直等待）或队列已满时返回 429
+
+ALTER TABLE t_model
+    ADD COLUMN max_concurrency INT NOT NULL DEFAULT 0,
+    ADD COLUMN max_queue       INT NOT NULL DEFAULT 0,
+    ADD COLUMN queue_timeout   INT NOT NULL DEFAULT 10;
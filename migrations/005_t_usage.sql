@@ -0,0 +1,16 @@
+-- 用量表：每次上游对话调用一行（模型、输入/输出 token 数、耗时、状态码），用于容量规划和按模型计费
+-- 由应用批量写入（usage 配置），token_source 标明 token 数来自上游 usage、流式分段计数还是按字符数估算
+
+CREATE TABLE IF NOT EXISTS t_usage (
+    id                BIGINT       PRIMARY KEY AUTO_INCREMENT,
+    model_id          VARCHAR(64)  NOT NULL,
+    mode              VARCHAR(16)  NOT NULL,
+    prompt_tokens     INT          NOT NULL DEFAULT 0,
+    completion_tokens INT          NOT NULL DEFAULT 0,
+    token_source      VARCHAR(16)  NOT NULL,
+    latency_ms        INT          NOT NULL DEFAULT 0,
+    status            INT          NOT NULL DEFAULT 0,
+    created_at        DATETIME     NOT NULL,
+    KEY idx_t_usage_model_id (model_id),
+    KEY idx_t_usage_created_at (created_at)
+);
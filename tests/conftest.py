@@ -0,0 +1,54 @@
+import asyncio
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+
+# 测试使用仓库自带的配置文件
+os.environ.setdefault("MYAPI_CONFIG", str(Path(__file__).resolve().parents[1] / "etc" / "config.yaml"))
+
+
+class FakeLease:
+    def release(self) -> None:
+        pass
+
+    def record(self, ok: bool, latency=None) -> None:
+        pass
+
+
+class FakeStream:
+    """替换 chat.open_hedged 的流式上游：send() 放入的分段依次作为响应体输出，close() 结束。"""
+
+    def __init__(self):
+        self.opened = 0
+        self._queue: "asyncio.Queue" = asyncio.Queue()
+
+    def send(self, *chunks: bytes) -> None:
+        for chunk in chunks:
+            self._queue.put_nowait(chunk)
+
+    def close(self) -> None:
+        self._queue.put_nowait(None)
+
+    async def _body(self):
+        while True:
+            chunk = await self._queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    async def open_hedged(self, model, payload, headers, timeout, first_chunk):
+        self.opened += 1
+        resp = httpx.Response(200, headers={"content-type": "text/event-stream"})
+        return resp, FakeLease(), self._body()
+
+
+@pytest.fixture
+def fake_stream(monkeypatch) -> FakeStream:
+    from app.services import chat
+
+    stream = FakeStream()
+    monkeypatch.setattr(chat, "open_hedged", stream.open_hedged)
+    monkeypatch.setattr(chat, "_inflight_streams", {})
+    return stream
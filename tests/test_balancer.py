@@ -0,0 +1,148 @@
+"""
+多上游地址：连接失败换地址、熔断与单个试探请求、least_outstanding / ewma 选择。
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.config import BalancerConfig
+from app.models.model import Model, ModelEndpoint
+from app.services import balancer
+from app.services.balancer import UPSTREAM_FAILOVER, EndpointBalancer, open_upstream
+from app.services.upstream import upstream_timeout
+
+A, B, C = "http://a.test/v1", "http://b.test/v1", "http://c.test/v1"
+
+
+def _model(*extra: str, weights=None) -> Model:
+    weights = weights or {}
+    endpoints = [ModelEndpoint(endpoint=url, weight=weights.get(url, 1)) for url in extra]
+    return Model(model_id="m", name="m", endpoint=A, api_key="k", endpoints=endpoints)
+
+
+@pytest.fixture
+def lb(monkeypatch):
+    def make(**kwargs) -> EndpointBalancer:
+        instance = EndpointBalancer(BalancerConfig(**kwargs))
+        monkeypatch.setattr(balancer, "_balancer", instance)
+        return instance
+
+    return make
+
+
+def test_connect_error_fails_over_to_the_next_endpoint(lb, monkeypatch):
+    b = lb(max_attempts=2, failure_threshold=1)
+    hosts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hosts.append(request.url.host)
+        if request.url.host == "a.test":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    async def get_client(url):
+        return client
+
+    monkeypatch.setattr(balancer, "get_upstream_client", get_client)
+    model = _model(B)
+    # A 先被选中（B 已有在途请求）
+    busy = b.acquire(model, exclude=[A])
+    failovers = UPSTREAM_FAILOVER.get("m")
+
+    async def run():
+        used = []
+        resp, lease = await open_upstream(model, {}, {}, upstream_timeout(5), used=used)
+        await resp.aread()
+        lease.release()
+        await client.aclose()
+        return resp, used
+
+    resp, used = asyncio.run(run())
+    busy.release()
+    assert resp.json() == {"ok": True}
+    assert hosts == ["a.test", "b.test"] and used == [A, B]
+    assert UPSTREAM_FAILOVER.get("m") == failovers + 1
+    # failure_threshold=1：A 已熔断，B 没有在途请求
+    stats = {s["endpoint"]: s for s in b.stats()}
+    assert stats[A]["open"] and stats[B]["outstanding"] == 0
+
+
+def test_circuit_opens_and_half_open_admits_a_single_probe(lb):
+    b = lb(failure_threshold=2, open_seconds=30)
+    model = _model(B)
+    for _ in range(2):
+        lease = b.acquire(model, exclude=[B])
+        lease.record(False)
+        lease.release()
+    # 熔断中：只选 B
+    assert {b.acquire(model).url for _ in range(3)} == {B}
+    state = b._state(A)
+    state.open_until = 1.0
+    b._state(B).outstanding = 100
+    probe = b.acquire(model)
+    assert probe.url == A
+    # 试探期间不再放行第二个请求
+    assert b.acquire(model).url == B
+    # 试探失败：立即重新熔断
+    probe.record(False)
+    probe.release()
+    assert not state.probing and state.open_until > 1.0
+    # 再次到期，试探成功后恢复
+    state.open_until = 1.0
+    probe = b.acquire(model)
+    assert probe.url == A
+    probe.record(True, 0.1)
+    probe.release()
+    assert state.open_until == 0 and state.failures == 0
+    assert b.acquire(model).url == A
+
+
+def test_cancelled_probe_lets_the_next_request_probe(lb):
+    b = lb(failure_threshold=1)
+    model = _model()
+    lease = b.acquire(model)
+    lease.record(False)
+    lease.release()
+    b._state(A).open_until = 1.0
+    probe = b.acquire(model)
+    probe.release()
+    assert not b._state(A).probing
+
+
+def test_least_outstanding_respects_weights(lb):
+    b = lb(strategy="least_outstanding")
+    model = _model(B, weights={B: 3})
+    leases = [b.acquire(model) for _ in range(8)]
+    # (在途 + 1) / 权重：B 的份额是 A 的三倍
+    assert sum(lease.url == B for lease in leases) == 6
+    for lease in leases:
+        lease.release()
+    assert b.outstanding(model) == 0
+
+
+def test_ewma_prefers_the_faster_endpoint(lb):
+    b = lb(strategy="ewma", ewma_alpha=0.5)
+    model = _model(B)
+    b._state(A).ewma = 0.5
+    b._state(B).ewma = 0.1
+    leases = [b.acquire(model) for _ in range(6)]
+    assert sum(lease.url == B for lease in leases) == 5
+    # 样本按 alpha 平滑
+    assert leases[0].url == B
+    leases[0].record(True, 0.3)
+    assert b._state(B).ewma == pytest.approx(0.2)
+
+
+def test_ewma_seeds_new_endpoints_with_the_pool_mean(lb):
+    b = lb(strategy="ewma")
+    model = _model(B, C)
+    b._state(A).ewma = 0.1
+    b._state(B).ewma = 0.5
+    # C 没有样本：按平均值 0.3 评分，不会因为 0 分接下所有请求
+    leases = [b.acquire(model) for _ in range(9)]
+    counts = {url: sum(lease.url == url for lease in leases) for url in (A, B, C)}
+    assert counts[A] > counts[C] > counts[B]
+    assert counts[C] < 9
@@ -0,0 +1,166 @@
+"""
+流式生成的扇出缓冲：背压（暂停、放弃最慢的客户端）、丢弃已写出的分段，以及生成中途加入的相同请求。
+"""
+import asyncio
+
+import pytest
+
+from app.config import get_settings
+from app.models.model import Model
+from app.services import broadcast, chat
+from app.services.broadcast import StreamBroadcast
+
+PAYLOAD = {"model": "chat", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+
+
+def _model() -> Model:
+    return Model(model_id="m", name="m", endpoint="http://upstream.test/v1", api_key="k", type="chat")
+
+
+def _filled(*chunks: bytes, **kwargs) -> StreamBroadcast:
+    bc = StreamBroadcast(**kwargs)
+    for chunk in chunks:
+        bc.append(chunk)
+    return bc
+
+
+def test_wait_drained_pauses_until_the_slowest_client_catches_up():
+    async def run():
+        bc = _filled(b"x" * 10)
+        fast, slow = bc.attach(10), bc.attach(0)
+        assert bc.over_budget(max_lag=5, max_total_lag=100)
+        # 没有进展：到时返回 False
+        assert not await bc.wait_drained(5, 100, timeout=0.05)
+
+        async def catch_up():
+            await asyncio.sleep(0.01)
+            bc.advance(slow, 8)
+
+        task = asyncio.ensure_future(catch_up())
+        assert await bc.wait_drained(5, 100, timeout=1)
+        await task
+        assert bc.lag == 2
+        bc.detach(fast)
+        bc.detach(slow)
+
+    asyncio.run(run())
+
+
+def test_total_lag_budget_pauses_streams_with_backlog():
+    async def run():
+        a, b = _filled(b"x" * 30), _filled(b"y" * 30)
+        ca, cb = a.attach(0), b.attach(0)
+        assert broadcast.total_lag() == 60
+        # 单个流未超过 max_lag，但所有流之和超过 max_total_lag
+        assert a.over_budget(max_lag=50, max_total_lag=40)
+        b.advance(cb, 30)
+        assert not a.over_budget(max_lag=50, max_total_lag=40)
+        assert not b.over_budget(max_lag=50, max_total_lag=0)
+        a.detach(ca)
+        b.detach(cb)
+        assert broadcast.total_lag() == 0
+
+    asyncio.run(run())
+
+
+def test_drop_lagging_drops_the_slowest_cursor_when_none_exceeds_the_limit():
+    async def run():
+        bc = _filled(b"a" * 4, b"b" * 4)
+        for _ in range(3):
+            bc.subscribe()
+        fast, middle, slow = bc.attach(8), bc.attach(4), bc.attach(2)
+        assert bc.drop_lagging(max_lag=100) == 1
+        assert bc.is_dropped(slow)
+        assert not bc.is_dropped(middle)
+        assert bc.lag == 4
+        # 超过上限的全部放弃
+        bc.append(b"c" * 4)
+        assert bc.drop_lagging(max_lag=3) == 2
+        assert bc.is_dropped(fast) and bc.is_dropped(middle)
+        assert bc.lag == 0
+
+    asyncio.run(run())
+
+
+def test_trim_only_past_max_retained():
+    async def run():
+        bc = _filled(b"a" * 4, b"b" * 4, b"c" * 4, max_retained=6)
+        bc.subscribe()
+        cursor = bc.attach(0)
+        bc.advance(cursor, 8)
+        assert (bc.base, bc.base_offset, bc.retained) == (2, 8, 4)
+        assert bc.read_from(2) == b"c" * 4
+        assert bc.offset_of(3) == 12
+        with pytest.raises(IndexError):
+            bc.read_from(0)
+        with pytest.raises(IndexError):
+            bc.offset_of(1)
+        assert not bc.joinable
+        bc.detach(cursor)
+
+        # 没有 max_retained（未开启背压）时从不丢弃，仍可合并
+        bc = _filled(b"a" * 4, b"b" * 4)
+        bc.subscribe()
+        cursor = bc.attach(0)
+        bc.advance(cursor, 8)
+        assert bc.base == 0 and bc.read_from(0) == b"a" * 4 + b"b" * 4
+        assert bc.joinable
+        bc.detach(cursor)
+
+    asyncio.run(run())
+
+
+def test_trim_keeps_data_for_subscribers_without_cursor():
+    async def run():
+        # 异步任务的订阅、刚加入尚未开始读取的客户端都没有游标，此时保留全部
+        bc = _filled(b"a" * 4, b"b" * 4, max_retained=0)
+        bc.subscribe()
+        bc.subscribe()
+        cursor = bc.attach(0)
+        bc.advance(cursor, 8)
+        assert bc.base == 0
+        bc.unsubscribe()
+        bc.advance(cursor, 8)
+        assert bc.base == 2
+        bc.detach(cursor)
+
+        # 可续传的流同样保留
+        bc = _filled(b"a" * 4, max_retained=0)
+        bc.stream_id = "s"
+        bc.subscribe()
+        cursor = bc.attach(0)
+        bc.advance(cursor, 4)
+        assert bc.base == 0
+        bc.forget()
+        assert bc.base == 1
+        bc.detach(cursor)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("backpressure", ["off", "pause"])
+def test_identical_request_joins_mid_stream_and_replays_from_start(fake_stream, monkeypatch, backpressure):
+    monkeypatch.setattr(get_settings().coalesce, "enabled", True)
+    monkeypatch.setattr(get_settings().server, "sse_backpressure", backpressure)
+    model = _model()
+
+    async def run():
+        leader = await chat.open_stream(model, PAYLOAD)
+        first = chat._subscribe_stream(model, leader, None)
+        fake_stream.send(b"data: 1\n\n")
+        assert await first.__anext__() == b"data: 1\n\n"
+        # 第一个客户端登记已写出第一段，等待下一段
+        pending = asyncio.ensure_future(first.__anext__())
+        await asyncio.sleep(0.01)
+        assert leader.lag == 0
+        # 相同请求仍加入同一次生成并从头补发
+        follower = await chat.open_stream(model, PAYLOAD)
+        assert follower is leader
+        second = chat._subscribe_stream(model, follower, None)
+        assert await second.__anext__() == b"data: 1\n\n"
+        fake_stream.send(b"data: 2\n\n")
+        fake_stream.close()
+        return [await pending] + [chunk async for chunk in first], [chunk async for chunk in second]
+
+    assert asyncio.run(run()) == ([b"data: 2\n\n"], [b"data: 2\n\n"])
+    assert fake_stream.opened == 1
@@ -0,0 +1,133 @@
+"""
+异步对话任务：队列满时 429、长轮询、结果落盘后读回，以及有慢订阅者时流式任务的完整结果。
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api.routes import models as routes
+from app.config import ChatJobsConfig, get_settings
+from app.models.model import Model
+from app.services import chat_jobs
+from app.services.chat_jobs import ChatJobs
+
+MODEL = Model(model_id="m", name="m", endpoint="http://upstream.test/v1", api_key="k", type="chat")
+PAYLOAD = {"model": "chat", "messages": [{"role": "user", "content": "hi"}]}
+
+
+@pytest.fixture
+def completion(monkeypatch):
+    """替换 fetch_completion：每次调用等待 delay 秒后返回 (200, {"n": 第几次调用})。"""
+    calls = []
+    delay = [0.0]
+
+    async def fake(model, payload):
+        calls.append(payload)
+        await asyncio.sleep(delay[0])
+        return 200, {"n": len(calls)}
+
+    monkeypatch.setattr(chat_jobs, "fetch_completion", fake)
+    return delay
+
+
+def test_submit_over_max_queue_returns_429(monkeypatch):
+    async def get_model(model_id):
+        return MODEL
+
+    monkeypatch.setattr(routes, "aget_model_cached", get_model)
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def run():
+        # 不启动 worker：任务一直排队
+        monkeypatch.setattr(chat_jobs, "_jobs", ChatJobs(ChatJobsConfig(enabled=True, max_queue=1)))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            body = {"prompt": "hi"}
+            return [await client.post("/api/v1/models/chat/m?mode=async", json=body) for _ in range(2)]
+
+    accepted, rejected = asyncio.run(run())
+    assert accepted.status_code == 200 and accepted.json()["data"]["status"] == "queued"
+    assert rejected.status_code == 429
+    assert rejected.headers["retry-after"] == "1"
+
+
+def test_long_poll_waits_for_the_result(completion):
+    completion[0] = 0.05
+
+    async def run():
+        jobs = ChatJobs(ChatJobsConfig(enabled=True, workers=1, max_wait_seconds=5))
+        jobs.start()
+        try:
+            job = jobs.submit(MODEL, PAYLOAD, stream=False)
+            first = await jobs.get(job.job_id)
+            polled = await jobs.get(job.job_id, wait=5)
+        finally:
+            await jobs.stop()
+        return first, polled
+
+    first, polled = asyncio.run(run())
+    assert first["status"] in ("queued", "running") and first["result"] is None
+    assert polled["status"] == "done"
+    assert polled["result"] == {"status_code": 200, "content": {"n": 1}}
+
+
+def test_results_over_max_memory_spill_to_disk_and_read_back(completion, tmp_path):
+    async def run():
+        cfg = ChatJobsConfig(enabled=True, workers=1, max_memory_bytes=10, spill_dir=str(tmp_path))
+        jobs = ChatJobs(cfg)
+        jobs.start()
+        try:
+            first = jobs.submit(MODEL, PAYLOAD, stream=False)
+            second = jobs.submit(MODEL, PAYLOAD, stream=False)
+            await jobs.get(second.job_id, wait=5)
+            await asyncio.gather(*jobs._pending_writes)
+            assert first.job_id not in jobs._jobs
+            return await jobs.get(first.job_id), await jobs.get(second.job_id), jobs._bytes
+        finally:
+            await jobs.stop()
+
+    spilled, kept, held = asyncio.run(run())
+    assert spilled["status"] == "done"
+    assert spilled["result"] == {"status_code": 200, "content": {"n": 1}}
+    assert kept["result"]["content"] == {"n": 2}
+    # 只计入仍在内存中的结果
+    assert held == len(b'{"n":2}')
+    assert list(tmp_path.glob("*/*.json"))
+
+
+def test_stream_job_keeps_full_result_with_a_slow_subscriber(fake_stream, monkeypatch):
+    server_cfg = get_settings().server
+    monkeypatch.setattr(server_cfg, "sse_backpressure", "pause")
+    monkeypatch.setattr(server_cfg, "sse_client_max_lag_bytes", 8)
+    monkeypatch.setattr(server_cfg, "sse_disconnect_poll_seconds", 0)
+    chunks = [f"data: {i}\n\n".encode() for i in range(5)]
+
+    async def run():
+        jobs = ChatJobs(ChatJobsConfig(enabled=True, workers=1))
+        jobs.start()
+        try:
+            job = jobs.submit(MODEL, {**PAYLOAD, "stream": True}, stream=True)
+            resp = await jobs.stream(job.job_id, wait=5)
+            fake_stream.send(*chunks)
+            fake_stream.close()
+            received = []
+            async for chunk in resp.body_iterator:
+                received.append(chunk)
+                # 慢订阅者：任务结束后仍在推进，推进时会丢弃已写出的分段
+                await asyncio.sleep(0.02)
+            info = await jobs.get(job.job_id, wait=5)
+            late = await jobs.stream(job.job_id)
+            return b"".join(received), info, late.body, job.size
+        finally:
+            await jobs.stop()
+
+    received, info, late, size = asyncio.run(run())
+    full = b"".join(chunks)
+    assert received == full
+    assert info["status"] == "done"
+    assert info["result"] == {"status_code": 200, "content": full.decode()}
+    assert late == full
+    assert size == len(full)
@@ -0,0 +1,102 @@
+"""
+相同请求合并：跟随者拿到与发起者相同的结果或错误，发起者断开不影响跟随者。
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.config import get_settings
+from app.models.model import Model
+from app.services import chat
+from app.services.broadcast import StreamBroadcast
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setattr(get_settings().coalesce, "enabled", True)
+    monkeypatch.setattr(chat, "_inflight_calls", {})
+    monkeypatch.setattr(chat, "_inflight_streams", {})
+    return Model(model_id="m", name="m", endpoint="http://upstream.test/v1", api_key="k", type="chat")
+
+
+PAYLOAD = {"model": "chat", "messages": [{"role": "user", "content": "hi"}]}
+
+
+def _fake_completion(monkeypatch, result):
+    calls = []
+    release = asyncio.Event()
+
+    async def fake(model, payload):
+        calls.append(payload)
+        await release.wait()
+        if isinstance(result, BaseException):
+            raise result
+        return 200, result, 10
+
+    monkeypatch.setattr(chat, "_request_completion", fake)
+    return calls, release
+
+
+def test_followers_see_the_leaders_error(model, monkeypatch):
+    async def run():
+        calls, release = _fake_completion(monkeypatch, HTTPException(status_code=502, detail="upstream down"))
+        callers = [asyncio.ensure_future(chat.fetch_completion(model, PAYLOAD)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        return calls, results
+
+    calls, results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(r, HTTPException) and r.detail == "upstream down" for r in results)
+    assert chat._inflight_calls == {}
+
+
+def test_leader_disconnect_does_not_cancel_followers(model, monkeypatch):
+    async def run():
+        calls, release = _fake_completion(monkeypatch, {"answer": 42})
+        leader = asyncio.ensure_future(chat.fetch_completion(model, PAYLOAD))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(chat.fetch_completion(model, PAYLOAD))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        return calls, await follower, await asyncio.gather(leader, return_exceptions=True)
+
+    calls, result, (leader_result,) = asyncio.run(run())
+    assert len(calls) == 1
+    assert result == (200, {"answer": 42})
+    assert isinstance(leader_result, asyncio.CancelledError)
+
+
+def test_stream_followers_see_the_leaders_error(model, monkeypatch):
+    produced = []
+
+    async def fake_produce(model, payload, bc: StreamBroadcast):
+        produced.append(bc)
+        await asyncio.sleep(0.01)
+        bc.append(b"data: {}\n\n")
+        await asyncio.sleep(0.01)
+        bc.finish(RuntimeError("upstream reset"))
+
+    monkeypatch.setattr(chat, "_produce_stream", fake_produce)
+
+    async def consume(bc):
+        out = []
+        try:
+            async for chunk in chat._subscribe_stream(model, bc, None):
+                out.append(chunk)
+        except RuntimeError as e:
+            return out, str(e)
+        return out, None
+
+    async def run():
+        leader = await chat.open_stream(model, PAYLOAD)
+        follower = await chat.open_stream(model, PAYLOAD)
+        assert follower is leader
+        return await asyncio.gather(consume(leader), consume(follower))
+
+    results = asyncio.run(run())
+    assert len(produced) == 1
+    assert results == [([b"data: {}\n\n"], "upstream reset")] * 2
@@ -0,0 +1,108 @@
+"""
+向量化：微批中单条文本出错不连累同批请求、上游 4xx / 429 透传、多批调用的并发上限。
+"""
+import asyncio
+import json
+from typing import List
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.config import get_settings
+from app.models.model import Model
+from app.services import embedding
+
+
+class _Lease:
+    url = "http://upstream.test/v1/embeddings"
+
+    def record(self, ok, latency=None):
+        pass
+
+    def release(self):
+        pass
+
+
+class _Upstream:
+    """按输入返回结果的假上游：含 "bad" 的批次返回 400，status 不为 200 时整批返回该状态码。"""
+
+    def __init__(self, status: int = 200, headers=None, delay: float = 0):
+        self.status = status
+        self.headers = headers or {}
+        self.delay = delay
+        self.calls: List[List[str]] = []
+        self.active = 0
+        self.max_active = 0
+
+    async def __call__(self, model, payload, headers, timeout, exclude=(), used=None):
+        texts = payload["input"]
+        self.calls.append(texts)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        if self.status != 200:
+            return httpx.Response(self.status, headers=self.headers, content=b"upstream error"), _Lease()
+        if "bad" in texts:
+            return httpx.Response(400, content=b"invalid input"), _Lease()
+        body = {
+            "data": [{"index": i, "embedding": [float(len(t)), 0.0]} for i, t in enumerate(texts)],
+            "usage": {"prompt_tokens": len(texts)},
+        }
+        return httpx.Response(200, content=json.dumps(body).encode()), _Lease()
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setattr(embedding, "_batchers", {})
+    return Model(model_id="emb", name="emb", endpoint=_Lease.url, api_key="k", type="text-embedding")
+
+
+def test_bad_text_does_not_fail_its_batch(model, monkeypatch):
+    upstream = _Upstream()
+    monkeypatch.setattr(embedding, "open_upstream", upstream)
+
+    async def run():
+        texts = ["a", "bb", "bad", "dddd", "eeeee"]
+        return await asyncio.gather(*[embedding.embed_one(model, t) for t in texts], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert isinstance(results[2], HTTPException) and results[2].status_code == 400
+    assert [r[0][0] for i, r in enumerate(results) if i != 2] == [1.0, 2.0, 4.0, 5.0]
+    assert upstream.calls[0] == ["a", "bb", "bad", "dddd", "eeeee"]
+    # 二分重试：只有包含 bad 的那一半继续拆分
+    assert ["bad"] in upstream.calls and len(upstream.calls) < 10
+
+
+@pytest.mark.parametrize("status", [401, 404, 429])
+def test_upstream_4xx_is_passed_through(model, monkeypatch, status):
+    monkeypatch.setattr(embedding, "open_upstream", _Upstream(status, {"Retry-After": "7"}))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(embedding.embed_texts(model, ["a"]))
+    assert exc.value.status_code == status
+    assert exc.value.headers == {"Retry-After": "7"}
+
+
+def test_upstream_5xx_is_502(model, monkeypatch):
+    upstream = _Upstream(503)
+    monkeypatch.setattr(embedding, "open_upstream", upstream)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(embedding.embed(model, ["a", "b"]))
+    assert exc.value.status_code == 502
+    assert len(upstream.calls) == 1
+
+
+def test_multi_input_batches_are_bounded(model, monkeypatch):
+    cfg = get_settings().embedding
+    monkeypatch.setattr(cfg, "max_batch_size", 2)
+    monkeypatch.setattr(cfg, "max_concurrent_batches", 3)
+    upstream = _Upstream(delay=0.02)
+    monkeypatch.setattr(embedding, "open_upstream", upstream)
+
+    body = asyncio.run(embedding.embed(model, ["x" * (i + 1) for i in range(20)]))
+    assert [d["embedding"][0] for d in body["data"]] == [float(i + 1) for i in range(20)]
+    assert len(upstream.calls) == 10
+    assert upstream.max_active == 3
@@ -0,0 +1,71 @@
+"""
+请求对冲：对冲胜出时按主请求已等待的时长记样本，对冲到其它模型时用该模型自己的超时。
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.config import HedgeConfig
+from app.models.model import Model
+from app.services import hedge
+from app.services.upstream import upstream_timeout
+
+
+def _model(model_id: str, timeout: int) -> Model:
+    return Model(model_id=model_id, name=model_id, endpoint="http://upstream.test/v1", api_key="k",
+                 type="chat", timeout=timeout)
+
+
+@pytest.fixture
+def hedger(monkeypatch):
+    h = hedge.Hedger(HedgeConfig(enabled=True, min_samples=1, budget_percent=100, min_delay_ms=10))
+    monkeypatch.setattr(hedge, "_hedger", h)
+    return h
+
+
+def _fake_attempts(monkeypatch, delays):
+    seen = []
+
+    async def fake(model, payload, headers, timeout, first_chunk, exclude=(), used=None):
+        seen.append((model.model_id, timeout))
+        delay = delays[model.model_id]
+        await asyncio.sleep(delay)
+        resp = httpx.Response(200, request=httpx.Request("POST", model.endpoint))
+        return (resp, _Lease(), None), delay
+
+    monkeypatch.setattr(hedge, "_attempt", fake)
+    return seen
+
+
+class _Lease:
+    def release(self):
+        pass
+
+    def record(self, ok):
+        pass
+
+
+def test_alternate_model_uses_its_own_timeout_and_primary_latency_is_observed(hedger, monkeypatch):
+    primary, other = _model("slow", 120), _model("fast", 15)
+    state = hedger.state(primary.model_id)
+    state.delay = 0.02
+    state.tokens = 1
+    monkeypatch.setattr(hedger, "alternate", lambda model, used: (other, ()))
+    seen = _fake_attempts(monkeypatch, {"slow": 0.5, "fast": 0.01})
+
+    timeout = upstream_timeout(primary.timeout, read=False)
+    asyncio.run(hedge.open_hedged(primary, {}, {"Authorization": "Bearer k"}, timeout, first_chunk=True))
+
+    assert seen[0] == ("slow", timeout)
+    assert seen[1][0] == "fast"
+    assert seen[1][1] == upstream_timeout(15, read=False)
+    # 样本是主请求至少等待的时长（delay + 对冲耗时），而不是对冲请求自身的 0.01 秒
+    assert state.samples[-1] >= 0.03
+
+
+def test_primary_winner_records_its_own_latency(hedger, monkeypatch):
+    model = _model("m", 30)
+    _fake_attempts(monkeypatch, {"m": 0.01})
+    asyncio.run(hedge.open_hedged(model, {}, {}, 30, first_chunk=False))
+    assert list(hedger.state("m").samples) == [0.01]
@@ -0,0 +1,87 @@
+"""
+images_proc 消息中 path / url 的访问范围。
+"""
+import asyncio
+import os
+
+import httpx
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from app.config import ImagesProcConfig, NatsConfig
+from app.services.images_worker import ImagesProcWorker, _url_allowed
+from app.services.jetstream_worker import PermanentError
+
+
+def _worker(cfg: ImagesProcConfig) -> ImagesProcWorker:
+    nats_cfg = NatsConfig(
+        endpoint="nats://127.0.0.1:4222",
+        subject="test.>",
+        streamName="TEST",
+        articleSubject="test.article",
+        articleConsumerName="article",
+        imagesProcSubject="test.images",
+        imagesProcConsumerName="images",
+        clientId="c1",
+        defaultAccountName="",
+    )
+    return ImagesProcWorker(nats_cfg, cfg)
+
+
+def test_path_must_stay_in_input_dir(tmp_path):
+    root = tmp_path / "in"
+    (root / "sub").mkdir(parents=True)
+    (root / "sub" / "a.png").write_bytes(b"x")
+    (tmp_path / "secret").write_bytes(b"x")
+    os.symlink(tmp_path / "secret", root / "link")
+    worker = _worker(ImagesProcConfig(input_dir=str(root)))
+
+    assert worker._local_path("sub/a.png") == str((root / "sub" / "a.png").resolve())
+    assert worker._local_path(str(root / "sub" / "a.png")) == str((root / "sub" / "a.png").resolve())
+    for path in ("../secret", str(tmp_path / "secret"), "link", "sub/../../secret"):
+        with pytest.raises(PermanentError):
+            worker._local_path(path)
+
+
+def test_path_rejected_without_input_dir():
+    with pytest.raises(PermanentError):
+        _worker(ImagesProcConfig())._local_path("/tmp/a.png")
+
+
+def test_url_allowlist():
+    cfg = ImagesProcConfig(url_schemes=["https"], url_hosts=["img.example.com", "*.cdn.example.com"])
+    assert _url_allowed(httpx.URL("https://img.example.com/a.png"), cfg)
+    assert _url_allowed(httpx.URL("https://a.cdn.example.com/a.png"), cfg)
+    assert not _url_allowed(httpx.URL("http://img.example.com/a.png"), cfg)
+    assert not _url_allowed(httpx.URL("https://cdn.example.com/a.png"), cfg)
+    assert not _url_allowed(httpx.URL("https://evil-img.example.com/a.png"), cfg)
+    assert not _url_allowed(httpx.URL("https://169.254.169.254/latest"), cfg)
+    assert not _url_allowed(httpx.URL("https://img.example.com/a.png"), ImagesProcConfig())
+
+
+def test_redirect_outside_allowlist_is_refused():
+    worker = _worker(ImagesProcConfig(url_hosts=["img.example.com"]))
+    fetched = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetched.append(str(request.url))
+        if request.url.host == "img.example.com":
+            return httpx.Response(302, headers={"location": "http://169.254.169.254/latest"})
+        return httpx.Response(200, content=b"secret")
+
+    async def run():
+        worker._http = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler),
+            follow_redirects=True,
+            event_hooks={"request": [worker._check_request]},
+        )
+        try:
+            with pytest.raises(PermanentError):
+                await worker._download("https://img.example.com/a.png")
+        finally:
+            await worker._http.aclose()
+
+    asyncio.run(run())
+    assert fetched == ["https://img.example.com/a.png"]
@@ -0,0 +1,124 @@
+"""
+PullConsumerWorker 对 handle 结果 / 异常的确认处理，连本地 nats-server（-js）运行；未安装 nats-server 时跳过。
+"""
+import asyncio
+import shutil
+import socket
+import subprocess
+import time
+from typing import Dict, List
+
+import pytest
+
+from app.config import NatsConfig, PullWorkerConfig
+from app.services.jetstream_worker import ACK, JETSTREAM_MESSAGES, PermanentError, PullConsumerWorker
+
+pytestmark = pytest.mark.skipif(shutil.which("nats-server") is None, reason="需要本地 nats-server")
+
+
+@pytest.fixture
+def nats_url(tmp_path):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen(
+        ["nats-server", "-js", "-a", "127.0.0.1", "-p", str(port), "-sd", str(tmp_path)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                proc.kill()
+                pytest.fail("nats-server 未能启动")
+            time.sleep(0.05)
+    yield f"nats://127.0.0.1:{port}"
+    proc.terminate()
+    proc.wait(10)
+
+
+class _Worker(PullConsumerWorker):
+    def __init__(self, nats_cfg: NatsConfig, cfg: PullWorkerConfig):
+        super().__init__(nats_cfg, cfg, nats_cfg.articleSubject, nats_cfg.articleConsumerName)
+        self.deliveries: Dict[bytes, List[int]] = {}
+
+    async def handle(self, msg):
+        self.deliveries.setdefault(msg.data, []).append(msg.metadata.num_delivered)
+        if msg.data == b"boom":
+            raise RuntimeError("boom")
+        if msg.data == b"bad":
+            raise PermanentError("bad")
+        return ACK, None
+
+
+def _nats_cfg(url: str, consumer: str) -> NatsConfig:
+    return NatsConfig(
+        endpoint=url,
+        subject="test.>",
+        streamName="TEST",
+        articleSubject="test.{clientId}.article",
+        articleConsumerName=consumer,
+        imagesProcSubject="test.{clientId}.images",
+        imagesProcConsumerName=f"{consumer}_images",
+        clientId="c1",
+        defaultAccountName="",
+    )
+
+
+async def _wait_for(predicate, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        await asyncio.sleep(0.05)
+
+
+def test_handle_is_abstract():
+    with pytest.raises(TypeError):
+        PullConsumerWorker(_nats_cfg("nats://127.0.0.1:4222", "x"), PullWorkerConfig(), "s", "x")
+
+
+def test_unexpected_error_is_nacked_then_termed(nats_url):
+    consumer = "test_errors"
+    nats_cfg = _nats_cfg(nats_url, consumer)
+    cfg = PullWorkerConfig(
+        max_deliver=3,
+        backoff_seconds=[0.1],
+        ack_flush_ms=10,
+        fetch_timeout_seconds=0.2,
+        ack_wait_seconds=30,
+    )
+
+    async def run():
+        import nats
+
+        nc = await nats.connect(nats_url)
+        js = nc.jetstream()
+        await js.add_stream(name="TEST", subjects=["test.>"])
+        worker = _Worker(nats_cfg, cfg)
+        await worker.start()
+        try:
+            for data in (b"ok", b"boom", b"bad"):
+                await js.publish(worker.subject, data)
+            await _wait_for(lambda: len(worker.deliveries.get(b"boom", [])) >= cfg.max_deliver)
+            await _wait_for(lambda: JETSTREAM_MESSAGES.get(consumer, "term") >= 2)
+            # term 之后不再重投
+            await asyncio.sleep(0.5)
+            info = await js.consumer_info("TEST", consumer)
+        finally:
+            await worker.stop(timeout=5)
+            await nc.close()
+        return worker, info
+
+    worker, info = asyncio.run(run())
+    assert worker.deliveries[b"ok"] == [1]
+    assert worker.deliveries[b"bad"] == [1]
+    assert worker.deliveries[b"boom"] == [1, 2, 3]
+    assert JETSTREAM_MESSAGES.get(consumer, "ack") == 1
+    assert JETSTREAM_MESSAGES.get(consumer, "nak") == 2
+    assert JETSTREAM_MESSAGES.get(consumer, "term") == 2
+    assert info.num_ack_pending == 0
+    assert info.num_pending == 0
@@ -0,0 +1,102 @@
+"""
+按模型的并发名额：排队按到达顺序、队列上限、排队超时和等待者被取消（客户端断开）时的名额归还。
+"""
+import asyncio
+
+import pytest
+
+from app.models.model import Model
+from app.services.limiter import ConcurrencyLimiter, ModelOverloaded
+
+
+def _model(**kwargs) -> Model:
+    return Model(model_id="m", name="m", endpoint="http://upstream.test/v1", api_key="k", **kwargs)
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    model = _model(max_concurrency=1, max_queue=3, queue_timeout=0)
+    limiter = ConcurrencyLimiter()
+    admitted = []
+
+    async def waiter(name):
+        slot = await limiter.acquire(model)
+        admitted.append(name)
+        await asyncio.sleep(0)
+        slot.release()
+
+    async def run():
+        first = await limiter.acquire(model)
+        tasks = []
+        for name in "abc":
+            tasks.append(asyncio.ensure_future(waiter(name)))
+            await asyncio.sleep(0)
+        # 队列已满：第四个直接拒绝
+        with pytest.raises(ModelOverloaded) as exc:
+            await limiter.acquire(model)
+        assert exc.value.reason == "queue_full"
+        first.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert admitted == ["a", "b", "c"]
+    assert limiter.stats()["m"] == {"limit": 1, "in_use": 0, "queued": 0}
+
+
+def test_queue_timeout_leaves_the_queue():
+    model = _model(max_concurrency=1, max_queue=1, queue_timeout=1)
+    limiter = ConcurrencyLimiter()
+
+    async def run():
+        held = await limiter.acquire(model)
+        with pytest.raises(ModelOverloaded) as exc:
+            await limiter.acquire(model)
+        assert exc.value.reason == "timeout"
+        assert limiter.stats()["m"]["queued"] == 0
+        # 超时的等待者不会再占用名额：释放后下一个请求立即拿到
+        held.release()
+        slot = await asyncio.wait_for(limiter.acquire(model), 0.1)
+        slot.release()
+
+    asyncio.run(run())
+    assert limiter.stats()["m"] == {"limit": 1, "in_use": 0, "queued": 0}
+
+
+def test_cancelled_waiter_gives_back_its_place_and_slot():
+    model = _model(max_concurrency=1, max_queue=2, queue_timeout=0)
+    limiter = ConcurrencyLimiter()
+
+    async def run():
+        held = await limiter.acquire(model)
+        # 排队中断开：从队列移除
+        queued = asyncio.ensure_future(limiter.acquire(model))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert limiter.stats()["m"]["queued"] == 0
+
+        # 名额刚交给等待者、它还没运行就断开：名额要还回来
+        granted = asyncio.ensure_future(limiter.acquire(model))
+        await asyncio.sleep(0)
+        held.release()
+        assert limiter.stats()["m"]["in_use"] == 1
+        granted.cancel()
+        await asyncio.gather(granted, return_exceptions=True)
+        assert limiter.stats()["m"] == {"limit": 1, "in_use": 0, "queued": 0}
+
+        slot = await asyncio.wait_for(limiter.acquire(model), 0.1)
+        slot.release()
+
+    asyncio.run(run())
+
+
+def test_slot_release_is_idempotent():
+    model = _model(max_concurrency=1)
+    limiter = ConcurrencyLimiter()
+
+    async def run():
+        slot = await limiter.acquire(model)
+        slot.release()
+        slot.release()
+
+    asyncio.run(run())
+    assert limiter.stats()["m"]["in_use"] == 0
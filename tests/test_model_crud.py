@@ -0,0 +1,58 @@
+"""
+同步的模型增删改：额外上游地址一起落库，并即时更新进程内的模型注册表。
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import db
+from app.models.model import (
+    ModelCreateRequest,
+    ModelEndpoint,
+    create_model_entry,
+    delete_model_entry,
+    get_model_by_id,
+    list_models,
+    save_model,
+)
+from app.models.registry import model_registry
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    db.Base.metadata.create_all(engine)
+    monkeypatch.setattr(db, "_SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+    yield
+    engine.dispose()
+
+
+def test_sync_crud_keeps_endpoints_and_registry(session_factory):
+    created = create_model_entry(ModelCreateRequest(
+        name="m",
+        endpoint="http://a/v1",
+        api_key="k",
+        endpoints=[ModelEndpoint(endpoint="http://b/v1", weight=2)],
+    ))
+    try:
+        assert model_registry.lookup(created.model_id) == (True, created)
+        loaded = get_model_by_id(created.model_id)
+        assert [e.endpoint for e in loaded.endpoints] == ["http://b/v1"]
+        assert [m.endpoints for m in list_models()] == [loaded.endpoints]
+
+        # 读出、修改、写回不丢失额外上游地址
+        save_model(loaded.model_copy(update={"name": "m2"}))
+        assert model_registry.lookup(created.model_id)[1].name == "m2"
+        assert [e.endpoint for e in get_model_by_id(created.model_id).endpoints] == ["http://b/v1"]
+
+        save_model(loaded.model_copy(update={"endpoints": [{"endpoint": "http://c/v1"}]}))
+        assert [e.endpoint for e in get_model_by_id(created.model_id).endpoints] == ["http://c/v1"]
+        assert [e.endpoint for e in model_registry.lookup(created.model_id)[1].endpoints] == ["http://c/v1"]
+
+        deleted = delete_model_entry(created.model_id)
+        assert [e.endpoint for e in deleted.endpoints] == ["http://c/v1"]
+        assert model_registry.lookup(created.model_id) == (False, None)
+        assert get_model_by_id(created.model_id) is None
+    finally:
+        model_registry.remove(created.model_id)
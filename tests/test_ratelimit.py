@@ -0,0 +1,124 @@
+"""
+令牌桶：进程内与 Redis（Lua 脚本）两种存放的语义一致；调用方按认证身份或客户端 IP 区分。
+Redis 用例需要安装 redis 包并设置 REDIS_URL，否则跳过。
+"""
+import asyncio
+import os
+import time
+from uuid import uuid4
+
+import pytest
+from starlette.authentication import SimpleUser
+from starlette.requests import Request
+
+from app.config import RateLimitConfig, RateLimitRule
+from app.services.ratelimit import LocalBucketStore, RateLimited, RateLimiter, RedisBucketStore
+
+
+def _redis_store():
+    url = os.getenv("REDIS_URL")
+    if not url:
+        pytest.skip("未设置 REDIS_URL")
+    pytest.importorskip("redis")
+    return RedisBucketStore(url, prefix=f"test:rl:{uuid4().hex}:")
+
+
+@pytest.fixture(params=["local", "redis"])
+def store(request):
+    return LocalBucketStore() if request.param == "local" else _redis_store()
+
+
+def _run(store, coro):
+    async def run():
+        try:
+            return await coro
+        finally:
+            await store.aclose()
+
+    return asyncio.run(run())
+
+
+def test_take_until_empty_then_refill(store):
+    async def run():
+        # 每秒补充 20 个，容量 2
+        req = [("a", 20.0, 2.0, 1.0)]
+        assert await store.take(req) == (0.0, -1)
+        assert await store.take(req) == (0.0, -1)
+        wait, blocked = await store.take(req)
+        assert blocked == 0 and 0 < wait <= 0.05 + 0.01
+        await asyncio.sleep(0.06)
+        assert await store.take(req) == (0.0, -1)
+
+    _run(store, run())
+
+
+def test_all_or_nothing(store):
+    async def run():
+        roomy = ("roomy", 1.0, 10.0, 1.0)
+        tight = ("tight", 0.1, 1.0, 1.0)
+        assert await store.take([roomy, tight]) == (0.0, -1)
+        # tight 已空：整体拒绝，roomy 不扣减；返回等待最久的桶
+        for _ in range(20):
+            wait, blocked = await store.take([roomy, tight])
+            assert blocked == 1 and wait > 9
+        for _ in range(9):
+            assert await store.take([roomy]) == (0.0, -1)
+        wait, blocked = await store.take([roomy])
+        assert blocked == 0
+
+    _run(store, run())
+
+
+def test_local_store_drops_idle_buckets(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    store = LocalBucketStore(max_keys=2)
+
+    async def run():
+        await store.take([("a", 1.0, 60.0, 1.0)])
+        await store.take([("b", 1.0, 60.0, 1.0)])
+        now[0] += 61
+        await store.take([("c", 1.0, 60.0, 1.0)])
+
+    asyncio.run(run())
+    assert set(store._buckets) == {"c"}
+
+
+def _request(headers=None, client="10.0.0.1", user=None) -> Request:
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": (client, 1234),
+    }
+    if user is not None:
+        scope["user"] = user
+    return Request(scope)
+
+
+def test_caller_is_principal_or_client_ip():
+    limiter = RateLimiter(RateLimitConfig(api_keys={"sk-known": "team-a"}), LocalBucketStore())
+    assert limiter.caller_of(_request({"X-API-Key": "sk-known"})) == "team-a"
+    assert limiter.caller_of(_request({"Authorization": "Bearer sk-known"})) == "team-a"
+    # 未登记的 Key 不单独建桶，换 Key 也落在同一个 IP 桶里
+    assert limiter.caller_of(_request({"X-API-Key": "sk-random-1"})) == "ip:10.0.0.1"
+    assert limiter.caller_of(_request({"X-API-Key": "sk-random-2"})) == "ip:10.0.0.1"
+    assert limiter.caller_of(_request()) == "ip:10.0.0.1"
+    assert limiter.caller_of(_request({"X-API-Key": "sk-known"}, user=SimpleUser("alice"))) == "user:alice"
+
+
+def test_unknown_keys_share_the_ip_bucket():
+    cfg = RateLimitConfig(enabled=True, caller=RateLimitRule(requests_per_minute=2))
+    limiter = RateLimiter(cfg, LocalBucketStore())
+
+    async def run():
+        for key in ("k1", "k2"):
+            await limiter.check("m", limiter.caller_of(_request({"X-API-Key": key})), 1)
+        with pytest.raises(RateLimited) as exc:
+            await limiter.check("m", limiter.caller_of(_request({"X-API-Key": "k3"})), 1)
+        assert exc.value.bucket == "caller_requests"
+        # 其它 IP 不受影响
+        await limiter.check("m", limiter.caller_of(_request({"X-API-Key": "k3"}, client="10.0.0.2")), 1)
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+"""
+响应缓存磁盘层的过期清理和总大小上限。
+"""
+import asyncio
+import time
+
+from app.config import ResponseCacheConfig
+from app.services.response_cache import ResponseCache
+
+
+def _key(i: int) -> str:
+    return f"{i:02d}" * 32
+
+
+def test_disk_sweep_removes_expired_and_enforces_cap(tmp_path):
+    cfg = ResponseCacheConfig(enabled=True, disk_dir=str(tmp_path), disk_max_bytes=3000, disk_sweep_seconds=0.2)
+
+    async def run():
+        cache = ResponseCache(cfg)
+        cache.start()
+        try:
+            # 每个文件约 530 字节，过期时间依次推后
+            for i in range(10):
+                cache.put(_key(i), {"x": "y" * 500}, 510, ttl=100 + i)
+            cache.put(_key(99), {"x": "short"}, 10, ttl=0.1)
+            await asyncio.sleep(0.8)
+            # 只看磁盘层
+            cache._entries.clear()
+            cache._bytes = 0
+            return cache, await cache.get("m", _key(9)), await cache.get("m", _key(0)), await cache.get("m", _key(99))
+        finally:
+            await cache.stop()
+
+    cache, newest, oldest, expired = asyncio.run(run())
+    names = sorted(p.name[:4] for p in tmp_path.glob("*/*"))
+    assert names == ["0505", "0606", "0707", "0808", "0909"]
+    assert newest == {"x": "y" * 500}
+    assert oldest is None and expired is None
+    assert cache._disk_bytes <= cfg.disk_max_bytes
+
+
+def test_disk_sweep_removes_stale_tmp_files(tmp_path):
+    cfg = ResponseCacheConfig(enabled=True, disk_dir=str(tmp_path), disk_sweep_seconds=60)
+    cache = ResponseCache(cfg)
+    (tmp_path / "ab").mkdir()
+    stale = tmp_path / "ab" / "x.123.tmp"
+    stale.write_bytes(b"{")
+    assert cache._disk_sweep(time.time()) == 0
+    assert stale.exists()
+    assert cache._disk_sweep(time.time() + 120) == 0
+    assert not stale.exists()
@@ -0,0 +1,69 @@
+"""
+语义缓存的进程内索引：相似度阈值、上下文指纹、TTL 过期和 max_entries 淘汰；Milvus 过滤表达式的转义。
+"""
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.services import semantic_cache
+from app.services.semantic_cache import NumpyIndex, _milvus_str
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def _vec(*values: float):
+    v = np.asarray(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_threshold_and_scope(clock):
+    index = NumpyIndex("m", max_entries=10)
+    index.add(_vec(1, 0), scope=1, content="a", ttl=60)
+    index.add(_vec(0, 1), scope=1, content="b", ttl=60)
+    assert index.search(_vec(1, 0.1), scope=1, threshold=0.95) == "a"
+    # 余弦相似度 0.8，低于阈值
+    assert index.search(_vec(0.6, 0.8), scope=1, threshold=0.9) is None
+    assert index.search(_vec(0.6, 0.8), scope=1, threshold=0.75) == "b"
+    # 上下文指纹不同的条目互不命中
+    assert index.search(_vec(1, 0), scope=2, threshold=0.5) is None
+    # 维度不一致时视为未命中
+    assert index.search(_vec(1, 0, 0), scope=1, threshold=0.5) is None
+
+
+def test_expired_entries_miss_and_are_evicted_first(clock):
+    index = NumpyIndex("m", max_entries=2)
+    index.add(_vec(1, 0), scope=1, content="old", ttl=10)
+    index.add(_vec(0, 1), scope=1, content="fresh", ttl=100)
+    clock[0] += 10
+    assert index.search(_vec(1, 0), scope=1, threshold=0.9) is None
+    # 已满：先清理过期条目，未过期的保留
+    index.add(_vec(1, 1), scope=1, content="new", ttl=100)
+    assert index.size == 2
+    assert index.search(_vec(0, 1), scope=1, threshold=0.9) == "fresh"
+    assert index.search(_vec(1, 1), scope=1, threshold=0.9) == "new"
+
+
+def test_max_entries_evicts_the_least_recently_hit(clock):
+    index = NumpyIndex("m", max_entries=3)
+    for content, vec in (("a", _vec(1, 0, 0)), ("b", _vec(0, 1, 0)), ("c", _vec(0, 0, 1))):
+        index.add(vec, scope=1, content=content, ttl=100)
+        clock[0] += 1
+    assert index.search(_vec(1, 0, 0), scope=1, threshold=0.9) == "a"
+    clock[0] += 1
+    index.add(_vec(1, 1, 0), scope=1, content="d", ttl=100)
+    assert index.size == 3
+    found = {c for c in (index.search(v, 1, 0.99) for v in (_vec(1, 0, 0), _vec(0, 1, 0), _vec(0, 0, 1), _vec(1, 1, 0)))}
+    assert found == {"a", "c", "d", None}
+
+
+def test_milvus_filter_escapes_model_id():
+    assert _milvus_str("abc") == '"abc"'
+    assert _milvus_str('x" or model_id != "') == '"x\\" or model_id != \\""'
+    assert _milvus_str("a\\") == '"a\\\\"'
@@ -0,0 +1,82 @@
+"""
+上游流的分帧与转发：事件 / 行跨块切分、CRLF、被截断的 UTF-8 字符、data: 前缀跨块，以及非 SSE 的响应体。
+"""
+import asyncio
+from typing import List
+
+import pytest
+
+from app.services.sse import SSEEventFramer, SSELineFramer, relay_sse_bytes, relay_sse_text
+
+NI_HAO = "你好".encode("utf-8")
+
+
+@pytest.mark.parametrize("chunks, expected", [
+    # 按事件 flush：原样透传
+    ([b"data: a\n\n", b"data: b\n\n"], [b"data: a\n\n", b"data: b\n\n"]),
+    # 事件跨块：在边界处输出
+    ([b"data: a", b"\n\ndata: b\n", b"\n"], [b"data: a\n\n", b"data: b\n\n"]),
+    # 一块中有多个事件，末尾残留半个事件
+    ([b"data: a\n\ndata: b\n\ndata: c", b"\n\n"], [b"data: a\n\ndata: b\n\n", b"data: c\n\n"]),
+    # CRLF 边界跨块
+    ([b"data: a\r\n", b"\r\ndata: b\r\n\r\n"], [b"data: a\r\n\r\ndata: b\r\n\r\n"]),
+    ([b"data: a\r\n\r", b"\ndata: b\r\n\r\n"], [b"data: a\r\n\r\ndata: b\r\n\r\n"]),
+    # 多字节字符跨块：按字节转发，不解码
+    ([b"data: " + NI_HAO[:2], NI_HAO[2:] + b"\n\n"], [b"data: " + NI_HAO + b"\n\n"]),
+])
+def test_event_framer(chunks: List[bytes], expected: List[bytes]):
+    framer = SSEEventFramer()
+    out = [o for o in (framer.feed(c) for c in chunks) if o]
+    assert out == expected
+    assert framer.take_pending() == b""
+
+
+@pytest.mark.parametrize("chunks, expected, pending", [
+    ([b"a\nb\n"], [b"a", b"b"], b""),
+    ([b"a", b"b\nc"], [b"ab"], b"c"),
+    # 行尾的 \r 去掉，跨块的 \r\n 同样识别
+    ([b"a\r\nb\r", b"\n\r\n"], [b"a", b"b", b""], b""),
+    ([b"data: " + NI_HAO[:1], NI_HAO[1:] + b"\n"], [b"data: " + NI_HAO], b""),
+])
+def test_line_framer(chunks: List[bytes], expected: List[bytes], pending: bytes):
+    framer = SSELineFramer()
+    lines = [bytes(line) for c in chunks for line in framer.feed(c)]
+    assert lines == expected
+    assert framer.pending() == pending
+
+
+async def _aiter(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _relay(chunks, upstream_is_sse=None) -> List[bytes]:
+    async def run():
+        return [out async for out in relay_sse_bytes(_aiter(chunks), upstream_is_sse)]
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("chunks, upstream_is_sse, expected", [
+    # data: 前缀跨块：凑够开头再判断是否为 SSE
+    ([b"da", b"ta: x\n\n"], None, [b"data: x\n\n"]),
+    ([b"\xef\xbb\xbf", b"\n", b"ev", b"ent: e\ndata: x\n\n"], None, [b"\xef\xbb\xbf\nevent: e\ndata: x\n\n"]),
+    # 未以空行结尾的最后一个事件在结束时补齐
+    ([b"data: x\n\ndata: y"], True, [b"data: x\n\n", b"data: y\n\n"]),
+    # 非 SSE：逐行包装，不完整的行随下一块一起发出
+    ([b"hello\nwor", b"ld"], None, [b"data: hello\n\n", b"data: world\n\n"]),
+    ([b"plain text"], False, [b"data: plain text\n\n"]),
+    # 非 SSE 且多字节字符被截断：不完整的字节留到下一块
+    ([NI_HAO[:4], NI_HAO[4:]], False, [b"data: " + NI_HAO[:3] + b"\n\n", b"data: " + NI_HAO[3:] + b"\n\n"]),
+    # 只有空白的响应体不输出
+    ([b"\n", b"  "], None, []),
+])
+def test_relay_sse_bytes(chunks, upstream_is_sse, expected):
+    assert _relay(chunks, upstream_is_sse) == expected
+
+
+def test_relay_sse_text_decodes_split_utf8():
+    async def run():
+        return [out async for out in relay_sse_text(_aiter([b"data: " + NI_HAO[:2], NI_HAO[2:] + b"\n\n"]))]
+
+    assert "".join(asyncio.run(run())) == "data: 你好\n\n"
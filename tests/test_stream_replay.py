@@ -0,0 +1,110 @@
+"""
+SSE 断线续传：带 Last-Event-ID 在保留期内重连时从断点继续，流被移出（forget）或 ID 未知、已过期时按新请求处理。
+"""
+import asyncio
+import re
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api.routes import models as routes
+from app.config import get_settings
+from app.models.model import Model
+from app.services import chat, stream_replay
+from app.services.stream_replay import init_stream_replay
+
+MODEL = Model(model_id="m", name="m", endpoint="http://upstream.test/v1", api_key="k", type="chat")
+BODY = {"messages": [{"role": "user", "content": "hi"}]}
+
+
+@pytest.fixture
+def app(monkeypatch, fake_stream):
+    async def get_model(model_id):
+        return MODEL if model_id == MODEL.model_id else None
+
+    monkeypatch.setattr(routes, "aget_model_cached", get_model)
+    monkeypatch.setattr(stream_replay, "_replay", None)
+    monkeypatch.setattr(get_settings().server, "sse_disconnect_poll_seconds", 0)
+    app = FastAPI()
+    app.include_router(routes.router)
+    return app
+
+
+async def _first_chunks(fake_stream, n: int):
+    """开始一次流式生成，逐段读取前 n 段，返回 (生成, 各段输出)。"""
+    resp = await chat.stream_to_client(MODEL, {"model": "chat", "messages": BODY["messages"], "stream": True})
+    body = resp.body_iterator
+    out = []
+    for i in range(n):
+        fake_stream.send(f"data: {i}\n\n".encode())
+        out.append(await body.__anext__())
+    return resp, body, out
+
+
+async def _post(app, last_event_id: str) -> str:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        resp = await client.post(
+            "/api/v1/models/chat/m?stream=1", json=BODY, headers={"Last-Event-ID": last_event_id},
+        )
+    assert resp.status_code == 200
+    return resp.text
+
+
+def _event_id(chunk: bytes) -> str:
+    return re.search(rb"id: (\S+)", chunk).group(1).decode()
+
+
+def test_resume_within_grace_continues_from_the_last_event(app, fake_stream):
+    async def run():
+        init_stream_replay(grace_seconds=5, max_bytes=1 << 20)
+        resp, body, out = await _first_chunks(fake_stream, 2)
+        assert resp.headers["x-stream-id"] in _event_id(out[0])
+        # 客户端在第一段后断开，生成继续；之后的输出在重连时补发
+        await body.aclose()
+        fake_stream.send(b"data: 2\n\n")
+        fake_stream.close()
+        return await _post(app, _event_id(out[0]))
+
+    text = asyncio.run(run())
+    assert text.startswith("data: 1\n")
+    assert "data: 2\n" in text and "data: 0\n" not in text
+    assert fake_stream.opened == 1
+
+
+def test_resume_after_forget_starts_a_fresh_request(app, fake_stream):
+    async def run():
+        replay = init_stream_replay(grace_seconds=5, max_bytes=1 << 20)
+        resp, body, out = await _first_chunks(fake_stream, 1)
+        stream_id = resp.headers["x-stream-id"]
+        # 被淘汰：不再可续传，等待重连的生成随之取消
+        replay._remove(stream_id)
+        await body.aclose()
+        fake_stream.send(b"data: fresh\n\n")
+        fake_stream.close()
+        return await _post(app, _event_id(out[0]))
+
+    text = asyncio.run(run())
+    assert text.startswith("data: fresh\n")
+    assert fake_stream.opened == 2
+
+
+@pytest.mark.parametrize("last_event_id", ["unknown-1", "not-an-id", "expired"])
+def test_unknown_or_expired_id_starts_a_fresh_request(app, fake_stream, last_event_id):
+    async def run():
+        init_stream_replay(grace_seconds=0.05, max_bytes=1 << 20)
+        event_id = last_event_id
+        if last_event_id == "expired":
+            resp, body, out = await _first_chunks(fake_stream, 1)
+            fake_stream.close()
+            assert [chunk async for chunk in body] == []
+            event_id = _event_id(out[0])
+            await asyncio.sleep(0.1)
+        fake_stream.send(b"data: fresh\n\n")
+        fake_stream.close()
+        return await _post(app, event_id)
+
+    text = asyncio.run(run())
+    assert text.startswith("data: fresh\n")
+    assert fake_stream.opened == (2 if last_event_id == "expired" else 1)
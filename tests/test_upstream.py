@@ -0,0 +1,45 @@
+"""
+上游请求的超时：请求级的 timeout 会整体替换客户端的设置，连接超时必须随每次请求传入。
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.config import UpstreamConfig
+from app.services import upstream
+from app.services.upstream import init_upstream_clients, upstream_timeout
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    monkeypatch.setattr(upstream, "_clients", None)
+    return init_upstream_clients(UpstreamConfig(connect_timeout=2.5))
+
+
+def test_connect_timeout_comes_from_config(clients):
+    assert upstream_timeout(60) == httpx.Timeout(60, connect=2.5)
+    # 模型未设置超时时按 30 秒
+    assert upstream_timeout(0) == httpx.Timeout(30, connect=2.5)
+
+
+def test_stream_timeout_has_no_read_limit(clients):
+    timeout = upstream_timeout(60, read=False)
+    assert (timeout.connect, timeout.read, timeout.write, timeout.pool) == (2.5, None, 60, 60)
+
+
+def test_request_timeout_reaches_the_transport(clients):
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.extensions["timeout"])
+        return httpx.Response(200)
+
+    async def run():
+        client = await upstream.get_upstream_client("http://upstream.test/v1")
+        client._transport = httpx.MockTransport(handler)
+        await client.post("http://upstream.test/v1", timeout=upstream_timeout(45))
+        await upstream.close_upstream_clients()
+
+    asyncio.run(run())
+    assert seen == [{"connect": 2.5, "read": 45, "write": 45, "pool": 45}]